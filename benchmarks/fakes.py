@@ -0,0 +1,272 @@
+"""
+Local stand-ins for the services a cross-post talks to.
+
+``FakeServices`` starts three HTTP servers on 127.0.0.1 - Cobalt (which also
+serves the media files, like Instagram's CDN), Mastodon and an
+OpenAI-compatible chat endpoint - each answering after a configurable
+latency and optionally streaming bodies at a limited bandwidth.
+``StubInstagramClient`` replaces instaloader with posts defined in memory.
+"""
+
+import json
+import re
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+from instadon.instagram_cache import CachedPost
+
+CHUNK_SIZE = 64 * 1024
+
+
+def png_bytes(padding: int = 0, tag: str = "") -> bytes:
+    """A valid 8x8 PNG, followed by padding bytes (ignored by decoders) to reach a target size."""
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    rows = b"".join(b"\x00" + b"\xc8\x3c\x28" * 8 for _ in range(8))
+    image = (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", 8, 8, 8, 2, 0, 0, 0))
+             + chunk(b"IDAT", zlib.compress(rows)) + chunk(b"IEND", b""))
+    # The tag makes every file unique, so nothing is deduplicated between runs
+    return image + tag.encode("utf-8") + b"\x00" * max(0, padding - len(image) - len(tag))
+
+
+def mp4_bytes(size: int, tag: str = "") -> bytes:
+    header = b"\x00\x00\x00\x18ftypisom\x00\x00\x02\x00isomiso2" + tag.encode("utf-8")
+    return header + b"\x00" * max(0, size - len(header))
+
+
+class FakeServer:
+    """ThreadingHTTPServer that sends every request to handle(method, path, headers, body)."""
+
+    def __init__(self, name: str, handle, latency: float = 0.0, bandwidth: Optional[float] = None):
+        self.name = name
+        self.latency = latency
+        self.bandwidth = bandwidth
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _dispatch(handler, method):
+                length = int(handler.headers.get("Content-Length") or 0)
+                body = handler.rfile.read(length) if length else b""
+                time.sleep(server.latency)
+                status, headers, payload = handle(method, handler.path, handler.headers, body)
+                if isinstance(payload, (dict, list)):
+                    payload = json.dumps(payload).encode("utf-8")
+                    headers = dict({"Content-Type": "application/json"}, **headers)
+                handler.send_response(status)
+                for key, value in headers.items():
+                    handler.send_header(key, value)
+                handler.send_header("Content-Length", str(len(payload)))
+                handler.end_headers()
+                server._write(handler.wfile, payload)
+
+            def do_GET(handler):
+                handler._dispatch("GET")
+
+            def do_POST(handler):
+                handler._dispatch("POST")
+
+            def log_message(handler, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name=f"fake-{name}", daemon=True)
+
+    def _write(self, wfile, payload: bytes):
+        if not self.bandwidth:
+            wfile.write(payload)
+            return
+        for i in range(0, len(payload), CHUNK_SIZE):
+            chunk = payload[i:i + CHUNK_SIZE]
+            wfile.write(chunk)
+            time.sleep(len(chunk) / self.bandwidth)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class FakeServices:
+    """Fake Cobalt, Mastodon and OpenAI-compatible servers.
+
+    Register a post's media with ``add_post``; Cobalt then answers for it
+    with a picker (several items), tunnel (one video) or redirect (one
+    photo) response. Mastodon processes videos asynchronously for
+    ``processing_delay`` seconds (202, then 206 while polled) and answers
+    every ``rate_limit_every``-th status with 429.
+    """
+
+    def __init__(self, latency: float = 0.02, bandwidth: Optional[float] = None, processing_delay: float = 0.5,
+                 rate_limit_every: int = 0, max_media_attachments: int = 4, max_characters: int = 500):
+        self.processing_delay = processing_delay
+        self.rate_limit_every = rate_limit_every
+        self.max_media_attachments = max_media_attachments
+        self.max_characters = max_characters
+        self._lock = threading.Lock()
+        self._posts: Dict[str, Tuple[str, List[Tuple[str, int]]]] = {}
+        self._media: Dict[str, float] = {}
+        self._status_requests = 0
+        self.counts = {"cobalt": 0, "cdn_bytes": 0, "uploads": 0, "upload_bytes": 0, "statuses": 0,
+                       "rate_limited": 0, "media_polls": 0, "completions": 0}
+
+        self.cobalt = FakeServer("cobalt", self._cobalt, latency, bandwidth)
+        self.mastodon = FakeServer("mastodon", self._mastodon, latency)
+        self.openai = FakeServer("openai", self._openai, latency)
+        self.servers = [self.cobalt, self.mastodon, self.openai]
+
+    def add_post(self, shortcode: str, status: str, items: List[Tuple[str, int]]):
+        """items are (type, size) pairs, type "photo" or "video"."""
+        self._posts[shortcode] = (status, items)
+
+    def _count(self, key: str, value: int = 1):
+        with self._lock:
+            self.counts[key] += value
+
+    def _cobalt(self, method, path, headers, body):
+        match = re.match(r"/media/(\w+)/(\d+)", path)
+        if method == "GET" and match:
+            shortcode, index = match.group(1), int(match.group(2))
+            kind, size = self._posts[shortcode][1][index]
+            tag = f"{shortcode}/{index}"
+            payload = mp4_bytes(size, tag) if kind == "video" else png_bytes(size, tag)
+            self._count("cdn_bytes", len(payload))
+            content_type = "video/mp4" if kind == "video" else "image/png"
+            return 200, {"Content-Type": content_type}, payload
+
+        self._count("cobalt")
+        url = json.loads(body or b"{}").get("url", "")
+        shortcode = re.search(r"/p/([\w-]+)", url).group(1)
+        status, items = self._posts[shortcode]
+        urls = [f"{self.cobalt.url}/media/{shortcode}/{i}" for i in range(len(items))]
+        if status == "picker":
+            return 200, {}, {"status": "picker",
+                             "picker": [{"type": kind, "url": item_url} for (kind, _), item_url in zip(items, urls)]}
+        if status == "tunnel":
+            return 200, {}, {"status": "tunnel", "url": urls[0], "filename": f"{shortcode}.mp4"}
+        return 200, {}, {"status": "redirect", "url": urls[0], "filename": f"{shortcode}.jpg"}
+
+    def _mastodon(self, method, path, headers, body):
+        if path == "/api/v2/instance":
+            return 200, {}, {"configuration": {
+                "statuses": {"max_characters": self.max_characters,
+                             "max_media_attachments": self.max_media_attachments},
+                "media_attachments": {"image_size_limit": 16 * 1024 ** 2, "video_size_limit": 99 * 1024 ** 2},
+            }}
+
+        if method == "POST" and path == "/api/v2/media":
+            self._count("uploads")
+            self._count("upload_bytes", len(body))
+            with self._lock:
+                media_id = str(len(self._media) + 1)
+                video = re.search(rb'filename="[^"]*\.(mp4|mov|webm)"', body[:4096]) is not None
+                self._media[media_id] = time.monotonic() + (self.processing_delay if video else 0)
+            if video:
+                return 202, {}, {"id": media_id, "url": None}
+            return 200, {}, {"id": media_id, "url": f"{self.mastodon.url}/files/{media_id}"}
+
+        match = re.match(r"/api/v1/media/(\w+)", path)
+        if method == "GET" and match:
+            self._count("media_polls")
+            if time.monotonic() < self._media[match.group(1)]:
+                return 206, {}, {"id": match.group(1), "url": None}
+            return 200, {}, {"id": match.group(1), "url": f"{self.mastodon.url}/files/{match.group(1)}"}
+
+        if method == "POST" and path == "/api/v1/statuses":
+            with self._lock:
+                self._status_requests += 1
+                limited = self.rate_limit_every and self._status_requests % self.rate_limit_every == 0
+                if limited:
+                    self.counts["rate_limited"] += 1
+                else:
+                    self.counts["statuses"] += 1
+                status_id = str(self.counts["statuses"])
+            if limited:
+                return 429, {"Retry-After": "0", "X-RateLimit-Remaining": "0"}, {"error": "Too many requests"}
+            data = json.loads(body)
+            return 200, {}, {"id": status_id, "content": data["status"], "media_ids": data.get("media_ids", []),
+                             "in_reply_to_id": data.get("in_reply_to_id"),
+                             "url": f"{self.mastodon.url}/@bench/{status_id}"}
+
+        return 404, {}, {"error": "Record not found"}
+
+    def _openai(self, method, path, headers, body):
+        self._count("completions")
+        request = json.loads(body)
+        prompt = request["messages"][-1]["content"]
+        # Good enough for a summary: the start of the caption the prompt contains
+        content = prompt.split("\n\n")[-2][:request.get("max_tokens", 150) * 2]
+        return 200, {}, {
+            "id": "chatcmpl-bench", "object": "chat.completion", "created": int(time.time()),
+            "model": request.get("model", "bench"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4,
+                      "total_tokens": (len(prompt) + len(content)) // 4},
+        }
+
+    def start(self) -> "FakeServices":
+        for server in self.servers:
+            server.start()
+        return self
+
+    def stop(self):
+        for server in self.servers:
+            server.stop()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+class StubInstagramClient:
+    """In-memory replacement for InstagramClient; posts are added per profile."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self._posts: Dict[str, List[CachedPost]] = {}
+        self._lock = threading.Lock()
+
+    def add_post(self, profile_name: str, shortcode: str, caption: str = "", accessibility_caption: str = "",
+                 age: timedelta = timedelta(minutes=5)) -> CachedPost:
+        post = CachedPost(shortcode, caption, accessibility_caption, datetime.utcnow() - age,
+                          owner_username=profile_name)
+        with self._lock:
+            self._posts.setdefault(profile_name, []).append(post)
+        return post
+
+    def latest_post(self, profile_name: str):
+        time.sleep(self.latency)
+        posts = self._posts.get(profile_name, [])
+        return max(posts, key=lambda post: post.date_utc) if posts else None
+
+    def new_posts(self, profile_name: str, since: Optional[datetime]) -> List:
+        time.sleep(self.latency)
+        if since is None:
+            latest = self.latest_post(profile_name)
+            return [latest] if latest else []
+        since = since.replace(tzinfo=None)
+        return sorted((post for post in self._posts.get(profile_name, []) if post.date_utc > since),
+                      key=lambda post: post.date_utc)
+
+    def get_post_by_shortcode(self, shortcode: str):
+        time.sleep(self.latency)
+        return next((post for posts in self._posts.values() for post in posts if post.shortcode == shortcode), None)
+
+    def profile_full_name(self, username: str) -> Optional[str]:
+        return None
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+End-to-end pipeline benchmark against local fake services.
+
+Runs real InstaDon cross-posts (Cobalt resolve, downloads, transcode check,
+uploads, Mastodon media processing and statuses, LLM summaries) against the
+servers in ``benchmarks.fakes``, with a stub Instagram client, and reports
+latency per post and throughput for each scenario:
+
+- ``single_photo``: one photo (Cobalt redirect response)
+- ``carousel``: a 10-item carousel, posted as a thread
+- ``reel``: one large video (tunnel), processed asynchronously by Mastodon
+- ``batch``: several profiles with a 3-photo post each, through BatchRunner
+
+    python -m benchmarks.pipeline
+    python -m benchmarks.pipeline --scenario carousel --runs 5 --latency-ms 50
+    python -m benchmarks.pipeline --json after.json --compare before.json
+"""
+
+import argparse
+import json
+import logging
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from benchmarks.fakes import FakeServices, StubInstagramClient
+
+from instadon import budget, instance, media_store, metrics, resolver, transcode
+from instadon.config import CONFIG
+
+ACCOUNT = "bench@localhost"
+LONG_CAPTION = ("Heute Abend im Neubau: Lesung, Musik und Gespräche über die Stadt von morgen. " * 12).strip()
+
+
+def configure(services: FakeServices, cache_dir: str):
+    """Point instadon at the fake services and a scratch cache, and drop process-wide singletons."""
+    cache = Path(cache_dir)
+    CONFIG["mastodon"]["accounts"][ACCOUNT] = {"instance": services.mastodon.url, "access_token": "bench-token"}
+    CONFIG["cobalt"]["urls"] = [services.cobalt.url + "/"]
+    CONFIG["openrouter"].update(api_key="bench-key", base_url=services.openai.url + "/v1")
+    CONFIG["media"]["processing_poll_interval"] = 0.05
+    CONFIG["media_store"]["dir"] = str(cache / "media")
+    CONFIG["journal"]["dir"] = str(cache / "journal")
+    CONFIG["instances"]["cache_file"] = str(cache / "instances.json")
+    CONFIG["mentions"]["learned_file"] = str(cache / "learned_mention_names.json")
+    # Every run should pay for its LLM call, without waiting for the free tier's quota
+    CONFIG["llm_cache"]["enabled"] = False
+    CONFIG["llm"].update(requests_per_minute=100000, budget_file=str(cache / "llm_budget.json"))
+
+    if transcode._default_transcoder is not None:
+        transcode._default_transcoder.close()
+    budget._llm_budget = None
+    resolver._default_resolver = None
+    media_store._default_store = None
+    instance._default_cache = None
+    transcode._default_transcoder = None
+    metrics.get_metrics().reset()
+
+
+class Scenario:
+    def __init__(self, name: str, description: str, setup: Callable[[FakeServices, StubInstagramClient, str], Any],
+                 run: Callable[[Any, Any], List[Dict[str, Any]]]):
+        self.name = name
+        self.description = description
+        self.setup = setup
+        self.run = run
+
+
+def _single_post(status: str, items, caption: str = "Ein Foto aus dem Neubau"):
+    def setup(services: FakeServices, instagram: StubInstagramClient, key: str):
+        services.add_post(key, status, items)
+        instagram.add_post(f"profile{key}", key, caption, "Foto")
+        return key
+
+    def run(app, key):
+        return [app.post_specific_post(key)]
+
+    return setup, run
+
+
+def _batch(profiles: int, items):
+    def setup(services: FakeServices, instagram: StubInstagramClient, key: str):
+        jobs = []
+        for i in range(profiles):
+            shortcode = f"{key}x{i}"
+            services.add_post(shortcode, "picker", items)
+            instagram.add_post(f"profile{shortcode}", shortcode, LONG_CAPTION, "Foto")
+            jobs.append({"profile": f"profile{shortcode}", "account": ACCOUNT, "visibility": "public"})
+        return jobs
+
+    def run(runner, jobs):
+        reports = runner.run(jobs)
+        errors = [report["error"] for report in reports if report["status"] == "error"]
+        if errors:
+            raise RuntimeError(f"{len(errors)} jobs failed: {errors[0]}")
+        return [result for report in reports for result in report["results"]]
+
+    return setup, run
+
+
+def scenarios(reel_mb: float, profiles: int) -> Dict[str, Scenario]:
+    photo = ("photo", 400 * 1024)
+    return {
+        "single_photo": Scenario("single_photo", "1 photo", *_single_post("redirect", [photo])),
+        "carousel": Scenario("carousel", "10-item carousel", *_single_post("picker", [photo] * 10, LONG_CAPTION)),
+        "reel": Scenario("reel", f"{reel_mb:g} MB reel", *_single_post("tunnel", [("video", int(reel_mb * 1024 ** 2))])),
+        "batch": Scenario("batch", f"{profiles} profiles x 3 photos", *_batch(profiles, [photo] * 3)),
+    }
+
+
+def run_scenario(scenario: Scenario, runs: int, latency: float, bandwidth: Optional[float],
+                 processing_delay: float, rate_limit_every: int, workers: int,
+                 use_async: bool = False) -> Dict[str, Any]:
+    """Run scenario runs times against fresh fake services and return its measurements.
+
+    With use_async the batch scenario runs on AsyncBatchRunner.
+    """
+    from instadon.batch import BatchRunner
+    from instadon.core import InstaDon
+    if use_async:
+        from instadon.async_core import AsyncBatchRunner as BatchRunner
+
+    latencies = []
+    posts = 0
+    elapsed_total = 0.0
+    with tempfile.TemporaryDirectory(prefix="instadon-bench-") as tmp, \
+            FakeServices(latency, bandwidth, processing_delay, rate_limit_every) as services:
+        configure(services, tmp)
+        instagram = StubInstagramClient()
+
+        for run_index in range(runs):
+            key = f"{scenario.name[:3]}{run_index}"
+            data = scenario.setup(services, instagram, key)
+            tracker = str(Path(tmp) / f"posted-{key}.txt")
+            cursors = str(Path(tmp) / f"cursors-{key}.json")
+            if scenario.name == "batch":
+                target = BatchRunner(tracker_file=tracker, max_workers=workers, cursor_file=cursors)
+                target._instagram = instagram
+            else:
+                target = InstaDon(ACCOUNT, instagram=instagram, tracker_file=tracker, cursor_file=cursors)
+
+            started = time.perf_counter()
+            results = scenario.run(target, data)
+            elapsed = time.perf_counter() - started
+            if scenario.name == "batch":
+                target.close()
+
+            if any(result["status"] != "success" for result in results):
+                raise RuntimeError(f"{scenario.name}: not every post succeeded: {results}")
+            latencies.append(elapsed)
+            posts += len(results)
+            elapsed_total += elapsed
+
+        snapshot = metrics.get_metrics().snapshot()
+        counts = dict(services.counts)
+
+    stages = {}
+    for stage, entries in snapshot["spans"].items():
+        count = sum(entry["count"] for entry in entries)
+        stages[stage] = {"count": count, "mean_ms": 1000 * sum(entry["sum"] for entry in entries) / count}
+
+    return {
+        "scenario": scenario.name,
+        "description": scenario.description,
+        "runs": runs,
+        "posts": posts,
+        "p50_s": statistics.median(latencies),
+        "max_s": max(latencies),
+        "posts_per_s": posts / elapsed_total,
+        "mb_per_s": (counts["cdn_bytes"] + counts["upload_bytes"]) / 1024 ** 2 / elapsed_total,
+        "requests": counts,
+        "stages": stages,
+    }
+
+
+def print_report(results: List[Dict[str, Any]], baseline: Optional[Dict[str, Dict[str, Any]]] = None):
+    print(f"{'scenario':<14} {'description':<24} {'posts':>5} {'p50 s':>8} {'max s':>8} {'posts/s':>8} {'MB/s':>8}")
+    for result in results:
+        line = (f"{result['scenario']:<14} {result['description']:<24} {result['posts']:>5} "
+                f"{result['p50_s']:>8.3f} {result['max_s']:>8.3f} {result['posts_per_s']:>8.2f} {result['mb_per_s']:>8.1f}")
+        before = (baseline or {}).get(result["scenario"])
+        if before:
+            change = (result["p50_s"] - before["p50_s"]) / before["p50_s"] * 100
+            line += f"   p50 {change:+.1f}% vs baseline"
+        print(line)
+
+    print("\nMean stage time (ms):")
+    for result in results:
+        stages = ", ".join(f"{stage} {data['mean_ms']:.1f} (x{data['count']})"
+                           for stage, data in sorted(result["stages"].items()))
+        print(f"  {result['scenario']:<14} {stages}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the cross-post pipeline against local fake services")
+    parser.add_argument("--scenario", action="append", choices=["single_photo", "carousel", "reel", "batch"],
+                        help="Scenario to run (repeatable; default: all)")
+    parser.add_argument("--runs", type=int, default=3, help="Runs per scenario")
+    parser.add_argument("--latency-ms", type=float, default=20, help="Latency added to every fake response")
+    parser.add_argument("--bandwidth-mbps", type=float, help="Limit media downloads to this many megabit/s")
+    parser.add_argument("--processing-delay", type=float, default=0.5,
+                        help="Seconds Mastodon takes to process a video")
+    parser.add_argument("--rate-limit-every", type=int, default=0,
+                        help="Answer every n-th status request with HTTP 429")
+    parser.add_argument("--reel-mb", type=float, default=50, help="Size of the reel in MB")
+    parser.add_argument("--profiles", type=int, default=8, help="Profiles in the batch scenario")
+    parser.add_argument("--workers", type=int, default=4, help="Batch workers")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="Run the batch scenario on the asyncio engine")
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--compare", help="Results file of an earlier run to compare p50 latency against")
+    parser.add_argument("--verbose", action="store_true", help="Show instadon's log output")
+    args = parser.parse_args()
+
+    # Before instadon.mastodon/media configure logging at INFO on import
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.ERROR)
+    bandwidth = args.bandwidth_mbps * 1024 ** 2 / 8 if args.bandwidth_mbps else None
+
+    available = scenarios(args.reel_mb, args.profiles)
+    results = []
+    for name in args.scenario or list(available):
+        results.append(run_scenario(available[name], args.runs, args.latency_ms / 1000, bandwidth,
+                                    args.processing_delay, args.rate_limit_every, args.workers, args.use_async))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = {result["scenario"]: result for result in json.load(f)}
+    print_report(results, baseline)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark: `python -X importtime` report for the instadon CLI.
+
+Prints the slowest imports and the total import time of the modules the CLI
+loads before doing any work, and fails if heavy dependencies sneak back into
+the startup path or the total exceeds --max-ms.
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --max-ms 300 --top 20
+"""
+
+import argparse
+import subprocess
+import sys
+
+# Modules that must only be imported once a run actually needs them
+DEFERRED_MODULES = ["openai", "instaloader", "requests"]
+
+# What `instadon --help` and an "already posted" --url run import before any client is built
+STARTUP_CODE = "import instadon, instadon.main, instadon.core"
+
+
+def measure(code: str = STARTUP_CODE):
+    """Run code under -X importtime and return [(module, self_us, cumulative_us)]."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True, text=True, check=True,
+    )
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, module = (part.strip() for part in line[len("import time:"):].split("|"))
+        imports.append((module.strip(), int(self_us), int(cumulative_us)))
+    return imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report instadon CLI import time")
+    parser.add_argument("--top", type=int, default=15, help="Number of slowest imports to show")
+    parser.add_argument("--max-ms", type=float, help="Fail if total import time exceeds this")
+    parser.add_argument("--runs", type=int, default=3, help="Take the best of this many runs")
+    args = parser.parse_args()
+
+    runs = [measure() for _ in range(args.runs)]
+    best = min(runs, key=lambda imports: sum(self_us for _, self_us, _ in imports))
+    total_ms = sum(self_us for _, self_us, _ in best) / 1000
+
+    print(f"{'module':<50} {'self ms':>9} {'cumul ms':>9}")
+    for module, self_us, cumulative_us in sorted(best, key=lambda item: item[2], reverse=True)[:args.top]:
+        print(f"{module:<50} {self_us / 1000:>9.1f} {cumulative_us / 1000:>9.1f}")
+    print(f"\nTotal import time: {total_ms:.1f} ms ({len(best)} modules, best of {args.runs})")
+
+    failed = False
+    loaded = {module for module, _, _ in best}
+    for module in DEFERRED_MODULES:
+        if module in loaded:
+            print(f"FAIL: {module} is imported at startup", file=sys.stderr)
+            failed = True
+    if args.max_ms is not None and total_ms > args.max_ms:
+        print(f"FAIL: startup import time {total_ms:.1f} ms exceeds {args.max_ms:.1f} ms", file=sys.stderr)
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
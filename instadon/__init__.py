@@ -3,6 +3,12 @@
 __version__ = "1.0.0"
 __author__ = "Your Name"
 
-from .core import InstaDon
-
 __all__ = ["InstaDon"]
+
+
+def __getattr__(name):
+    # Imported on first access so `import instadon` (and `instadon --help`) stays fast
+    if name == "InstaDon":
+        from .core import InstaDon
+        return InstaDon
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
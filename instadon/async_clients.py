@@ -0,0 +1,287 @@
+"""
+Coroutine versions of the Cobalt, media download, Mastodon and OpenRouter
+clients, used by ``AsyncInstaDon``. They share configuration, caches, the
+media store and metrics with the blocking clients and differ only in how
+they wait for the network.
+"""
+
+import asyncio
+import importlib
+import inspect
+import logging
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple, Union
+
+from .async_http import AsyncHttpClient
+from .config import CONFIG
+from .instance import InstanceCache, InstanceCapabilities
+from .mastodon import MastodonAccount
+from .media_store import MediaStore, StoreLease, get_media_store
+from .metrics import get_metrics
+from .multipart import MultipartEncoder
+from .text_processor import (MENTIONS_BATCH_PROMPT, MENTIONS_PROMPT, PROMPT_NAMES, SUMMARIZE_PROMPT,
+                             TextProcessor)
+
+logger = logging.getLogger(__name__)
+
+
+async def _blocking(function, *args):
+    """Run blocking work (disk, the sync clients) in the event loop's default thread pool."""
+    return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+
+async def download_from_cobalt(http: AsyncHttpClient, url: str, cobalt_url: Optional[str] = None,
+                               max_retries: Optional[int] = None) -> Dict[str, Any]:
+    """Resolve an Instagram URL with the Cobalt API (the first configured endpoint unless cobalt_url is given)."""
+    cobalt_url = cobalt_url or CONFIG["cobalt"]["urls"][0]
+    logger.info(f"Requesting media from Cobalt API: {cobalt_url}")
+    with get_metrics().span("cobalt_resolve"):
+        response = await http.post(cobalt_url, json={"url": url}, max_retries=max_retries, idempotent=True,
+                                   headers={"Content-Type": "application/json", "Accept": "application/json"})
+    if response.status_code != 200:
+        logger.error(f"HTTP {response.status_code} error from Cobalt API: {response.text}")
+    response.raise_for_status()
+    return response.json()
+
+
+async def url_to_file(http: AsyncHttpClient, url: str, suffix: Optional[str] = None,
+                      store: Optional[MediaStore] = None, lease: Optional[StoreLease] = None) -> Path:
+    """Stream a file from URL into the content-addressed media store (pinned by lease, if given)."""
+    store = store or get_media_store()
+    metrics = get_metrics()
+    with metrics.span("download"):
+        async with http.stream("GET", url) as response:
+            response.raise_for_status()
+            if suffix is None:
+                content_type = response.headers.get('content-type', '')
+                if 'video' in content_type or any(ext in url.lower() for ext in ['.mp4', '.mov', '.avi']):
+                    suffix = ".mp4"
+                else:
+                    suffix = ".jpeg"
+            expected_size = int(response.headers.get('content-length') or 0) or None
+            path = await store.put_async_chunks(response.aiter_bytes(CONFIG["media"]["chunk_size"]), suffix,
+                                                expected_size, lease)
+    metrics.increment("bytes_downloaded", path.stat().st_size)
+    return path
+
+
+class AsyncMastodonClient(MastodonAccount):
+    """MastodonClient with coroutine requests; account handling and upload reuse are shared with it."""
+
+    def __init__(self, account: str, http: AsyncHttpClient, media_store: Optional[MediaStore] = None,
+                 instances: Optional[InstanceCache] = None):
+        super().__init__(account, media_store, instances)
+        self.http = http
+        self._capabilities: Optional[InstanceCapabilities] = None
+
+    async def capabilities(self) -> InstanceCapabilities:
+        """The instance's limits; fetched (rarely, it is cached on disk) by the blocking client in a thread."""
+        if self._capabilities is None:
+            from .http_client import get_http_client
+            self._capabilities = await _blocking(self.instances.capabilities, self.instance, get_http_client())
+        return self._capabilities
+
+    async def upload_media(self, file_path: str, description: str, in_use: Optional[Set[str]] = None) -> str:
+        """Upload media and return its ID; media still processing (202) are waited for when posting.
+
+        IDs in ``in_use`` are not reused; see MastodonClient.upload_media.
+        """
+        # Hashing a large video and the upload records are disk work; keep them off the event loop
+        digest = await _blocking(MediaStore.digest_of, file_path)
+        upload_key = self._upload_key(digest, description)
+        cached_id = await _blocking(self._reusable_media_id, upload_key, file_path, in_use)
+        if cached_id:
+            return cached_id
+
+        body = MultipartEncoder({'description': description}, {'file': file_path}, CONFIG["media"]["chunk_size"])
+        headers = dict(self.headers, **{"Content-Type": body.content_type})
+        metrics = get_metrics()
+        with metrics.span("upload"):
+            response = await self.http.post(f"{self.instance}/api/v2/media", headers=headers, data=body)
+            response.raise_for_status()
+        metrics.increment("bytes_uploaded", len(body))
+
+        media_id = response.json()['id']
+        await _blocking(self._uploaded, upload_key, media_id, response.status_code, in_use)
+        return media_id
+
+    async def wait_for_media(self, media_ids: List[str], timeout: Optional[float] = None):
+        """Poll until every still-processing attachment in media_ids is ready."""
+        pending = self._still_pending(media_ids)
+        if not pending:
+            return
+
+        media_config = CONFIG["media"]
+        timeout = timeout or media_config["processing_timeout"]
+        interval = media_config["processing_poll_interval"]
+        deadline = time.monotonic() + timeout
+
+        async def ready(media_id: str) -> bool:
+            response = await self.http.get(f"{self.instance}/api/v1/media/{media_id}", headers=self.headers)
+            return self._processed(media_id, response)
+
+        with get_metrics().span("media_processing"):
+            while pending:
+                done = await asyncio.gather(*(ready(media_id) for media_id in pending))
+                pending = [media_id for media_id, is_ready in zip(pending, done) if not is_ready]
+                if pending:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError(f"Media still processing after {timeout:.0f}s: {pending}")
+                    await asyncio.sleep(min(interval, remaining))
+                    interval = min(interval * 1.5, media_config["processing_max_poll_interval"])
+
+    async def create_post(self, status: str, media_ids: List[str], visibility: str = "public",
+                          in_reply_to_id: Optional[str] = None) -> Dict[str, Any]:
+        await self.wait_for_media(media_ids)
+        data = self._status_data(status, media_ids, visibility, in_reply_to_id)
+        logger.debug(f"Request data: {data}")
+
+        with get_metrics().span("post_status", reply=bool(in_reply_to_id)):
+            response = await self.http.post(f"{self.instance}/api/v1/statuses", headers=self._status_headers(),
+                                            json=data)
+        if response.status_code != 200:
+            logger.error(f"HTTP {response.status_code} error from Mastodon API: {response.text}")
+        response.raise_for_status()
+
+        await _blocking(self._posted, media_ids)
+        return response.json()
+
+    async def create_post_thread(self, status: str, media_ids: Sequence[Union[str, "asyncio.Future"]],
+                                 visibility: str = "public",
+                                 existing_posts: Optional[List[Dict[str, Any]]] = None,
+                                 on_post: Optional[Callable[[Dict[str, Any]], Any]] = None) -> List[Dict[str, Any]]:
+        """Like ``MastodonClient.create_post_thread``; media_ids may be awaitables of uploads in progress.
+
+        ``on_post`` may be a coroutine function; the next part waits for it.
+        """
+        posts = list(existing_posts or [])
+        for part in self._thread_parts(status, len(media_ids), visibility, await self.capabilities(), posts):
+            chunk = [await media_id if asyncio.isfuture(media_id) else media_id
+                     for media_id in media_ids[part.media_start:part.media_end]]
+            post = await self.create_post(part.status, chunk, part.visibility,
+                                          posts[-1]["id"] if part.reply else None)
+            posts.append(post)
+            if on_post:
+                outcome = on_post(post)
+                if inspect.isawaitable(outcome):
+                    await outcome
+        if len(posts) > 1:
+            logger.info(f"Successfully created thread with {len(posts)} posts")
+        return posts
+
+
+class AsyncTextProcessor(TextProcessor):
+    """TextProcessor whose LLM calls are coroutines on AsyncOpenAI.
+
+    Prompts, the response cache, mention resolution and fallbacks are shared
+    with TextProcessor; only the methods that wait for the API are
+    coroutines here.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._async_client = None
+        # Created on first use, inside the event loop
+        self._async_slots: Optional[asyncio.Semaphore] = None
+
+    async def get_async_client(self):
+        if self._async_client is None:
+            # Importing openai takes a good part of a second; keep it off the event loop
+            openai = await _blocking(importlib.import_module, "openai")
+            # Checked again: other coroutines may have waited for the same import
+            if self._async_client is None:
+                self._async_client = openai.AsyncOpenAI(
+                    api_key=CONFIG["openrouter"]["api_key"],
+                    base_url=CONFIG["openrouter"]["base_url"]
+                )
+        return self._async_client
+
+    async def aclose(self):
+        """Close the API client; the next call creates one on the running event loop."""
+        if self._async_client is not None:
+            await self._async_client.close()
+        self._async_client = None
+        self._async_slots = None
+
+    async def summarize_if_needed(self, text: str, max_chars: Optional[int] = None) -> str:
+        if not text:
+            return text
+        max_chars = max_chars or self.max_chars
+        if self._needs_summary(text, max_chars):
+            return await self._summarize_text(text, max_chars)
+        return await self._process_mentions_only(text)
+
+    async def process_many(self, texts: List[str], max_chars: Optional[int] = None) -> List[str]:
+        """Like TextProcessor.process_many, with the summaries and packs as concurrent coroutines."""
+        max_chars = max_chars or self.max_chars
+        results, summaries, packs = await _blocking(self._plan_many, texts, max_chars)
+        summarized = await asyncio.gather(*(self._summarize_text(texts[i], max_chars) for i in summaries),
+                                          *(self._process_mentions_pack(pack) for pack in packs))
+        for i, summary in zip(summaries, summarized):
+            results[i] = summary
+        for answers in summarized[len(summaries):]:
+            for i, text in answers.items():
+                results[i] = text
+        return results
+
+    async def _complete(self, template: str, text: str, max_tokens: int, temperature: float,
+                        allow_truncation: bool = True, use_cache: bool = True, **fields) -> str:
+        key = self._cache_key(template, text, max_tokens, temperature, **fields) if use_cache else None
+        cached = await _blocking(self._cached, key)
+        if cached is not None:
+            return cached
+
+        while True:
+            wait = await _blocking(self.budget.try_acquire)
+            if wait <= 0:
+                break
+            logger.info(f"LLM request budget exhausted, waiting {wait:.0f}s")
+            await asyncio.sleep(wait)
+        if self._async_slots is None:
+            self._async_slots = asyncio.Semaphore(self.concurrency)
+        try:
+            async with self._async_slots:
+                with get_metrics().span("llm", prompt=PROMPT_NAMES.get(template, "other")):
+                    client = await self.get_async_client()
+                    response = await client.chat.completions.create(
+                        **self._completion_args(template, text, max_tokens, temperature, **fields))
+        except Exception as e:
+            await _blocking(self._completion_failed, e)
+            raise
+        return await _blocking(self._completion_content, response, key, max_tokens, allow_truncation)
+
+    async def _process_mentions_pack(self, pack: List[Tuple[int, str]]) -> Dict[int, str]:
+        if len(pack) == 1:
+            i, text = pack[0]
+            return {i: await self._process_mentions_only(text)}
+
+        payload = self._pack_payload(pack)
+        try:
+            content = await self._complete(MENTIONS_BATCH_PROMPT, payload, **self._pack_args(payload))
+        except Exception as e:
+            return self._pack_fallback(pack, e)
+
+        results, missing = await _blocking(self._read_pack, pack, content)
+        answers = await asyncio.gather(*(self._process_mentions_only(text) for _, text in missing))
+        for (i, _), text in zip(missing, answers):
+            results[i] = text
+        return results
+
+    async def _summarize_text(self, text: str, max_chars: int) -> str:
+        text, _ = self.mentions.replace_known(text)
+        try:
+            summary = await self._complete(SUMMARIZE_PROMPT, text, **self._summary_args(max_chars))
+        except Exception as e:
+            return self._summary_fallback(text, max_chars, e)
+        return self._fit_summary(text, summary, max_chars)
+
+    async def _process_mentions_only(self, text: str) -> str:
+        text, unresolved = self._replace_known_mentions(text)
+        if not unresolved:
+            return text
+        try:
+            return await self._complete(MENTIONS_PROMPT, text, **self._mentions_args(text))
+        except Exception as e:
+            return self._mentions_fallback(text, e)
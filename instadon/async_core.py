@@ -0,0 +1,320 @@
+"""
+Asyncio engine: many posts and accounts progressing on one event loop.
+
+``AsyncInstaDon`` runs the same stages as ``InstaDon`` (Cobalt, downloads,
+transcoding, uploads, LLM, thread posting, journals and tracking) with
+httpx and AsyncOpenAI, so a slow call only holds up the post waiting for
+it. The bookkeeping between the stages is shared with ``InstaDon``
+(``core.InstaDonBase``). instaloader, the transcoder and everything that
+reads or writes the disk (tracker, cursors, journals, caches) run in a
+thread pool. ``AsyncBatchRunner.run`` is the synchronous entry point used by
+``instadon batch --async``.
+
+Requires ``pip install instadon[async]``.
+"""
+
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Dict, List, Optional, Union
+
+from .async_clients import (AsyncMastodonClient, AsyncTextProcessor, download_from_cobalt,
+                            url_to_file)
+from .async_http import AsyncHttpClient
+from .batch import BatchRunner, job_accounts
+from .config import CONFIG
+from .core import InstaDonBase
+from .cursor import CursorStore
+from .media import cobalt_media_items
+from .media_store import get_media_store
+from .metrics import get_metrics
+from .post_tracker import PostTracker
+from .resolver import get_media_resolver
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncInstaDon(InstaDonBase):
+    """InstaDon's stages as coroutines; the bookkeeping between them is InstaDonBase's, run in the executor."""
+
+    def __init__(self, mastodon_account: str, instagram, http: AsyncHttpClient,
+                 text_processor: AsyncTextProcessor, mastodon_clients: Dict[str, AsyncMastodonClient],
+                 post_tracker: PostTracker, cursors: CursorStore, executor: ThreadPoolExecutor,
+                 extra_accounts: Optional[List[str]] = None):
+        super().__init__(mastodon_account, post_tracker, cursors, extra_accounts)
+        self.instagram = instagram
+        self.http = http
+        self.text_processor = text_processor
+        self._mastodon_clients = mastodon_clients
+        self.executor = executor
+
+    def mastodon_for(self, account: str) -> AsyncMastodonClient:
+        if account not in self._mastodon_clients:
+            self._mastodon_clients[account] = AsyncMastodonClient(account, self.http)
+        return self._mastodon_clients[account]
+
+    async def _blocking(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    async def post_new_from_profile(self, profile_name: str, visibility: str = "public") -> List[dict]:
+        """Cross-post every post published since the last run, oldest first (see InstaDon)."""
+        cursor_key = self._cursor_key(profile_name)
+        cursor = await self._blocking(self.cursors.get, cursor_key)
+        with get_metrics().span("instagram_fetch"):
+            new_posts = await self._blocking(self.instagram.new_posts, profile_name, cursor)
+        logger.info(f"Found {len(new_posts)} new posts for {profile_name}")
+
+        # Captions are processed together while the first posts' media are transferred; posts already
+        # on every account are left out
+        unposted = await self._blocking(self._unposted, new_posts) if len(new_posts) > 1 else []
+        texts = asyncio.ensure_future(self._process_texts(unposted)) if unposted else None
+        batched = {post.shortcode for post in unposted}
+        results = []
+        try:
+            for post in new_posts:
+                text = None
+                if post.shortcode in batched:
+                    text = asyncio.ensure_future(self._text_at(texts, post.shortcode))
+                results.append(await self._process_instagram_post(post, visibility, text))
+                await self._blocking(self.cursors.advance, cursor_key, post.date_utc, post.shortcode)
+        finally:
+            if texts and not texts.done():
+                texts.cancel()
+        return results
+
+    async def post_specific_post(self, instagram_url_or_shortcode: str, visibility: str = "public"):
+        shortcode = self._shortcode(instagram_url_or_shortcode)
+        if await self._blocking(self._posted_everywhere, shortcode):
+            return self._already_posted_result(shortcode)
+
+        with get_metrics().span("instagram_fetch"):
+            post = await self._blocking(self.instagram.get_post_by_shortcode, shortcode)
+        if not post:
+            raise ValueError(f"Could not find Instagram post: {instagram_url_or_shortcode}")
+        return await self._process_instagram_post(post, visibility)
+
+    async def _process_instagram_post(self, instagram_post, visibility: str = "public",
+                                      text: Optional[asyncio.Future] = None):
+        """Cross-post to every account; errors are raised as InstaDon._process_instagram_post does."""
+        shortcode = instagram_post.shortcode
+        logger.info(f"Processing post: {shortcode}")
+        return self._combine(shortcode, await self._cross_post(instagram_post, visibility, text))
+
+    async def _cross_post(self, instagram_post, visibility: str,
+                          text: Optional[asyncio.Future] = None) -> Dict[str, Any]:
+        shortcode = instagram_post.shortcode
+        pending, results = await self._blocking(self._pending, shortcode)
+        if not pending:
+            if text:
+                text.cancel()
+            return results
+
+        journals = await self._blocking(self.journals.open_post, shortcode, pending)
+        # Expired journaled or cached media URLs are resolved again, as InstaDon._cross_post does
+        for refresh in (False, True):
+            try:
+                media_items = await self._media_items(instagram_post, journals, refresh)
+            except Exception as e:
+                logger.error(f"Failed to process post {shortcode}: {e}")
+                if text:
+                    text.cancel()
+                return dict(results, **{account: e for account in pending})
+
+            text = await self._text_for(instagram_post, journals, pending, text)
+            results.update(await self._publish_all(instagram_post, pending, journals, media_items, visibility, text))
+            retry = None if refresh else await self._blocking(self._retry_expired, shortcode, pending, results,
+                                                              journals)
+            if retry is None:
+                break
+            pending, journals = retry
+
+        if not text.done():
+            text.cancel()
+        return results
+
+    async def _media_items(self, instagram_post, journals, refresh: bool = False):
+        media_items = [] if refresh else journals.media_items()
+        if not media_items:
+            fetch = partial(download_from_cobalt, self.http)
+            cobalt_result = await get_media_resolver().resolve_async(instagram_post, fetch, refresh=refresh)
+            media_items = cobalt_media_items(cobalt_result)
+        return await self._blocking(self._record_media_items, journals, media_items)
+
+    async def _text_for(self, instagram_post, journals, pending: List[str],
+                        text: Optional[asyncio.Future]) -> asyncio.Future:
+        processed_text = journals.text()
+        if processed_text is not None:
+            if text:
+                text.cancel()
+            text = asyncio.get_running_loop().create_future()
+            text.set_result(processed_text)
+        elif text is None:
+            max_chars = await self._max_characters(pending)
+            text = asyncio.ensure_future(self._process_text(instagram_post.caption or "", max_chars))
+        return text
+
+    async def _publish_all(self, instagram_post, pending: List[str], journals, media_items, visibility: str,
+                           text: asyncio.Future) -> Dict[str, Any]:
+        shortcode = instagram_post.shortcode
+        # Every item is downloaded once, by whichever account asks first
+        downloads: Dict[int, asyncio.Task] = {}
+
+        def download(index: int) -> asyncio.Task:
+            if index not in downloads:
+                url, suffix = media_items[index]
+                downloads[index] = asyncio.ensure_future(url_to_file(self.http, url, suffix, lease=lease))
+            return downloads[index]
+
+        # The post's files stay in the media store until every account has uploaded them
+        with get_media_store().lease() as lease:
+            outcomes = await asyncio.gather(*(
+                self._publish(account, journals[account], shortcode, media_items, download,
+                              instagram_post.accessibility_caption, text, visibility, lease)
+                for account in pending
+            ), return_exceptions=True)
+            # Nothing is left running behind a failed account
+            await asyncio.gather(*downloads.values(), return_exceptions=True)
+
+        results = {}
+        for account, outcome in zip(pending, outcomes):
+            if isinstance(outcome, Exception):
+                logger.error(f"Failed to process post {shortcode} for {account}: {outcome}")
+            results[account] = outcome
+        return results
+
+    async def _publish(self, account: str, journal, shortcode: str, media_items, download, description: str,
+                       text: asyncio.Future, visibility: str, lease=None) -> dict:
+        mastodon = self.mastodon_for(account)
+        uploaded_ids, in_use = await self._blocking(self._uploaded_ids, mastodon, journal, len(media_items))
+
+        # Built on first use (tool probes, process pool)
+        transcoder = await self._blocking(self._transcoder)
+        if transcoder is not None:
+            limits = (await mastodon.capabilities()).media_limits
+
+        async def upload(index: int) -> str:
+            if uploaded_ids[index]:
+                return uploaded_ids[index]
+            path = await download(index)
+            await self._blocking(journal.record_item, "files", index, str(path), len(media_items))
+            if transcoder is not None:
+                path = await self._blocking(transcoder.prepare, path, limits, lease)
+            media_id = await mastodon.upload_media(str(path), description, in_use)
+            await self._blocking(journal.record_item, "media_ids", index, media_id, len(media_items))
+            return media_id
+
+        # Every item uploads as soon as it is downloaded; each thread part waits only for its own
+        uploads = [asyncio.ensure_future(upload(i)) for i in range(len(media_items))]
+        try:
+            processed_text = await asyncio.shield(text)
+            if journal.get("text") is None:
+                await self._blocking(journal.record, "text", processed_text)
+            posts = await mastodon.create_post_thread(
+                processed_text, uploads, visibility,
+                existing_posts=journal.get("posts"),
+                on_post=lambda post: self._blocking(journal.append, "posts", post)
+            )
+        finally:
+            await asyncio.gather(*uploads, return_exceptions=True)
+
+        return await self._blocking(self._published, account, journal, shortcode, posts)
+
+    async def _max_characters(self, accounts: List[str]) -> int:
+        capabilities = await asyncio.gather(*(self.mastodon_for(account).capabilities() for account in accounts))
+        return min(capability.max_characters for capability in capabilities)
+
+    async def _process_text(self, text: str, max_chars: int) -> str:
+        await self._blocking(self._learn_mentions, text)
+        return await self.text_processor.summarize_if_needed(text, max_chars)
+
+    async def _process_texts(self, posts: List) -> Dict[str, str]:
+        """Process the captions of posts with one batched call; returns the texts by shortcode."""
+        captions = [post.caption or "" for post in posts]
+        for caption in captions:
+            await self._blocking(self._learn_mentions, caption)
+        texts = await self.text_processor.process_many(captions, await self._max_characters(self.accounts))
+        return {post.shortcode: text for post, text in zip(posts, texts)}
+
+    @staticmethod
+    async def _text_at(texts: asyncio.Future, shortcode: str) -> str:
+        return (await asyncio.shield(texts))[shortcode]
+
+
+class AsyncBatchRunner(BatchRunner):
+    """BatchRunner whose jobs all run concurrently on one event loop.
+
+    Instagram, trackers and cursors are shared as in BatchRunner; the HTTP
+    client, Mastodon clients and text processor are the async ones.
+    ``max_workers`` bounds how many jobs are in progress at once.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.http: Optional[AsyncHttpClient] = None
+        self.executor = ThreadPoolExecutor(max_workers=CONFIG["async"]["executor_workers"],
+                                           thread_name_prefix="instadon-async")
+
+    @property
+    def text_processor(self) -> AsyncTextProcessor:
+        with self._lock:
+            if self._text_processor is None:
+                self._text_processor = AsyncTextProcessor()
+            return self._text_processor
+
+    def app_for(self, account: Union[str, List[str]], tracker_file: Optional[str] = None) -> AsyncInstaDon:
+        accounts = [account] if isinstance(account, str) else list(account)
+        # Jobs build their apps concurrently in the executor
+        with self._lock:
+            for name in accounts:
+                if name not in self._mastodon_clients:
+                    self._mastodon_clients[name] = AsyncMastodonClient(name, self.http)
+        return AsyncInstaDon(
+            mastodon_account=accounts[0],
+            extra_accounts=accounts[1:],
+            instagram=self.instagram,
+            http=self.http,
+            text_processor=self.text_processor,
+            mastodon_clients={name: self._mastodon_clients[name] for name in accounts},
+            post_tracker=self._tracker(tracker_file or self.tracker_file),
+            cursors=self.cursors,
+            executor=self.executor,
+        )
+
+    async def run_job_async(self, job: Dict[str, Any], slots: asyncio.Semaphore) -> Dict[str, Any]:
+        async with slots:
+            started = time.perf_counter()
+            report = {"job": job}
+            try:
+                # Loading the Instagram session and opening trackers are disk work; kept off the event loop
+                app = await asyncio.get_running_loop().run_in_executor(self.executor, self.app_for, job["account"],
+                                                                       job.get("tracker"))
+                results = await app.post_new_from_profile(job["profile"], job["visibility"])
+                posted = any(result["status"] == "success" for result in results)
+                report.update(status="success" if posted else "skipped", results=results)
+            except Exception as e:
+                logger.error(f"Batch job {job['profile']} -> {job_accounts(job)} failed: {e}")
+                report.update(status="error", error=str(e))
+            report["elapsed"] = time.perf_counter() - started
+            return report
+
+    async def run_async(self, jobs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        logger.info(f"Running {len(jobs)} batch jobs on one event loop, {self.max_workers} at a time")
+        # Clients bound to this event loop
+        self.http = AsyncHttpClient()
+        self._mastodon_clients = {}
+        try:
+            slots = asyncio.Semaphore(self.max_workers)
+            return list(await asyncio.gather(*(self.run_job_async(job, slots) for job in jobs)))
+        finally:
+            await self.http.aclose()
+            await self.text_processor.aclose()
+
+    def run(self, jobs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Run all jobs and return reports in job order (blocking, like BatchRunner.run)."""
+        return asyncio.run(self.run_async(jobs))
+
+    def close(self):
+        super().close()
+        self.executor.shutdown(wait=True)
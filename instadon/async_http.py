@@ -0,0 +1,129 @@
+"""
+HTTP layer of the asyncio engine, on httpx (``pip install instadon[async]``).
+
+Mirrors ``HttpClient``: one connection pool for all hosts, the same retry
+policy for connection errors, 429 and 5xx, and responses returned as-is so
+callers use ``raise_for_status()``. In addition every host gets a limit of
+requests in flight, so many posts progressing on one event loop don't flood
+a single Mastodon instance or Cobalt server.
+"""
+
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Iterable, Optional
+from urllib.parse import urlparse
+
+import httpx
+
+from .config import CONFIG
+from .http_client import RetryPolicy
+from .metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+
+async def _stream_body(body: Iterable[bytes]) -> AsyncIterator[bytes]:
+    # Streaming bodies such as MultipartEncoder read their file a chunk at a time, in a thread
+    loop = asyncio.get_running_loop()
+    chunks = iter(body)
+    while True:
+        chunk = await loop.run_in_executor(None, next, chunks, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+class AsyncHttpClient(RetryPolicy):
+    def __init__(self, connect_timeout: Optional[float] = None, read_timeout: Optional[float] = None,
+                 max_retries: Optional[int] = None, backoff_factor: Optional[float] = None,
+                 max_backoff: Optional[float] = None, per_host_limit: Optional[int] = None,
+                 host_limits: Optional[Dict[str, int]] = None):
+        super().__init__(max_retries, backoff_factor, max_backoff)
+        http_config = CONFIG["http"]
+        async_config = CONFIG["async"]
+        self.per_host_limit = per_host_limit or async_config["per_host_limit"]
+        self.host_limits = dict(async_config["host_limits"], **(host_limits or {}))
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read_timeout or http_config["read_timeout"],
+                                  connect=connect_timeout or http_config["connect_timeout"]),
+            limits=httpx.Limits(max_connections=async_config["max_connections"],
+                                max_keepalive_connections=http_config["pool_maxsize"]),
+            follow_redirects=True,
+        )
+        self._slots: Dict[str, asyncio.Semaphore] = {}
+
+    def _slot(self, url: str) -> asyncio.Semaphore:
+        # Keyed by host and port: services sharing a host on different ports are limited separately
+        parsed = urlparse(url)
+        if parsed.netloc not in self._slots:
+            limit = self.host_limits.get(parsed.netloc, self.host_limits.get(parsed.hostname, self.per_host_limit))
+            self._slots[parsed.netloc] = asyncio.Semaphore(limit)
+        return self._slots[parsed.netloc]
+
+    async def _send(self, method: str, url: str, stream: bool, max_retries: Optional[int] = None,
+                    idempotent: Optional[bool] = None, **kwargs) -> httpx.Response:
+        """Send with retries; the returned response is open (unread) when stream is set.
+
+        Requests that aren't idempotent are only retried if they can't have
+        reached the server, as in HttpClient.request.
+        """
+        max_retries = self.max_retries if max_retries is None else max_retries
+        idempotent = self._idempotent(method, kwargs.get("headers"), idempotent)
+        body = kwargs.pop("data", None)
+        if isinstance(body, dict):
+            kwargs["data"] = body
+            body = None
+
+        for attempt in range(max_retries + 1):
+            if body is not None:
+                kwargs["content"] = _stream_body(body) if hasattr(body, "reset") else body
+                if hasattr(body, "__len__"):
+                    kwargs["headers"] = dict(kwargs.get("headers") or {}, **{"Content-Length": str(len(body))})
+            request = self.client.build_request(method, url, **kwargs)
+            try:
+                response = await self.client.send(request, stream=stream)
+            except (httpx.ConnectError, httpx.TimeoutException, httpx.RemoteProtocolError) as e:
+                # Nothing was sent if no connection could be made (or none was free in the pool)
+                unsent = isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout))
+                if attempt >= max_retries or not (idempotent or unsent):
+                    raise
+                delay = self._backoff(attempt)
+                get_metrics().increment("http_retries", host=urlparse(url).hostname, reason=type(e).__name__)
+                logger.warning(f"{method} {url} failed ({e}); retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+
+            if not self._retry_status(response.status_code, idempotent) or attempt >= max_retries:
+                return response
+
+            delay = self._retry_delay(response, attempt)
+            get_metrics().increment("http_retries", host=urlparse(url).hostname, reason=response.status_code)
+            logger.warning(f"{method} {url} returned HTTP {response.status_code}; retrying in {delay:.1f}s")
+            await response.aclose()
+            await asyncio.sleep(delay)
+
+        return response
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        async with self._slot(url):
+            return await self._send(method, url, stream=False, **kwargs)
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, **kwargs) -> AsyncIterator[httpx.Response]:
+        """Response whose body is read while the host's slot is held (e.g. a media download)."""
+        async with self._slot(url):
+            response = await self._send(method, url, stream=True, **kwargs)
+            try:
+                yield response
+            finally:
+                await response.aclose()
+
+    async def aclose(self):
+        await self.client.aclose()
@@ -0,0 +1,158 @@
+"""
+Cross-post a profile's back catalogue.
+
+Posts are streamed from Instagram newest first by a producer thread, checked
+against the tracker a page at a time, and handed to the posting loop through
+a bounded queue, so fetching stays only a little ahead of posting. Posting
+is paced by a posts-per-hour budget. After every post the Instagram
+iterator's position is saved to a checkpoint, from which an interrupted run
+resumes without paging through the profile again.
+"""
+
+import json
+import logging
+import os
+import queue
+import tempfile
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from .budget import RequestBudget
+from .config import CONFIG
+from .core import InstaDon
+
+logger = logging.getLogger(__name__)
+
+# Shortcodes checked against the tracker at once (one page of Instagram's feed)
+FILTER_CHUNK = 12
+# Seconds to wait for the producer when the run ends; after an interrupt it may be stuck in an Instagram request
+PRODUCER_JOIN_TIMEOUT = 5
+
+_DONE = object()
+
+
+class Backfill:
+    def __init__(self, app: InstaDon, profile_name: str, since: datetime, visibility: str = "public",
+                 posts_per_hour: Optional[float] = None, queue_size: Optional[int] = None,
+                 checkpoint_file: Optional[str] = None):
+        backfill_config = CONFIG["backfill"]
+        self.app = app
+        self.profile_name = profile_name
+        # Naive dates are UTC, like instaloader's
+        self.since = since if since.tzinfo else since.replace(tzinfo=timezone.utc)
+        self.visibility = visibility
+        self.pacing = RequestBudget(rate_per_hour=posts_per_hour or backfill_config["posts_per_hour"], burst=1,
+                                    name="Backfill")
+        self.queue: "queue.Queue" = queue.Queue(maxsize=queue_size or backfill_config["queue_size"])
+        self.checkpoint_file = Path(checkpoint_file or
+                                    Path(backfill_config["checkpoint_dir"]) / f"{profile_name}.json")
+        self._stop = threading.Event()
+        self._error: Optional[BaseException] = None
+
+    def _load_checkpoint(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.checkpoint_file, 'r') as f:
+                checkpoint = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable backfill checkpoint {self.checkpoint_file}: {e}")
+            return None
+        if checkpoint.get("accounts") != self.app.accounts or checkpoint.get("since") != self.since.isoformat():
+            logger.warning(f"Ignoring backfill checkpoint {self.checkpoint_file}: it is for other accounts or dates")
+            return None
+        return checkpoint
+
+    def _save_checkpoint(self, state: Dict[str, Any], report: Dict[str, Any]):
+        checkpoint = {"profile": self.profile_name, "accounts": self.app.accounts, "since": self.since.isoformat(),
+                      "iterator": state, "posted": report["posted"], "failed": report["failed"]}
+        self.checkpoint_file.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=self.checkpoint_file.parent, suffix=".tmp")
+        with os.fdopen(fd, 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_name, self.checkpoint_file)
+
+    def _put(self, item) -> bool:
+        """Queue item, waiting for room; False if the run was stopped meanwhile."""
+        while not self._stop.is_set():
+            try:
+                self.queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _enqueue_pending(self, chunk: List) -> bool:
+        """Queue the posts of chunk that some account still lacks."""
+        shortcodes = [post.shortcode for post, _ in chunk]
+        posted = [self.app.post_tracker.is_already_posted_many(shortcodes, account) for account in self.app.accounts]
+        for post, state in chunk:
+            if all(post.shortcode in done for done in posted):
+                logger.debug(f"Backfill: {post.shortcode} already posted")
+                continue
+            if not self._put((post, state)):
+                return False
+        return True
+
+    def _produce(self, resume: Optional[Dict[str, Any]]):
+        try:
+            chunk = []
+            for item in self.app.instagram.iter_posts(self.profile_name, self.since, resume):
+                chunk.append(item)
+                if len(chunk) >= FILTER_CHUNK:
+                    if not self._enqueue_pending(chunk):
+                        return
+                    chunk = []
+            self._enqueue_pending(chunk)
+        except BaseException as e:
+            self._error = e
+        finally:
+            self._put(_DONE)
+
+    def run(self) -> Dict[str, Any]:
+        """Post everything since the start date that isn't posted yet; returns counts and failed shortcodes."""
+        checkpoint = self._load_checkpoint()
+        report: Dict[str, Any] = {"posted": 0, "failed": [], "results": []}
+        if checkpoint:
+            report.update(posted=checkpoint["posted"], failed=checkpoint["failed"])
+            logger.info(f"Resuming backfill of {self.profile_name} after {checkpoint['posted']} posts")
+        cursor_key = self.app._cursor_key(self.profile_name)
+
+        producer = threading.Thread(target=self._produce, args=(checkpoint and checkpoint["iterator"],),
+                                    name="instadon-backfill", daemon=True)
+        producer.start()
+        try:
+            while True:
+                item = self.queue.get()
+                if item is _DONE:
+                    break
+                post, state = item
+                self.pacing.acquire()
+                try:
+                    result = self.app._process_instagram_post(post, self.visibility)
+                    report["results"].append(result)
+                    # Posts another run already published to every account are reported as skipped
+                    if result["status"] == "success":
+                        report["posted"] += 1
+                    self.app.cursors.advance(cursor_key, post.date_utc, post.shortcode)
+                except Exception as e:
+                    # Not tracked, so a later run (or `instadon --url`) can retry it
+                    logger.error(f"Backfill of {post.shortcode} failed: {e}")
+                    report["failed"].append(post.shortcode)
+                self._save_checkpoint(state, report)
+        finally:
+            self._stop.set()
+            # A daemon thread, so one that doesn't finish in time doesn't keep the process alive
+            producer.join(PRODUCER_JOIN_TIMEOUT)
+            if producer.is_alive():
+                logger.warning("Backfill: gave up waiting for the Instagram fetch to stop")
+
+        if self._error is not None:
+            # The checkpoint is kept, so running again continues from the last handled post
+            raise self._error
+        self.checkpoint_file.unlink(missing_ok=True)
+        logger.info(f"Backfill of {self.profile_name} finished: {report['posted']} posted, "
+                    f"{len(report['failed'])} failed")
+        return report
@@ -0,0 +1,168 @@
+"""
+Run many (profile, account, visibility) cross-post jobs in one process.
+
+All jobs share one Instagram session, one text processor and one Mastodon
+client per account, so the startup cost is paid once per batch instead of
+once per profile.
+"""
+
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Union
+
+from .core import InstaDon
+from .cursor import CursorStore
+from .instagram import InstagramClient
+from .mastodon import MastodonClient
+from .post_tracker import PostTracker
+from .text_processor import TextProcessor
+
+logger = logging.getLogger(__name__)
+
+VISIBILITIES = ["public", "unlisted", "private", "direct"]
+
+
+def load_manifest(manifest_file: str) -> Dict[str, Any]:
+    """Load a batch manifest.
+
+    The manifest is a JSON file, either a list of jobs or an object with a
+    ``jobs`` list plus optional defaults (``session``, ``tracker``,
+    ``tracker_backend``, ``cursor_file``, ``workers``). Each job needs ``profile`` and
+    ``account``, which may be a list to fan one profile out to several
+    accounts; ``visibility`` and ``tracker`` are optional.
+    """
+    with open(manifest_file, 'r') as f:
+        manifest = json.load(f)
+
+    if isinstance(manifest, list):
+        manifest = {"jobs": manifest}
+
+    jobs = manifest.get("jobs")
+    if not isinstance(jobs, list) or not jobs:
+        raise ValueError(f"Manifest {manifest_file} contains no jobs")
+
+    for i, job in enumerate(jobs):
+        missing = [key for key in ("profile", "account") if not job.get(key)]
+        if missing:
+            raise ValueError(f"Job {i + 1} in {manifest_file} is missing: {', '.join(missing)}")
+        job.setdefault("visibility", "public")
+        if job["visibility"] not in VISIBILITIES:
+            raise ValueError(f"Job {i + 1} has invalid visibility '{job['visibility']}'")
+
+    return manifest
+
+
+def job_accounts(job: Dict[str, Any]) -> str:
+    """Human-readable account(s) of a job."""
+    account = job["account"]
+    return account if isinstance(account, str) else ", ".join(account)
+
+
+class BatchRunner:
+    def __init__(self, session_file: str = "kommen", tracker_file: str = "posted_instagram_ids.txt",
+                 tracker_backend: Optional[str] = None, max_workers: int = 4,
+                 cursor_file: str = "instadon_cursors.json"):
+        self.session_file = session_file
+        self.tracker_file = tracker_file
+        self.tracker_backend = tracker_backend
+        self.max_workers = max_workers
+        # One store for all jobs; separate instances would overwrite each other's cursors
+        self.cursors = CursorStore(cursor_file)
+
+        self._lock = threading.Lock()
+        self._instagram: Optional[InstagramClient] = None
+        self._text_processor: Optional[TextProcessor] = None
+        self._mastodon_clients: Dict[str, MastodonClient] = {}
+        self._trackers: Dict[str, PostTracker] = {}
+
+    @property
+    def instagram(self) -> InstagramClient:
+        with self._lock:
+            if self._instagram is None:
+                self._instagram = InstagramClient(self.session_file)
+            return self._instagram
+
+    @property
+    def text_processor(self) -> TextProcessor:
+        with self._lock:
+            if self._text_processor is None:
+                self._text_processor = TextProcessor()
+            return self._text_processor
+
+    def _mastodon_client(self, account: str) -> MastodonClient:
+        with self._lock:
+            if account not in self._mastodon_clients:
+                self._mastodon_clients[account] = MastodonClient(account)
+            return self._mastodon_clients[account]
+
+    def _tracker(self, tracker_file: str) -> PostTracker:
+        with self._lock:
+            if tracker_file not in self._trackers:
+                self._trackers[tracker_file] = PostTracker(tracker_file, self.tracker_backend)
+            return self._trackers[tracker_file]
+
+    def app_for(self, account: Union[str, List[str]], tracker_file: Optional[str] = None) -> InstaDon:
+        """Build an InstaDon for one account (or a fan-out list) that reuses the shared clients."""
+        accounts = [account] if isinstance(account, str) else list(account)
+        return InstaDon(
+            mastodon_account=accounts[0],
+            extra_accounts=accounts[1:],
+            instagram=self.instagram,
+            mastodon_clients={name: self._mastodon_client(name) for name in accounts},
+            text_processor=self.text_processor,
+            post_tracker=self._tracker(tracker_file or self.tracker_file),
+            cursors=self.cursors,
+        )
+
+    def run_job(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        started = time.perf_counter()
+        report = {"job": job}
+        try:
+            app = self.app_for(job["account"], job.get("tracker"))
+            results = app.post_new_from_profile(job["profile"], job["visibility"])
+            posted = any(result["status"] == "success" for result in results)
+            report.update(status="success" if posted else "skipped", results=results)
+        except Exception as e:
+            logger.error(f"Batch job {job['profile']} -> {job_accounts(job)} failed: {e}")
+            report.update(status="error", error=str(e))
+        report["elapsed"] = time.perf_counter() - started
+        return report
+
+    def run(self, jobs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Run all jobs on a bounded worker pool and return reports in job order."""
+        logger.info(f"Running {len(jobs)} batch jobs with {self.max_workers} workers")
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="instadon-batch") as pool:
+            return list(pool.map(self.run_job, jobs))
+
+    def close(self):
+        for tracker in self._trackers.values():
+            tracker.close()
+
+
+def run_manifest(manifest_file: str, session_file: Optional[str] = None, tracker_file: Optional[str] = None,
+                 tracker_backend: Optional[str] = None, max_workers: Optional[int] = None,
+                 cursor_file: Optional[str] = None, use_async: bool = False) -> List[Dict[str, Any]]:
+    """Load a manifest and run it. Command line values override manifest defaults.
+
+    With use_async the jobs run on one event loop (AsyncBatchRunner) instead of a thread pool.
+    """
+    manifest = load_manifest(manifest_file)
+    if use_async:
+        from .async_core import AsyncBatchRunner
+        runner_class = AsyncBatchRunner
+    else:
+        runner_class = BatchRunner
+    runner = runner_class(
+        session_file=session_file or manifest.get("session", "kommen"),
+        tracker_file=tracker_file or manifest.get("tracker", "posted_instagram_ids.txt"),
+        tracker_backend=tracker_backend or manifest.get("tracker_backend"),
+        max_workers=max_workers or manifest.get("workers", 4),
+        cursor_file=cursor_file or manifest.get("cursor_file", "instadon_cursors.json"),
+    )
+    try:
+        return runner.run(manifest["jobs"])
+    finally:
+        runner.close()
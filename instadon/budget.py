@@ -0,0 +1,136 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+from .config import CONFIG
+
+logger = logging.getLogger(__name__)
+
+
+class RequestBudget:
+    """Token bucket shared by every request made with one Instagram session
+    (or another rate-limited API, named by ``name``).
+
+    Tokens refill at ``rate_per_hour`` up to ``burst``; each request takes one
+    and waits when the bucket is empty. When Instagram answers 429, ``penalize``
+    empties the bucket and blocks it for a while, so every job backs off
+    together instead of each hammering the session on its own. The level is
+    saved to ``state_file`` so short-lived runs (e.g. from cron) share the
+    budget too.
+    """
+
+    def __init__(self, rate_per_hour: Optional[float] = None, burst: Optional[float] = None,
+                 state_file: Optional[str] = None, name: str = "Instagram"):
+        instagram_config = CONFIG["instagram"]
+        self.name = name
+        self.rate = (rate_per_hour or instagram_config["requests_per_hour"]) / 3600
+        self.burst = burst or instagram_config["burst"]
+        self.state_file = Path(state_file) if state_file else None
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._updated = time.time()
+        self._blocked_until = 0.0
+        self._load()
+
+    def _load(self):
+        if not self.state_file:
+            return
+        try:
+            with open(self.state_file, 'r') as f:
+                state = json.load(f)
+            self._tokens = min(self.burst, float(state["tokens"]))
+            self._updated = float(state["updated"])
+            self._blocked_until = float(state.get("blocked_until", 0))
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def _save(self):
+        if not self.state_file:
+            return
+        try:
+            self.state_file.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_name = tempfile.mkstemp(dir=self.state_file.parent, suffix=".tmp")
+            with os.fdopen(fd, 'w') as f:
+                json.dump({"tokens": self._tokens, "updated": self._updated,
+                           "blocked_until": self._blocked_until}, f)
+            os.replace(tmp_name, self.state_file)
+        except OSError as e:
+            logger.warning(f"Could not save {self.name} request budget: {e}")
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _wait_time(self, cost: float, now: float) -> float:
+        self._refill(now)
+        blocked = max(0.0, self._blocked_until - now)
+        missing = max(0.0, cost - self._tokens)
+        return max(blocked, missing / self.rate)
+
+    def wait_time(self, cost: float = 1) -> float:
+        """Seconds until cost requests could be made without waiting."""
+        with self._lock:
+            return self._wait_time(cost, time.time())
+
+    def try_acquire(self, cost: float = 1) -> float:
+        """Take cost tokens if available and return 0, else return the seconds to wait."""
+        with self._lock:
+            now = time.time()
+            wait = self._wait_time(cost, now)
+            if wait <= 0:
+                self._tokens -= cost
+                self._save()
+            return max(wait, 0.0)
+
+    def acquire(self, cost: float = 1):
+        """Take cost tokens, sleeping until they are available."""
+        while True:
+            wait = self.try_acquire(cost)
+            if wait <= 0:
+                return
+            logger.info(f"{self.name} request budget exhausted, waiting {wait:.0f}s")
+            time.sleep(wait)
+
+    def penalize(self, seconds: Optional[float] = None):
+        """The service throttled us: empty the bucket and pause all requests."""
+        seconds = seconds or CONFIG["instagram"]["throttle_backoff"]
+        with self._lock:
+            now = time.time()
+            self._refill(now)
+            self._tokens = 0.0
+            self._blocked_until = max(self._blocked_until, now + seconds)
+            self._save()
+        logger.warning(f"{self.name} throttled our requests, pausing for {seconds:.0f}s")
+
+
+_default_budget: Optional[RequestBudget] = None
+_default_budget_lock = threading.Lock()
+
+
+def get_instagram_budget() -> RequestBudget:
+    """Return the process-wide Instagram RequestBudget, creating it on first use."""
+    global _default_budget
+    with _default_budget_lock:
+        if _default_budget is None:
+            _default_budget = RequestBudget(state_file=CONFIG["instagram"]["budget_file"])
+        return _default_budget
+
+
+_llm_budget: Optional[RequestBudget] = None
+
+
+def get_llm_budget() -> RequestBudget:
+    """Return the process-wide RequestBudget for chat completions, creating it on first use."""
+    global _llm_budget
+    with _default_budget_lock:
+        if _llm_budget is None:
+            llm_config = CONFIG["llm"]
+            _llm_budget = RequestBudget(rate_per_hour=llm_config["requests_per_minute"] * 60,
+                                        burst=max(1, llm_config["requests_per_minute"]),
+                                        state_file=llm_config["budget_file"], name="LLM")
+        return _llm_budget
@@ -1,9 +1,20 @@
 import os
+import shutil
+from importlib.util import find_spec
 from typing import Dict, Any
 from dotenv import load_dotenv
 
 load_dotenv()
 
+CACHE_DIR = os.getenv("INSTADON_CACHE_DIR", ".instadon_cache")
+
+
+def _transcode_default() -> str:
+    # Transcoding only does something with Pillow or ffmpeg; checked without importing Pillow
+    available = find_spec("PIL") is not None or shutil.which(os.getenv("INSTADON_FFMPEG", "ffmpeg")) is not None
+    return "1" if available else "0"
+
+
 CONFIG = {
     "mastodon": {
         "accounts": {
@@ -25,12 +36,148 @@ CONFIG = {
             }
         }
     },
+    "media": {
+        # Picker items fetched at once; each upload starts as soon as its download finishes
+        "max_concurrent_downloads": int(os.getenv("INSTADON_MAX_CONCURRENT_DOWNLOADS", "4")),
+        "max_concurrent_uploads": int(os.getenv("INSTADON_MAX_CONCURRENT_UPLOADS", "2")),
+        # Buffer size for streaming downloads to disk and multipart uploads from disk
+        "chunk_size": int(os.getenv("INSTADON_MEDIA_CHUNK_SIZE", str(64 * 1024))),
+        # Polling for media Mastodon is still processing (HTTP 202 from /api/v2/media)
+        "processing_poll_interval": 0.5,
+        "processing_max_poll_interval": 5.0,
+        "processing_timeout": float(os.getenv("INSTADON_MEDIA_PROCESSING_TIMEOUT", "600"))
+    },
+    "http": {
+        "connect_timeout": float(os.getenv("INSTADON_HTTP_CONNECT_TIMEOUT", "10")),
+        "read_timeout": float(os.getenv("INSTADON_HTTP_READ_TIMEOUT", "120")),
+        "max_retries": int(os.getenv("INSTADON_HTTP_MAX_RETRIES", "4")),
+        "backoff_factor": 1.0,
+        "max_backoff": 300.0,
+        # Keep-alive connections kept per host
+        "pool_maxsize": 10
+    },
+    "async": {
+        # Requests in flight per host for the asyncio engine (`instadon batch --async`)
+        "per_host_limit": int(os.getenv("INSTADON_ASYNC_PER_HOST_LIMIT", "4")),
+        # Overrides by hostname, e.g. {"cobalt.example": 2}
+        "host_limits": {},
+        "max_connections": 100,
+        # Threads for blocking work: instaloader, transcoding, tracker, cursor and journal I/O
+        "executor_workers": 8
+    },
+    "daemon": {
+        # Poll interval bounds per job; active profiles move towards the minimum
+        "min_interval": float(os.getenv("INSTADON_MIN_POLL_INTERVAL", "300")),
+        "max_interval": float(os.getenv("INSTADON_MAX_POLL_INTERVAL", "3600")),
+        # Random +/- fraction applied to every interval
+        "jitter": 0.2
+    },
+    "instagram": {
+        # Request budget for the Instagram session, shared by every job (token bucket)
+        "requests_per_hour": float(os.getenv("INSTADON_INSTAGRAM_REQUESTS_PER_HOUR", "120")),
+        "burst": float(os.getenv("INSTADON_INSTAGRAM_BURST", "20")),
+        # All requests pause this long after Instagram answers 429
+        "throttle_backoff": 900.0,
+        # Requests a poll usually takes (profile lookup and the first page of posts)
+        "poll_cost": 2,
+        "budget_file": os.path.join(CACHE_DIR, "instagram_budget.json"),
+        # Profile IDs/names and post metadata, so reruns don't ask Instagram again
+        "cache_file": os.path.join(CACHE_DIR, "instagram.json"),
+        "profile_ttl": 7 * 24 * 3600,
+        "post_ttl": 30 * 24 * 3600
+    },
+    "transcode": {
+        # Resize/re-encode media that exceeds the target instance's limits before uploading.
+        # Images need Pillow (pip install instadon[transcode]), videos need ffmpeg on PATH;
+        # on by default only if one of them is installed
+        "enabled": os.getenv("INSTADON_TRANSCODE", _transcode_default()) != "0",
+        # Transcodes (image worker processes, ffmpeg runs) in parallel; one per CPU unless set
+        "workers": int(os.getenv("INSTADON_TRANSCODE_WORKERS", "0")) or os.cpu_count() or 1,
+        "jpeg_quality": 85,
+        "ffmpeg": os.getenv("INSTADON_FFMPEG", "ffmpeg"),
+        "ffprobe": os.getenv("INSTADON_FFPROBE", "ffprobe"),
+        # Per-video limit for ffmpeg runs, in seconds
+        "timeout": 900
+    },
+    "metrics": {
+        # Append every span and counter update to this file as JSON lines
+        "jsonl_file": os.getenv("INSTADON_METRICS_FILE"),
+        # Interface for the /metrics endpoint of `instadon serve --metrics-port`
+        "host": os.getenv("INSTADON_METRICS_HOST", "127.0.0.1")
+    },
     "cobalt": {
-        "url": "https://cobalt.uber.space/"
+        # Comma-separated in INSTADON_COBALT_URLS; healthy endpoints are picked weighted by latency
+        "urls": [url.strip() for url in os.getenv("INSTADON_COBALT_URLS", "https://cobalt.uber.space/").split(",")
+                 if url.strip()],
+        # An endpoint that fails is skipped for cooldown seconds, doubling per failure in a row
+        "cooldown": 60.0,
+        "max_cooldown": 1800.0,
+        # Answers are reused for retries of the same post; Cobalt's tunnel URLs expire after ~90s
+        "cache_ttl": float(os.getenv("INSTADON_COBALT_CACHE_TTL", "60")),
+        # Download straight from the media URLs instaloader returned with the post, when it has them
+        "use_post_media": os.getenv("INSTADON_USE_POST_MEDIA", "1") != "0"
     },
     "openrouter": {
         "api_key": os.getenv("OPENROUTER_API_KEY"),
         "base_url": "https://openrouter.ai/api/v1",
         "model": "deepseek/deepseek-chat-v3-0324:free"
+    },
+    "backfill": {
+        # Cross-posting a profile's history is paced so followers' timelines aren't flooded
+        "posts_per_hour": float(os.getenv("INSTADON_BACKFILL_POSTS_PER_HOUR", "20")),
+        # Posts fetched from Instagram ahead of the one being posted
+        "queue_size": 8,
+        "checkpoint_dir": os.path.join(CACHE_DIR, "backfill")
+    },
+    "mentions": {
+        # User-editable {"handle": "Name"} map used before falling back to the LLM
+        "names_file": os.getenv("INSTADON_MENTION_NAMES", "mention_names.json"),
+        "learned_file": os.path.join(CACHE_DIR, "learned_mention_names.json"),
+        # Look up full names of unknown handles on Instagram (one profile request per handle)
+        "learn_from_instagram": os.getenv("INSTADON_LEARN_MENTIONS", "0") == "1"
+    },
+    "media_store": {
+        # Content-addressed cache of downloaded media, evicted least recently used first
+        "dir": os.path.join(CACHE_DIR, "media"),
+        "max_bytes": int(os.getenv("INSTADON_MEDIA_STORE_MAX_BYTES", str(2 * 1024 ** 3))),
+        # Unattached media IDs are reused for this long (Mastodon removes them after ~1 day)
+        "upload_ttl": 12 * 3600,
+        # Downloads and transcodes in progress (incoming/); new ones wait while it is full
+        "scratch_max_bytes": int(os.getenv("INSTADON_SCRATCH_MAX_BYTES", str(1024 ** 3))),
+        # Files up to this size are kept in memory until complete (0 writes everything to disk)
+        "spool_bytes": int(os.getenv("INSTADON_SPOOL_BYTES", str(1024 ** 2))),
+        # Scratch files of live processes are only removed once they are this old
+        "orphan_age": 6 * 3600
+    },
+    "instances": {
+        # Limits from /api/v2/instance (characters, attachments, media sizes), one entry per instance
+        "cache_file": os.path.join(CACHE_DIR, "instances.json"),
+        "ttl": float(os.getenv("INSTADON_INSTANCE_CACHE_TTL", str(24 * 3600)))
+    },
+    "journal": {
+        # Per-post progress records used to resume interrupted cross-posts
+        "dir": os.path.join(CACHE_DIR, "journal"),
+        "max_age": 24 * 3600,
+        # Journaled media URLs are resolved again after this long (Cobalt's tunnel URLs expire after ~90s);
+        # journaled media IDs follow media_store.upload_ttl
+        "media_url_ttl": 60
+    },
+    "llm": {
+        # Chat completions in flight at once, across batch workers
+        "concurrency": int(os.getenv("INSTADON_LLM_CONCURRENCY", "4")),
+        # OpenRouter's free tier allows 20 requests per minute
+        "requests_per_minute": float(os.getenv("INSTADON_LLM_RPM", "20")),
+        "budget_file": os.path.join(CACHE_DIR, "llm_budget.json"),
+        # Pause after the API answers 429
+        "throttle_backoff": 60,
+        # Short captions that only need @-mentions resolved are sent together, up to this many per request
+        "pack_size": 8,
+        "pack_chars": 4000
+    },
+    "llm_cache": {
+        "enabled": os.getenv("INSTADON_LLM_CACHE", "1") != "0",
+        "dir": os.path.join(CACHE_DIR, "llm"),
+        "ttl": 30 * 24 * 3600,
+        "max_entries": 5000
     }
 }
@@ -1,105 +1,470 @@
-from .instagram import InstagramClient
-from .mastodon import MastodonClient
-from .media import download_from_cobalt, process_cobalt_result
-from .text_processor import TextProcessor
 from .post_tracker import PostTracker
-from typing import List
+from .mentions import find_mentions
+from .cursor import CursorStore
+from .journal import JobJournal, JournalStore, PostJournals
+from .resolver import is_expired_media
+from .urls import extract_shortcode, post_url
+from .config import CONFIG
+from .metrics import get_metrics
+from abc import ABC, abstractmethod
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Set, Tuple
 import logging
+import threading
+
+# instaloader, openai and requests are slow to import; clients and the media pipeline
+# are only built when a run needs them
+if TYPE_CHECKING:
+    from .pipeline import MediaPipeline
+    from .instagram import InstagramClient
+    from .mastodon import MastodonClient
+    from .text_processor import TextProcessor
 
 logger = logging.getLogger(__name__)
 
-class InstaDon:
-    def __init__(self, mastodon_account: str, session_file: str = "kommen", tracker_file: str = "posted_instagram_ids.txt"):
-        self.instagram = InstagramClient(session_file)
-        self.mastodon = MastodonClient(mastodon_account)
-        self.text_processor = TextProcessor()
-        self.post_tracker = PostTracker(tracker_file)
+class InstaDonBase(ABC):
+    """Stage bookkeeping shared by InstaDon and the asyncio engine (async_core.AsyncInstaDon).
+
+    These methods read and write the tracker and journals but never wait
+    for the network; the engines only differ in how they drive the
+    transfers between them (the async one calls these in a thread).
+    """
+
+    # Provided by the engines; both use the blocking Instagram client
+    instagram: "InstagramClient"
+    text_processor: "TextProcessor"
+
+    def __init__(self, mastodon_account: str, post_tracker: PostTracker, cursors: CursorStore,
+                 extra_accounts: Optional[List[str]] = None):
+        self.post_tracker = post_tracker
+        self.cursors = cursors
+        self.journals = JournalStore()
+        self.mastodon_account = mastodon_account
+        # Fan-out: every post is fetched, downloaded and summarized once, then published to all accounts
+        self.accounts = list(dict.fromkeys([mastodon_account] + list(extra_accounts or [])))
+
+    @abstractmethod
+    def mastodon_for(self, account: str):
+        """The Mastodon client of account."""
+
+    def _cursor_key(self, profile_name: str) -> str:
+        return f"{profile_name}:{'+'.join(self.accounts)}"
+
+    @staticmethod
+    def _shortcode(instagram_url_or_shortcode: str) -> str:
+        # Determine if input is URL or shortcode
+        if instagram_url_or_shortcode.startswith('http') or 'instagram.com' in instagram_url_or_shortcode:
+            shortcode = extract_shortcode(instagram_url_or_shortcode)
+            if not shortcode:
+                raise ValueError(f"Could not extract shortcode from URL: {instagram_url_or_shortcode}")
+            return shortcode
+        # Assume it's a shortcode
+        return instagram_url_or_shortcode
+
+    def _posted_everywhere(self, shortcode: str) -> bool:
+        if all(self.post_tracker.is_already_posted(shortcode, account) for account in self.accounts):
+            logger.info(f"Post {shortcode} already posted to Mastodon. Skipping.")
+            return True
+        return False
+
+    def _unposted(self, posts: List) -> List:
+        """posts without the ones already on every account."""
+        return [post for post in posts
+                if not all(self.post_tracker.is_already_posted(post.shortcode, account) for account in self.accounts)]
+
+    def _pending(self, shortcode: str) -> Tuple[List[str], Dict[str, Any]]:
+        """The accounts shortcode still has to be posted to, and the results of the others."""
+        pending = [account for account in self.accounts if not self.post_tracker.is_already_posted(shortcode, account)]
+        results: Dict[str, Any] = {account: self._already_posted_result(shortcode)
+                                   for account in self.accounts if account not in pending}
+        if pending:
+            logger.info(f"Processing new post: {post_url(shortcode)} for {', '.join(pending)}")
+        return pending, results
+
+    def _combine(self, shortcode: str, results: Dict[str, Any]) -> dict:
+        """One result for the post from every account's result or exception (see InstaDon._process_instagram_post)."""
+        failures = {account: result for account, result in results.items() if isinstance(result, Exception)}
+        if failures:
+            if len(self.accounts) == 1:
+                raise failures[self.mastodon_account]
+            details = "; ".join(f"{account}: {error}" for account, error in failures.items())
+            raise RuntimeError(f"Failed to post {shortcode} to {len(failures)} of {len(results)} accounts: {details}") \
+                from next(iter(failures.values()))
+
+        if len(self.accounts) == 1:
+            return results[self.mastodon_account]
+
+        successes = [result for result in results.values() if result["status"] == "success"]
+        result = dict(successes[0] if successes else results[self.mastodon_account])
+        result["accounts"] = results
+        return result
+
+    def _retry_expired(self, shortcode: str, pending: List[str], results: Dict[str, Any],
+                       journals: PostJournals) -> Optional[Tuple[List[str], PostJournals]]:
+        """Accounts that failed on expired media URLs, with their journals cleared to resolve again (or None)."""
+        expired = [account for account in pending
+                   if isinstance(results[account], Exception) and is_expired_media(results[account])]
+        if not expired:
+            return None
+        logger.warning(f"Media URLs of {shortcode} no longer work, resolving them again")
+        journals = journals.only(expired)
+        journals.discard_media_items()
+        return expired, journals
+
+    @staticmethod
+    def _record_media_items(journals: PostJournals, media_items):
+        if not media_items:
+            raise ValueError("No media files could be downloaded")
+        journals.record_media_items(media_items)
+        return media_items
+
+    @staticmethod
+    def _uploaded_ids(mastodon, journal: JobJournal, count: int) -> Tuple[List[Optional[str]], Set[str]]:
+        """Media journaled as uploaded (None where not), and the IDs the thread already uses."""
+        # Media uploaded before a crash may still be processing on the server; Mastodon deletes
+        # media that isn't attached to a status after about a day
+        uploaded_ids = journal.fresh("media_ids", CONFIG["media_store"]["upload_ttl"]) or [None] * count
+        mastodon.track_pending([media_id for media_id in uploaded_ids if media_id])
+        # IDs of this thread; identical items in it must not share one upload
+        return uploaded_ids, {media_id for media_id in uploaded_ids if media_id}
+
+    @staticmethod
+    def _transcoder():
+        """The transcoder that scales media down to an instance's limits, or None if disabled."""
+        if not CONFIG["transcode"]["enabled"]:
+            return None
+        from .transcode import get_transcoder
+        return get_transcoder()
+
+    def _published(self, account: str, journal: JobJournal, shortcode: str, posts: List[Dict[str, Any]]) -> dict:
+        # Mark as posted only after successful Mastodon post creation
+        self.post_tracker.mark_as_posted(shortcode, account)
+
+        # Downloaded files stay in the media store for other accounts and retries
+        journal.complete()
+
+        logger.info(f"Successfully processed post {shortcode} for {account}")
+        return {
+            "status": "success",
+            "post": posts[0],  # First post in the thread
+            "posts": posts,  # All posts in the thread
+            "thread_length": len(posts),
+            "shortcode": shortcode,
+            "instagram_url": post_url(shortcode),
+            "account": account
+        }
+
+    def _already_posted_result(self, shortcode: str) -> dict:
+        return {
+            "status": "skipped",
+            "reason": "already_posted",
+            "shortcode": shortcode,
+            "instagram_url": post_url(shortcode)
+        }
+
+    def _learn_mentions(self, text: str):
+        """Look up unknown @-mentions on Instagram if enabled, so they resolve without the LLM."""
+        if CONFIG["mentions"]["learn_from_instagram"]:
+            resolver = self.text_processor.mentions
+            for handle in find_mentions(text):
+                if resolver.resolve(handle) is None:
+                    name = self.instagram.profile_full_name(handle)
+                    if name:
+                        resolver.learn(handle, name)
+
+
+class InstaDon(InstaDonBase):
+    def __init__(self, mastodon_account: str, session_file: str = "kommen", tracker_file: str = "posted_instagram_ids.txt",
+                 tracker_backend: Optional[str] = None, instagram: Optional["InstagramClient"] = None,
+                 mastodon: Optional["MastodonClient"] = None, text_processor: Optional["TextProcessor"] = None,
+                 post_tracker: Optional[PostTracker] = None, cursor_file: str = "instadon_cursors.json",
+                 cursors: Optional[CursorStore] = None, extra_accounts: Optional[List[str]] = None,
+                 mastodon_clients: Optional[Dict[str, "MastodonClient"]] = None):
+        super().__init__(mastodon_account, post_tracker or PostTracker(tracker_file, tracker_backend),
+                         cursors or CursorStore(cursor_file), extra_accounts)
+        # Clients can be passed in so several InstaDon instances (e.g. batch jobs) share sessions;
+        # otherwise they are created on first use
+        self.session_file = session_file
+        self._instagram = instagram
+        # Clients for every account this instance posts to, keyed by account
+        self._mastodon_clients = mastodon_clients if mastodon_clients is not None else {}
+        if mastodon is not None:
+            self._mastodon_clients[mastodon_account] = mastodon
+        self._text_processor = text_processor
+        self._clients_lock = threading.Lock()
+        self._media_pipeline = None
+
+    @property
+    def instagram(self) -> "InstagramClient":
+        with self._clients_lock:
+            if self._instagram is None:
+                from .instagram import InstagramClient
+                self._instagram = InstagramClient(self.session_file)
+            return self._instagram
+
+    @property
+    def mastodon(self) -> "MastodonClient":
+        return self.mastodon_for(self.mastodon_account)
+
+    def mastodon_for(self, account: str) -> "MastodonClient":
+        with self._clients_lock:
+            if account not in self._mastodon_clients:
+                from .mastodon import MastodonClient
+                self._mastodon_clients[account] = MastodonClient(account)
+            return self._mastodon_clients[account]
+
+    @property
+    def media_pipeline(self) -> "MediaPipeline":
+        with self._clients_lock:
+            if self._media_pipeline is None:
+                from .pipeline import MediaPipeline
+                self._media_pipeline = MediaPipeline()
+            return self._media_pipeline
+
+    @property
+    def text_processor(self) -> "TextProcessor":
+        with self._clients_lock:
+            if self._text_processor is None:
+                from .text_processor import TextProcessor
+                self._text_processor = TextProcessor()
+            return self._text_processor
     
     def post_latest_from_profile(self, profile_name: str, visibility: str = "public"):
         """Get latest post from Instagram profile and create Mastodon draft."""
         # Get latest Instagram post
-        latest_post = self.instagram.latest_post(profile_name)
+        with get_metrics().span("instagram_fetch"):
+            latest_post = self.instagram.latest_post(profile_name)
         if not latest_post:
             raise ValueError(f"No posts found for profile: {profile_name}")
         
         return self._process_instagram_post(latest_post, visibility)
     
+    def post_new_from_profile(self, profile_name: str, visibility: str = "public") -> List[dict]:
+        """Cross-post every post published since the last run, oldest first.
+
+        The cursor only advances past posts that were handled, so after a
+        failure the next run picks up where this one stopped.
+        """
+        cursor_key = self._cursor_key(profile_name)
+        with get_metrics().span("instagram_fetch"):
+            new_posts = self.instagram.new_posts(profile_name, self.cursors.get(cursor_key))
+        logger.info(f"Found {len(new_posts)} new posts for {profile_name}")
+
+        results = []
+        # Captions of a backlog are processed together, while the first posts' media are transferred
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="instadon-text") as pool:
+            texts = self._process_texts(new_posts, pool) if len(new_posts) > 1 else {}
+            for post in new_posts:
+                results.append(self._process_instagram_post(post, visibility, texts.get(post.shortcode)))
+                self.cursors.advance(cursor_key, post.date_utc, post.shortcode)
+        return results
+
     def post_specific_post(self, instagram_url_or_shortcode: str, visibility: str = "public"):
         """Get specific Instagram post by URL or shortcode and create Mastodon post."""
-        # Determine if input is URL or shortcode
-        if instagram_url_or_shortcode.startswith('http') or 'instagram.com' in instagram_url_or_shortcode:
-            post = self.instagram.get_post_by_url(instagram_url_or_shortcode)
-        else:
-            # Assume it's a shortcode
-            post = self.instagram.get_post_by_shortcode(instagram_url_or_shortcode)
+        shortcode = self._shortcode(instagram_url_or_shortcode)
+
+        # Checked before touching Instagram so reruns don't even load the session
+        if self._posted_everywhere(shortcode):
+            return self._already_posted_result(shortcode)
+
+        with get_metrics().span("instagram_fetch"):
+            post = self.instagram.get_post_by_shortcode(shortcode)
         
         if not post:
             raise ValueError(f"Could not find Instagram post: {instagram_url_or_shortcode}")
         
         return self._process_instagram_post(post, visibility)
     
-    def _process_instagram_post(self, instagram_post, visibility: str = "public"):
-        """Process an Instagram post and create Mastodon post."""
+    def _process_instagram_post(self, instagram_post, visibility: str = "public",
+                                text_future: Optional[Future] = None):
+        """Process an Instagram post and create Mastodon post(s).
+
+        With several accounts, the result of the first account is returned
+        with every account's result under ``accounts``. If any account
+        fails, the error is raised after the others have finished; accounts
+        that succeeded are tracked and skipped on the retry.
+        """
         shortcode = instagram_post.shortcode
         logger.info(f"Processing post: {shortcode}")
         
+        return self._combine(shortcode, self._cross_post(instagram_post, visibility, text_future))
+
+    def _cross_post(self, instagram_post, visibility: str, text_future: Optional[Future] = None) -> Dict[str, Any]:
+        """Run the shared stages once and publish to every pending account concurrently.
+
+        text_future, if given, yields the processed status text (see _process_texts).
+        Returns each account's result dict, or the exception it failed with.
+        """
+        shortcode = instagram_post.shortcode
+        
         # Check if already posted
-        if self.post_tracker.is_already_posted(shortcode):
-            logger.info(f"Post {shortcode} already posted to Mastodon. Skipping.")
-            return {
-                "status": "skipped",
-                "reason": "already_posted",
-                "shortcode": shortcode,
-                "instagram_url": f"https://www.instagram.com/p/{shortcode}/"
-            }
+        pending, results = self._pending(shortcode)
+        if not pending:
+            return results
         
-        # Build Instagram URL
-        instagram_url = f"https://www.instagram.com/p/{shortcode}/"
-        logger.info(f"Processing new post: {instagram_url}")
+        # Stages completed by an earlier, interrupted run are read back from the journals
+        journals = self.journals.open_post(shortcode, pending)
+
+        # Journaled or cached media URLs may have expired since; if downloading them fails, they are
+        # resolved again and the failed accounts retried once
+        for refresh in (False, True):
+            try:
+                media_items = self._media_items(instagram_post, journals, refresh)
+            except Exception as e:
+                logger.error(f"Failed to process post {shortcode}: {e}")
+                return dict(results, **{account: e for account in pending})
+
+            results.update(self._publish_all(instagram_post, pending, journals, media_items, visibility, text_future))
+            retry = None if refresh else self._retry_expired(shortcode, pending, results, journals)
+            if retry is None:
+                break
+            pending, journals = retry
+
+        return results
+
+    def _media_items(self, instagram_post, journals, refresh: bool = False):
+        """Resolve media (journaled, cached, from the post itself or with Cobalt), once for all accounts."""
+        from .media import download_from_cobalt, cobalt_media_items
+        from .resolver import get_media_resolver
+
+        media_items = [] if refresh else journals.media_items()
+        if not media_items:
+            cobalt_result = get_media_resolver().resolve(instagram_post, download_from_cobalt, refresh=refresh)
+            media_items = cobalt_media_items(cobalt_result)
+        return self._record_media_items(journals, media_items)
+
+    def _publish_all(self, instagram_post, pending: List[str], journals, media_items, visibility: str,
+                     text_future: Optional[Future] = None) -> Dict[str, Any]:
+        """Publish to every pending account concurrently; returns each result or exception."""
+        from .media_store import get_media_store
+        from .pipeline import SharedDownloads
+
+        shortcode = instagram_post.shortcode
+        processed_text = journals.text()
+        original_text = instagram_post.caption or ""
+        description = instagram_post.accessibility_caption
+        results: Dict[str, Any] = {}
         
-        try:
-            # Download media using Cobalt
-            cobalt_result = download_from_cobalt(instagram_url)
-            media_files = process_cobalt_result(cobalt_result)
+        # The post's files stay in the media store until every account has uploaded them
+        with get_media_store().lease() as lease, \
+                ThreadPoolExecutor(max_workers=len(pending) + 1, thread_name_prefix="instadon-post") as pool, \
+                SharedDownloads(media_items, self.media_pipeline.max_concurrent_downloads, lease) as downloads:
+            # Process status text (summarize if needed) while media is transferred
+            if processed_text is None:
+                if text_future is None:
+                    text_future = pool.submit(self._process_text, original_text, self._max_characters(pending))
+            else:
+                text_future = Future()
+                text_future.set_result(processed_text)
             
-            if not media_files:
-                raise ValueError("No media files could be downloaded")
-            
-            # Upload media to Mastodon
-            media_ids = []
-            for media_file in media_files:
-                media_id = self.mastodon.upload_media(
-                    str(media_file),
-                    instagram_post.accessibility_caption
+            futures = {
+                account: pool.submit(self._publish, account, journals[account], shortcode, media_items,
+                                     downloads, description, text_future, visibility, lease)
+                for account in pending
+            }
+            for account, future in futures.items():
+                try:
+                    results[account] = future.result()
+                except Exception as e:
+                    logger.error(f"Failed to process post {shortcode} for {account}: {e}")
+                    # Don't mark as posted if there was an error
+                    results[account] = e
+        
+        return results
+
+    def _publish(self, account: str, journal, shortcode: str, media_items, downloads, description: str,
+                 text_future: Future, visibility: str, lease=None) -> dict:
+        """Upload media and post the status (thread) to one account."""
+        mastodon = self.mastodon_for(account)
+        uploaded_ids, in_use = self._uploaded_ids(mastodon, journal, len(media_items))
+        
+        # Scale media down to this instance's limits before uploading it
+        prepare = None
+        transcoder = self._transcoder()
+        if transcoder is not None:
+            prepare = lambda media_file: transcoder.prepare(media_file, mastodon.media_limits(), lease)
+        
+        # Resolved as each upload finishes, so thread parts can be posted while later media still upload
+        media_futures = [Future() for _ in media_items]
+        for future, media_id in zip(media_futures, uploaded_ids):
+            if media_id:
+                future.set_result(media_id)
+        
+        def on_upload(i: int, media_id: str):
+            journal.record_item("media_ids", i, media_id, len(media_items))
+            media_futures[i].set_result(media_id)
+        
+        def upload_all():
+            try:
+                # Upload each file to Mastodon as soon as it is downloaded, keeping carousel order
+                self.media_pipeline.run(
+                    media_items,
+                    lambda media_file: mastodon.upload_media(str(media_file), description, in_use),
+                    media_ids=uploaded_ids,
+                    files=journal.get("files"),
+                    on_download=lambda i, path: journal.record_item("files", i, str(path), len(media_items)),
+                    on_upload=on_upload,
+                    # Kept in the media store for the next attempt
+                    keep_files_on_error=True,
+                    download=downloads.get,
+                    prepare=prepare,
+                    lease=lease,
                 )
-                media_ids.append(media_id)
-            
-            # Process status text (summarize if needed)
-            original_text = instagram_post.caption or ""
-            processed_text = self.text_processor.summarize_if_needed(original_text)
-            
-            # Create post or thread (handles 4+ media automatically)
-            posts = self.mastodon.create_post_thread(processed_text, media_ids, visibility)
-            main_post = posts[0]  # First post in the thread
-            
-            # Mark as posted only after successful Mastodon post creation
-            self.post_tracker.mark_as_posted(shortcode)
-            
-            # Clean up temporary files
-            for media_file in media_files:
-                media_file.unlink()
+            except BaseException as e:
+                for future in media_futures:
+                    if not future.done():
+                        future.set_exception(e)
+                raise
+        
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="instadon-upload") as uploads:
+            upload_future = uploads.submit(upload_all)
             
-            logger.info(f"Successfully processed post {shortcode}")
-            return {
-                "status": "success",
-                "post": main_post,
-                "posts": posts,  # All posts in the thread
-                "thread_length": len(posts),
-                "shortcode": shortcode,
-                "instagram_url": instagram_url
-            }
+            processed_text = text_future.result()
+            if journal.get("text") is None:
+                journal.record("text", processed_text)
             
-        except Exception as e:
-            logger.error(f"Failed to process post {shortcode}: {e}")
-            # Don't mark as posted if there was an error
-            raise
+            # Create post or thread (splits media and text beyond the instance's limits); each part
+            # waits only for its own media, including media still processing
+            posts = mastodon.create_post_thread(
+                processed_text, media_futures, visibility,
+                existing_posts=journal.get("posts"),
+                on_post=lambda post: journal.append("posts", post)
+            )
+            upload_future.result()
+        return self._published(account, journal, shortcode, posts)
+
+    def _max_characters(self, accounts: List[str]) -> int:
+        """The status length every account's instance accepts (the text is shared)."""
+        return min(self.mastodon_for(account).capabilities.max_characters for account in accounts)
+
+    def _process_text(self, text: str, max_chars: Optional[int] = None) -> str:
+        """Summarize/resolve mentions, optionally learning unknown names from Instagram first."""
+        self._learn_mentions(text)
+        return self.text_processor.summarize_if_needed(text, max_chars)
+
+    def _process_texts(self, posts: List, pool: ThreadPoolExecutor) -> Dict[str, Future]:
+        """Process the captions of posts with one batched call on pool; returns a Future per shortcode.
+
+        Posts already on every account are left out.
+        """
+        posts = self._unposted(posts)
+        futures = {post.shortcode: Future() for post in posts}
+        if not posts:
+            return futures
+
+        def run():
+            try:
+                captions = [post.caption or "" for post in posts]
+                for caption in captions:
+                    self._learn_mentions(caption)
+                texts = self.text_processor.process_many(captions, self._max_characters(self.accounts))
+                for post, text in zip(posts, texts):
+                    futures[post.shortcode].set_result(text)
+            except Exception as e:
+                logger.error(f"Failed to process captions: {e}")
+                for future in futures.values():
+                    if not future.done():
+                        future.set_exception(e)
+
+        pool.submit(run)
+        return futures
@@ -0,0 +1,58 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class CursorStore:
+    """Per-profile high-water marks: the newest Instagram post already handled.
+
+    Stored as a small JSON file mapping a cursor key (profile, or profile and
+    account) to the post's ``date_utc`` and shortcode.
+    """
+
+    def __init__(self, cursor_file: str = "instadon_cursors.json"):
+        self.cursor_file = Path(cursor_file)
+        self._lock = threading.Lock()
+        self._cursors: Dict[str, Dict[str, Any]] = {}
+        if self.cursor_file.exists():
+            try:
+                with open(self.cursor_file, 'r') as f:
+                    self._cursors = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.error(f"Could not read cursor file {self.cursor_file}: {e}")
+
+    def get(self, key: str) -> Optional[datetime]:
+        """Return the date_utc of the newest handled post for key, if any."""
+        with self._lock:
+            cursor = self._cursors.get(key)
+        if not cursor:
+            return None
+        return datetime.fromisoformat(cursor["date_utc"])
+
+    def advance(self, key: str, date_utc: datetime, shortcode: str):
+        """Move the cursor for key forward to this post (never backwards)."""
+        if date_utc.tzinfo is None:
+            # instaloader returns naive UTC datetimes
+            date_utc = date_utc.replace(tzinfo=timezone.utc)
+
+        with self._lock:
+            current = self._cursors.get(key)
+            if current and datetime.fromisoformat(current["date_utc"]) >= date_utc:
+                return
+            self._cursors[key] = {"date_utc": date_utc.isoformat(), "shortcode": shortcode}
+            self._save()
+        logger.info(f"Cursor for {key} advanced to {shortcode} ({date_utc.isoformat()})")
+
+    def _save(self):
+        self.cursor_file.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=self.cursor_file.parent, suffix=".tmp")
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self._cursors, f, indent=2, sort_keys=True)
+        os.replace(tmp_name, self.cursor_file)
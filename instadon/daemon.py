@@ -0,0 +1,124 @@
+"""
+Long-running scheduler that keeps Instagram, OpenRouter and Mastodon clients
+warm and polls each manifest job on its own adaptive interval.
+"""
+
+import heapq
+import logging
+import random
+import signal
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from .batch import BatchRunner, job_accounts
+from .budget import RequestBudget, get_instagram_budget
+from .config import CONFIG
+
+logger = logging.getLogger(__name__)
+
+
+class Daemon:
+    def __init__(self, runner: BatchRunner, jobs: List[Dict[str, Any]], min_interval: Optional[float] = None,
+                 max_interval: Optional[float] = None, jitter: Optional[float] = None,
+                 budget: Optional[RequestBudget] = None):
+        daemon_config = CONFIG["daemon"]
+        self.runner = runner
+        self.jobs = jobs
+        self.min_interval = min_interval or daemon_config["min_interval"]
+        self.max_interval = max_interval or daemon_config["max_interval"]
+        self.jitter = daemon_config["jitter"] if jitter is None else jitter
+        self.budget = budget or get_instagram_budget()
+        self.poll_cost = CONFIG["instagram"]["poll_cost"]
+
+        # Each job starts at its own interval (or the minimum) and adapts from there
+        self.intervals = [float(job.get("interval", self.min_interval)) for job in jobs]
+        self._queue = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._running = 0
+
+    def _with_jitter(self, interval: float) -> float:
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _schedule(self, index: int, delay: float):
+        with self._lock:
+            heapq.heappush(self._queue, (time.monotonic() + delay, index))
+        self._wake.set()
+
+    def _adapt(self, index: int, report: Dict[str, Any]):
+        """Poll active profiles more often and back off on quiet or failing ones."""
+        if report["status"] == "success":
+            self.intervals[index] = max(self.min_interval, self.intervals[index] / 2)
+        else:
+            self.intervals[index] = min(self.max_interval, self.intervals[index] * 1.5)
+
+    def _budget_delay(self) -> float:
+        """Seconds to hold back the next poll so running and new polls fit in the Instagram budget."""
+        with self._lock:
+            running = self._running
+        return self.budget.wait_time(self.poll_cost * (running + 1))
+
+    def _job_done(self, index: int, future: Future):
+        with self._lock:
+            self._running -= 1
+        job = self.jobs[index]
+        try:
+            report = future.result()
+        except Exception as e:
+            report = {"job": job, "status": "error", "error": str(e), "elapsed": 0.0}
+
+        self._adapt(index, report)
+        logger.info(f"Poll {job['profile']} -> {job_accounts(job)}: {report['status']} in {report['elapsed']:.1f}s, "
+                    f"next in ~{self.intervals[index]:.0f}s")
+        if not self._stopping.is_set():
+            self._schedule(index, self._with_jitter(self.intervals[index]))
+
+    def stop(self, *_):
+        """Stop scheduling new polls; running polls are allowed to finish."""
+        if not self._stopping.is_set():
+            logger.info("Shutting down after running polls finish")
+        self._stopping.set()
+        self._wake.set()
+
+    def run(self):
+        """Run until SIGINT/SIGTERM (or stop()); must be called from the main thread."""
+        previous_handlers = {sig: signal.signal(sig, self.stop) for sig in (signal.SIGTERM, signal.SIGINT)}
+
+        # Stagger the first polls instead of starting them all at once
+        for index in range(len(self.jobs)):
+            self._schedule(index, random.uniform(0, self.min_interval * self.jitter))
+
+        logger.info(f"Serving {len(self.jobs)} jobs with {self.runner.max_workers} workers")
+        with ThreadPoolExecutor(max_workers=self.runner.max_workers, thread_name_prefix="instadon-poll") as pool:
+            while not self._stopping.is_set():
+                # Cleared before looking at the queue so no reschedule can be missed
+                self._wake.clear()
+                with self._lock:
+                    now = time.monotonic()
+                    due = []
+                    while self._queue and self._queue[0][0] <= now:
+                        due.append(heapq.heappop(self._queue)[1])
+                    timeout = self._queue[0][0] - now if self._queue else None
+
+                for position, index in enumerate(due):
+                    # Polls that can't be paid for yet wait instead of stalling in instaloader
+                    delay = self._budget_delay()
+                    if delay > 0:
+                        logger.info(f"Instagram budget low, delaying {len(due) - position} polls by {delay:.0f}s")
+                        for deferred in due[position:]:
+                            self._schedule(deferred, self._with_jitter(delay))
+                        break
+                    with self._lock:
+                        self._running += 1
+                    future = pool.submit(self.runner.run_job, self.jobs[index])
+                    future.add_done_callback(lambda f, index=index: self._job_done(index, f))
+
+                self._wake.wait(timeout)
+
+        for sig, handler in previous_handlers.items():
+            signal.signal(sig, handler)
+        self.runner.close()
+        logger.info("Daemon stopped")
@@ -0,0 +1,175 @@
+import email.utils
+import logging
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+from typing import Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+from .config import CONFIG
+from .metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Sending these twice has the same effect as sending them once
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+SECRET_HEADERS = {"authorization", "cookie", "set-cookie"}
+
+
+def redact_headers(headers: Dict[str, str]) -> Dict[str, str]:
+    """Copy of headers that is safe to log."""
+    return {name: "<redacted>" if name.lower() in SECRET_HEADERS else value for name, value in headers.items()}
+
+
+class RetryPolicy:
+    """When and how long to wait before retrying a request (shared by the sync and async clients)."""
+
+    def __init__(self, max_retries: Optional[int] = None, backoff_factor: Optional[float] = None,
+                 max_backoff: Optional[float] = None):
+        http_config = CONFIG["http"]
+        self.max_retries = http_config["max_retries"] if max_retries is None else max_retries
+        self.backoff_factor = http_config["backoff_factor"] if backoff_factor is None else backoff_factor
+        self.max_backoff = max_backoff or http_config["max_backoff"]
+
+    @staticmethod
+    def _idempotent(method: str, headers: Optional[Dict[str, str]], idempotent: Optional[bool]) -> bool:
+        """Whether a request may be sent again after it might have reached the server.
+
+        POSTs are not, unless they carry an Idempotency-Key (Mastodon drops the
+        duplicate) or the caller knows better (idempotent=True, e.g. Cobalt).
+        A media upload sent twice creates two attachments.
+        """
+        if idempotent is not None:
+            return idempotent
+        return method.upper() in IDEMPOTENT_METHODS or any(name.lower() == "idempotency-key"
+                                                            for name in (headers or {}))
+
+    @staticmethod
+    def _retry_status(status_code: int, idempotent: bool) -> bool:
+        # 429 means the request was turned away unprocessed; a 5xx may come after it was processed
+        return status_code in RETRY_STATUS_CODES and (idempotent or status_code == 429)
+
+    def _backoff(self, attempt: int) -> float:
+        """Exponential backoff with full jitter."""
+        return random.uniform(0, min(self.max_backoff, self.backoff_factor * 2 ** attempt))
+
+    def _retry_delay(self, response, attempt: int) -> float:
+        """Honour Retry-After and Mastodon's X-RateLimit-* headers, else back off."""
+        delay = None
+        retry_after = response.headers.get("Retry-After")
+        try:
+            if retry_after:
+                if retry_after.isdigit():
+                    delay = float(retry_after)
+                else:
+                    retry_at = email.utils.parsedate_to_datetime(retry_after)
+                    delay = (retry_at - datetime.now(timezone.utc)).total_seconds()
+            elif response.headers.get("X-RateLimit-Remaining") == "0" and response.headers.get("X-RateLimit-Reset"):
+                reset = response.headers["X-RateLimit-Reset"].replace("Z", "+00:00")
+                delay = (datetime.fromisoformat(reset) - datetime.now(timezone.utc)).total_seconds()
+        except (TypeError, ValueError):
+            logger.warning(f"Could not parse rate limit headers from {response.url}")
+            delay = None
+
+        if delay is None:
+            return self._backoff(attempt)
+        # Server-provided waits can be long (Mastodon resets every 5 minutes); still cap them
+        return max(0.0, min(delay, self.max_backoff))
+
+
+def _connect_failed(error: requests.exceptions.RequestException) -> bool:
+    """Whether the request failed before any of it was sent (refused, unresolvable, connect timeout)."""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+
+class HttpClient(RetryPolicy):
+    """Shared HTTP layer with keep-alive connection pooling, timeouts and retries.
+
+    One ``requests.Session`` is used for all hosts; its adapter keeps a pool of
+    persistent connections per host, so repeated calls to the same Mastodon
+    instance, Cobalt server or CDN reuse the TCP/TLS connection.
+    """
+
+    def __init__(self, connect_timeout: Optional[float] = None, read_timeout: Optional[float] = None,
+                 max_retries: Optional[int] = None, backoff_factor: Optional[float] = None,
+                 max_backoff: Optional[float] = None, pool_maxsize: Optional[int] = None):
+        super().__init__(max_retries, backoff_factor, max_backoff)
+        http_config = CONFIG["http"]
+        self.timeout = (connect_timeout or http_config["connect_timeout"], read_timeout or http_config["read_timeout"])
+
+        pool_maxsize = pool_maxsize or http_config["pool_maxsize"]
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_maxsize, pool_maxsize=pool_maxsize)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def request(self, method: str, url: str, max_retries: Optional[int] = None, idempotent: Optional[bool] = None,
+                **kwargs) -> requests.Response:
+        """Send a request, retrying connection errors, 429 and 5xx responses with backoff.
+
+        The final response is returned as-is (including error statuses), so
+        callers keep using ``raise_for_status()``. max_retries overrides the
+        client's setting for this request, e.g. 0 when another server can
+        be asked instead. Requests that aren't idempotent (see _idempotent)
+        are only retried when they can't have reached the server: the
+        connection couldn't be made, or the answer was 429.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        body = kwargs.get("data")
+        max_retries = self.max_retries if max_retries is None else max_retries
+        idempotent = self._idempotent(method, kwargs.get("headers"), idempotent)
+
+        for attempt in range(max_retries + 1):
+            if attempt and hasattr(body, "reset"):
+                body.reset()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt >= max_retries or not (idempotent or _connect_failed(e)):
+                    raise
+                delay = self._backoff(attempt)
+                get_metrics().increment("http_retries", host=urlparse(url).hostname, reason=type(e).__name__)
+                logger.warning(f"{method} {url} failed ({e}); retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+
+            if not self._retry_status(response.status_code, idempotent) or attempt >= max_retries:
+                return response
+
+            delay = self._retry_delay(response, attempt)
+            get_metrics().increment("http_retries", host=urlparse(url).hostname, reason=response.status_code)
+            logger.warning(f"{method} {url} returned HTTP {response.status_code}; retrying in {delay:.1f}s")
+            response.close()
+            time.sleep(delay)
+
+        return response
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+
+_default_client: Optional[HttpClient] = None
+_default_client_lock = threading.Lock()
+
+
+def get_http_client() -> HttpClient:
+    """Return the process-wide HttpClient, creating it on first use."""
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = HttpClient()
+        return _default_client
@@ -1,25 +1,90 @@
 import instaloader
-from typing import Optional
-from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from datetime import datetime, timezone
 from pathlib import Path
-import re
+import logging
+import threading
+
+from .budget import RequestBudget, get_instagram_budget
+from .instagram_cache import CachedPost, InstagramCache
+from .metrics import get_metrics
+from .urls import extract_shortcode
+
+logger = logging.getLogger(__name__)
+
+
+class BudgetRateController(instaloader.RateController):
+    """instaloader's rate controller, drawing every request from a shared RequestBudget first."""
+
+    def __init__(self, context: instaloader.InstaloaderContext, budget: RequestBudget):
+        super().__init__(context)
+        self.budget = budget
+
+    def wait_before_query(self, query_type: str) -> None:
+        get_metrics().increment("instagram_requests")
+        self.budget.acquire()
+        super().wait_before_query(query_type)
+
+    def handle_429(self, query_type: str) -> None:
+        get_metrics().increment("instagram_throttled")
+        self.budget.penalize()
+        super().handle_429(query_type)
+
 
 class InstagramClient:
-    def __init__(self, session_file: str = "kommen"):
-        self.loader = instaloader.Instaloader()
-        
+    def __init__(self, session_file: str = "kommen", budget: Optional[RequestBudget] = None,
+                 cache: Optional[InstagramCache] = None):
+        # Every request of this session, including the ones instaloader makes behind
+        # property access, is paid for from the budget
+        self.budget = budget or get_instagram_budget()
+        self.cache = cache or InstagramCache()
+        self.loader = instaloader.Instaloader(
+            rate_controller=lambda context: BudgetRateController(context, self.budget))
+
         # Use session_file as the username and generate local path
         username = session_file
         session_path = Path(f"{username}_session")
-        
+
         # Load session with username and local file path
         self.loader.load_session_from_file(username, str(session_path))
-    
+
+        # The instaloader context is not thread-safe; serialize requests when shared
+        self._lock = threading.RLock()
+        self._profiles = {}
+
     def latest_post(self, profile_name: str):
         """Get the latest post from a given Instagram profile."""
-        profile = instaloader.Profile.from_username(self.loader.context, profile_name)
+        with self._lock:
+            return self._latest_post(profile_name)
+
+    def _profile(self, profile_name: str):
+        """Look up a profile once per client; later polls reuse it.
+
+        If its ID is cached, the profile is built from the cache without a
+        request (Profile.from_id would look the username up again first).
+        """
+        if profile_name not in self._profiles:
+            cached = self.cache.profile(profile_name)
+            if cached is not None:
+                get_metrics().increment("cache_hits", cache="instagram_profile")
+                node = {"id": cached["id"], "username": profile_name.lower(), "full_name": cached["full_name"]}
+                profile = instaloader.Profile(self.loader.context, node)
+            else:
+                profile = instaloader.Profile.from_username(self.loader.context, profile_name)
+                self.cache.remember_profile(profile_name, profile.userid, profile.full_name)
+            self._profiles[profile_name] = profile
+        return self._profiles[profile_name]
+
+    def _snapshot(self, posts: List, profile_name: Optional[str] = None) -> List[CachedPost]:
+        """Read everything instadon needs from posts now (under the lock) and cache it."""
+        snapshots = [CachedPost.from_post(post, profile_name) for post in posts]
+        self.cache.remember_posts(snapshots)
+        return snapshots
+
+    def _latest_post(self, profile_name: str):
+        profile = self._profile(profile_name)
         posts_iterator = profile.get_posts()
-        
+
         # Get first 10 posts and filter out pinned ones
         latest_posts = []
         for i, post in enumerate(posts_iterator):
@@ -27,32 +92,97 @@ class InstagramClient:
                 break
             if not post.is_pinned:
                 latest_posts.append(post)
-        
+
         # Sort by date and return the most recent
         if latest_posts:
-            return max(latest_posts, key=lambda p: p.date_utc)
+            return self._snapshot([max(latest_posts, key=lambda p: p.date_utc)], profile_name)[0]
         return None
-    
+
+    def new_posts(self, profile_name: str, since: Optional[datetime]) -> List:
+        """Get all non-pinned posts newer than since, oldest first.
+
+        Iteration stops at the first post at or before since, so only new
+        posts are fetched. Without a cursor only the latest post is returned,
+        to avoid flooding Mastodon with a profile's whole history.
+        """
+        if since is None:
+            latest = self.latest_post(profile_name)
+            return [latest] if latest else []
+
+        with self._lock:
+            new_posts = []
+            for post in self._profile(profile_name).get_posts():
+                # Pinned posts come first regardless of their age
+                if post.is_pinned:
+                    continue
+                if post.date_utc.replace(tzinfo=timezone.utc) <= since:
+                    break
+                new_posts.append(post)
+            new_posts = self._snapshot(new_posts, profile_name)
+
+        return sorted(new_posts, key=lambda p: p.date_utc)
+
+    def iter_posts(self, profile_name: str, since: datetime,
+                   resume: Optional[Dict[str, Any]] = None) -> Iterator[Tuple[CachedPost, Dict[str, Any]]]:
+        """Yield a profile's posts newest first, back to since, one page of Instagram at a time.
+
+        Each post comes with the iterator state to pass as resume to continue
+        from that post later (it is yielded again). Pinned posts are included
+        when they are new enough, but don't end the iteration.
+        """
+        with self._lock:
+            iterator = self._profile(profile_name).get_posts()
+            if resume:
+                try:
+                    iterator.thaw(instaloader.FrozenNodeIterator(**resume))
+                except (instaloader.exceptions.InvalidArgumentException, TypeError) as e:
+                    logger.warning(f"Cannot resume the posts of {profile_name}, starting over: {e}")
+                    iterator = self._profile(profile_name).get_posts()
+
+        while True:
+            # Only hold the lock while talking to Instagram, not while the caller handles a post
+            with self._lock:
+                post = next(iterator, None)
+                if post is None:
+                    return
+                state = iterator.freeze()._asdict()
+                if post.date_utc.replace(tzinfo=timezone.utc) < since:
+                    if post.is_pinned:
+                        continue
+                    return
+                snapshot = self._snapshot([post], profile_name)[0]
+            yield snapshot, state
+
     def get_post_by_shortcode(self, shortcode: str):
-        """Get a specific post by its shortcode."""
-        return instaloader.Post.from_shortcode(self.loader.context, shortcode)
-    
+        """Get a specific post by its shortcode (from the cache if it was seen recently)."""
+        cached = self.cache.post(shortcode)
+        if cached is not None:
+            get_metrics().increment("cache_hits", cache="instagram_post")
+            return cached
+        with self._lock:
+            return self._snapshot([instaloader.Post.from_shortcode(self.loader.context, shortcode)])[0]
+
+    def profile_full_name(self, username: str) -> Optional[str]:
+        """Get the display name of an Instagram profile, or None if it can't be fetched."""
+        cached = self.cache.profile(username)
+        if cached is not None:
+            get_metrics().increment("cache_hits", cache="instagram_profile")
+            return cached["full_name"] or None
+        with self._lock:
+            try:
+                profile = instaloader.Profile.from_username(self.loader.context, username)
+            except instaloader.exceptions.InstaloaderException:
+                return None
+            self.cache.remember_profile(username, profile.userid, profile.full_name)
+            return profile.full_name or None
+
     def get_post_by_url(self, url: str):
         """Get a specific post by its Instagram URL."""
         shortcode = self._extract_shortcode_from_url(url)
         if not shortcode:
             raise ValueError(f"Could not extract shortcode from URL: {url}")
         return self.get_post_by_shortcode(shortcode)
-    
+
     def _extract_shortcode_from_url(self, url: str) -> Optional[str]:
         """Extract shortcode from Instagram URL."""
-        # Match patterns like:
-        # https://www.instagram.com/p/ABC123/
-        # https://instagram.com/p/ABC123/
-        # instagram.com/p/ABC123/
-        # https://www.instagram.com/reel/ABC123/
-        # https://instagram.com/reel/ABC123/
-        # instagram.com/reel/ABC123/
-        pattern = r'(?:https?://)?(?:www\.)?instagram\.com/(?:p|reel)/([A-Za-z0-9_-]+)'
-        match = re.search(pattern, url)
-        return match.group(1) if match else None
+        return extract_shortcode(url)
@@ -0,0 +1,152 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+from .config import CONFIG
+
+logger = logging.getLogger(__name__)
+
+
+def post_media(post) -> Optional[List[Dict[str, str]]]:
+    """The photos and videos of an instaloader Post as [{"type", "url"}], in carousel order.
+
+    Read from the data instaloader already holds: its ``url``, ``video_url``
+    and sidecar properties may ask Instagram for higher quality versions,
+    which costs requests from the budget. None if a URL is missing (feed
+    data lacks the video URLs of some carousels).
+    """
+    node = dict(getattr(post, "_node", None) or {}, **(getattr(post, "_full_metadata_dict", None) or {}))
+    if "edge_sidecar_to_children" in node:
+        nodes = [edge["node"] for edge in node["edge_sidecar_to_children"].get("edges", [])]
+    else:
+        nodes = [node]
+
+    media = []
+    for item in nodes:
+        url = item.get("video_url") if item.get("is_video") else item.get("display_url") or item.get("display_src")
+        if not url:
+            return None
+        media.append({"type": "video" if item.get("is_video") else "photo", "url": url})
+    return media or None
+
+
+class CachedPost:
+    """The parts of an instaloader Post instadon uses, without a session behind it.
+
+    Reading ``accessibility_caption`` (or anything else missing from the feed
+    data) on a real Post quietly fetches the full post; a snapshot has already
+    paid that cost once and can be reused from the cache.
+    """
+
+    def __init__(self, shortcode: str, caption: Optional[str], accessibility_caption: Optional[str],
+                 date_utc: datetime, is_pinned: bool = False, owner_username: Optional[str] = None,
+                 media: Optional[List[Dict[str, str]]] = None):
+        self.shortcode = shortcode
+        self.caption = caption
+        self.accessibility_caption = accessibility_caption
+        # Naive UTC, like instaloader's Post.date_utc
+        self.date_utc = date_utc
+        self.is_pinned = is_pinned
+        self.owner_username = owner_username
+        # CDN URLs of the photos and videos (see post_media); they expire after a few days
+        self.media = media
+
+    @classmethod
+    def from_post(cls, post, owner_username: Optional[str] = None) -> "CachedPost":
+        return cls(post.shortcode, post.caption, post.accessibility_caption, post.date_utc,
+                   post.is_pinned, owner_username, post_media(post))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "caption": self.caption,
+            "accessibility_caption": self.accessibility_caption,
+            "date_utc": self.date_utc.replace(tzinfo=timezone.utc).timestamp(),
+            "is_pinned": self.is_pinned,
+            "owner_username": self.owner_username,
+            "media": self.media,
+        }
+
+    @classmethod
+    def from_dict(cls, shortcode: str, data: Dict[str, Any]) -> "CachedPost":
+        date_utc = datetime.fromtimestamp(data["date_utc"], timezone.utc).replace(tzinfo=None)
+        return cls(shortcode, data.get("caption"), data.get("accessibility_caption"), date_utc,
+                   data.get("is_pinned", False), data.get("owner_username"), data.get("media"))
+
+
+class InstagramCache:
+    """On-disk cache of profile IDs/names and post metadata.
+
+    Profile entries expire after ``profile_ttl`` (names and IDs rarely
+    change), posts after ``post_ttl``. Expired entries are dropped whenever
+    the file is rewritten.
+    """
+
+    def __init__(self, cache_file: Optional[str] = None, profile_ttl: Optional[float] = None,
+                 post_ttl: Optional[float] = None):
+        instagram_config = CONFIG["instagram"]
+        self.cache_file = Path(cache_file or instagram_config["cache_file"])
+        self.profile_ttl = profile_ttl or instagram_config["profile_ttl"]
+        self.post_ttl = post_ttl or instagram_config["post_ttl"]
+        self._lock = threading.Lock()
+        self._data: Optional[Dict[str, Dict[str, Dict[str, Any]]]] = None
+
+    def _load(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        if self._data is None:
+            try:
+                with open(self.cache_file, 'r') as f:
+                    self._data = json.load(f)
+            except (OSError, ValueError):
+                self._data = {}
+            self._data.setdefault("profiles", {})
+            self._data.setdefault("posts", {})
+        return self._data
+
+    def _save(self):
+        now = time.time()
+        for section, ttl in (("profiles", self.profile_ttl), ("posts", self.post_ttl)):
+            entries = self._data[section]
+            for key in [key for key, entry in entries.items() if now - entry["fetched"] >= ttl]:
+                del entries[key]
+        try:
+            self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_name = tempfile.mkstemp(dir=self.cache_file.parent, suffix=".tmp")
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self._data, f)
+            os.replace(tmp_name, self.cache_file)
+        except OSError as e:
+            logger.warning(f"Could not save Instagram cache: {e}")
+
+    def _get(self, section: str, key: str, ttl: float) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._load()[section].get(key)
+        if entry and time.time() - entry["fetched"] < ttl:
+            return entry
+        return None
+
+    def profile(self, username: str) -> Optional[Dict[str, Any]]:
+        """Cached {"id", "full_name"} of a profile, or None."""
+        return self._get("profiles", username.lower(), self.profile_ttl)
+
+    def remember_profile(self, username: str, profile_id: int, full_name: Optional[str]):
+        with self._lock:
+            self._load()["profiles"][username.lower()] = {"id": profile_id, "full_name": full_name,
+                                                          "fetched": time.time()}
+            self._save()
+
+    def post(self, shortcode: str) -> Optional[CachedPost]:
+        entry = self._get("posts", shortcode, self.post_ttl)
+        return CachedPost.from_dict(shortcode, entry) if entry else None
+
+    def remember_posts(self, posts: Iterable[CachedPost]):
+        now = time.time()
+        with self._lock:
+            entries = self._load()["posts"]
+            for post in posts:
+                entries[post.shortcode] = dict(post.to_dict(), fetched=now)
+            self._save()
@@ -0,0 +1,143 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Optional
+
+from .config import CONFIG
+
+if TYPE_CHECKING:
+    from .http_client import HttpClient
+
+logger = logging.getLogger(__name__)
+
+# What Mastodon itself defaults to; used when an instance doesn't say
+DEFAULT_MAX_CHARACTERS = 500
+DEFAULT_MAX_MEDIA_ATTACHMENTS = 4
+DEFAULT_CHARACTERS_RESERVED_PER_URL = 23
+
+# Seconds before an unreachable instance is asked again
+RETRY_AFTER = 300
+
+
+class InstanceCapabilities:
+    """Limits an instance advertises in the ``configuration`` block of /api/v2/instance."""
+
+    def __init__(self, configuration: Optional[Dict[str, Any]] = None):
+        self.configuration = configuration or {}
+
+    def _get(self, section: str, key: str, default):
+        return self.configuration.get(section, {}).get(key) or default
+
+    @property
+    def max_characters(self) -> int:
+        return self._get("statuses", "max_characters", DEFAULT_MAX_CHARACTERS)
+
+    @property
+    def max_media_attachments(self) -> int:
+        return self._get("statuses", "max_media_attachments", DEFAULT_MAX_MEDIA_ATTACHMENTS)
+
+    @property
+    def characters_reserved_per_url(self) -> int:
+        return self._get("statuses", "characters_reserved_per_url", DEFAULT_CHARACTERS_RESERVED_PER_URL)
+
+    @property
+    def media_limits(self) -> Dict[str, Any]:
+        return self.configuration.get("media_attachments", {})
+
+
+class InstanceCache:
+    """On-disk cache of instance configurations, shared by every account on an instance.
+
+    Each instance is fetched at most once per ``ttl``, even when several
+    clients ask at the same time. If a refresh fails, the stale entry is
+    used; with nothing cached at all, Mastodon's defaults apply.
+    """
+
+    def __init__(self, cache_file: Optional[str] = None, ttl: Optional[float] = None):
+        instance_config = CONFIG["instances"]
+        self.cache_file = Path(cache_file or instance_config["cache_file"])
+        self.ttl = ttl or instance_config["ttl"]
+        self._lock = threading.Lock()
+        self._fetch_locks: Dict[str, threading.Lock] = {}
+        self._entries: Optional[Dict[str, Dict[str, Any]]] = None
+        # Instances that couldn't be reached aren't asked again on every call
+        self._failed_at: Dict[str, float] = {}
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        if self._entries is None:
+            try:
+                with open(self.cache_file, 'r') as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError):
+                self._entries = {}
+        return self._entries
+
+    def _save(self):
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=self.cache_file.parent, suffix=".tmp")
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self._entries, f)
+        os.replace(tmp_name, self.cache_file)
+
+    def _fresh(self, instance: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._load().get(instance)
+        if entry and time.time() - entry["fetched"] < self.ttl:
+            return entry
+        return None
+
+    def capabilities(self, instance: str, http: "HttpClient") -> InstanceCapabilities:
+        """Capabilities of instance, fetched with http if the cached copy is missing or expired."""
+        entry = self._fresh(instance)
+        if entry is None and time.time() - self._failed_at.get(instance, 0) > RETRY_AFTER:
+            with self._lock:
+                fetch_lock = self._fetch_locks.setdefault(instance, threading.Lock())
+            with fetch_lock:
+                # Another client (or process) may have fetched it while we waited
+                with self._lock:
+                    self._entries = None
+                entry = self._fresh(instance) or self._fetch(instance, http)
+        else:
+            with self._lock:
+                entry = entry or self._load().get(instance)
+        return InstanceCapabilities(entry["configuration"] if entry else None)
+
+    def _fetch(self, instance: str, http: "HttpClient") -> Optional[Dict[str, Any]]:
+        try:
+            response = http.get(f"{instance}/api/v2/instance", headers={"Accept": "application/json"})
+            response.raise_for_status()
+            configuration = response.json().get("configuration", {})
+        except Exception as e:
+            logger.warning(f"Could not read configuration of {instance}: {e}")
+            self._failed_at[instance] = time.time()
+            with self._lock:
+                return self._load().get(instance)
+
+        logger.info(f"Fetched configuration of {instance}")
+        entry = {"configuration": configuration, "fetched": time.time()}
+        with self._lock:
+            self._load()[instance] = entry
+            self._save()
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+            self.cache_file.unlink(missing_ok=True)
+
+
+_default_cache: Optional[InstanceCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def get_instance_cache() -> InstanceCache:
+    """Return the process-wide InstanceCache, creating it on first use."""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = InstanceCache()
+        return _default_cache
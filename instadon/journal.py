@@ -0,0 +1,206 @@
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .config import CONFIG
+
+logger = logging.getLogger(__name__)
+
+
+class JobJournal:
+    """Write-ahead record of how far one post got on its way to one account.
+
+    Stages are written as they complete: the resolved media items, the
+    downloaded files, each uploaded media ID, the processed text and each
+    status posted. A rerun reads the journal and skips what is already done.
+    Every update rewrites the file atomically, so a crash never leaves a
+    half-written journal behind.
+
+    The time each stage was first recorded is kept, so stages that expire
+    (media URLs, unattached media IDs) can be read with ``fresh``.
+    """
+
+    def __init__(self, path: Path, shortcode: str, account: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.state: Dict[str, Any] = {"shortcode": shortcode, "account": account, "created": time.time()}
+        if path.exists():
+            try:
+                with open(path, 'r') as f:
+                    self.state = json.load(f)
+                logger.info(f"Resuming {shortcode} for {account} from journal {path}")
+            except (OSError, ValueError) as e:
+                logger.error(f"Ignoring unreadable journal {path}: {e}")
+
+    @property
+    def resumed(self) -> bool:
+        return "updated" in self.state
+
+    def get(self, stage: str, default=None):
+        with self._lock:
+            return self.state.get(stage, default)
+
+    def fresh(self, stage: str, ttl: float, default=None):
+        """The stage's value if it was recorded less than ttl seconds ago; older values are discarded."""
+        with self._lock:
+            if stage not in self.state:
+                return default
+            recorded = self.state.get("recorded", {}).get(stage, self.state.get("created", 0))
+            if time.time() - recorded < ttl:
+                return self.state[stage]
+        logger.info(f"Journaled {stage} of {self.state['shortcode']} are older than {ttl:.0f}s, discarding them")
+        self.discard(stage)
+        return default
+
+    def record(self, stage: str, value: Any):
+        with self._lock:
+            self.state[stage] = value
+            self._recorded(stage)
+            self._save()
+
+    def record_item(self, stage: str, index: int, value: Any, size: int):
+        """Record one entry of a list stage (e.g. the media ID of carousel item index)."""
+        with self._lock:
+            items = self.state.get(stage) or [None] * size
+            items[index] = value
+            self.state[stage] = items
+            self._recorded(stage)
+            self._save()
+
+    def append(self, stage: str, value: Any):
+        with self._lock:
+            self.state.setdefault(stage, []).append(value)
+            self._recorded(stage)
+            self._save()
+
+    def discard(self, *stages: str):
+        """Forget stages that can't be resumed from (e.g. media URLs that have expired)."""
+        with self._lock:
+            if not any(stage in self.state for stage in stages):
+                return
+            for stage in stages:
+                self.state.pop(stage, None)
+                self.state.get("recorded", {}).pop(stage, None)
+            self._save()
+
+    def _recorded(self, stage: str):
+        # A list stage's age is that of its oldest entry
+        self.state.setdefault("recorded", {}).setdefault(stage, time.time())
+
+    def _save(self):
+        self.state["updated"] = time.time()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=self.path.parent, suffix=".tmp")
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(tmp_name, self.path)
+
+    def complete(self):
+        """The post is fully published; the journal is no longer needed."""
+        self.path.unlink(missing_ok=True)
+
+
+class PostJournals:
+    """The journals of one post, one per account it is being published to.
+
+    The stages shared by all accounts (media items, text) are read from
+    whichever journal has them and recorded in every journal that doesn't.
+    """
+
+    def __init__(self, journals: Dict[str, JobJournal]):
+        self.journals = journals
+
+    def __getitem__(self, account: str) -> JobJournal:
+        return self.journals[account]
+
+    def __iter__(self) -> Iterator[JobJournal]:
+        return iter(self.journals.values())
+
+    def only(self, accounts: List[str]) -> "PostJournals":
+        return PostJournals({account: self.journals[account] for account in accounts})
+
+    def media_items(self) -> List[Tuple[str, Optional[str]]]:
+        """Media items resolved by an earlier run, unless their URLs may have expired since."""
+        ttl = CONFIG["journal"]["media_url_ttl"]
+        for journal in self:
+            media_items = journal.fresh("media_items", ttl)
+            if media_items:
+                return [tuple(item) for item in media_items]
+        return []
+
+    def record_media_items(self, media_items: List[Tuple[str, Optional[str]]]):
+        for journal in self:
+            if journal.get("media_items") is None:
+                previous = journal.get("files") or journal.get("media_ids")
+                if previous and len(previous) != len(media_items):
+                    # Resolved differently than before; downloads and uploads can't be matched up
+                    journal.discard("files", "media_ids")
+                journal.record("media_items", [list(item) for item in media_items])
+
+    def discard_media_items(self):
+        """The journaled media URLs stopped working; the next attempt resolves them again."""
+        for journal in self:
+            journal.discard("media_items")
+
+    def text(self) -> Optional[str]:
+        return next((journal.get("text") for journal in self if journal.get("text") is not None), None)
+
+
+class JournalStore:
+    def __init__(self, journal_dir: Optional[str] = None, max_age: Optional[float] = None):
+        journal_config = CONFIG["journal"]
+        self.journal_dir = Path(journal_dir or journal_config["dir"])
+        # Mastodon deletes unattached media after about a day, so older journals can't be resumed
+        self.max_age = max_age or journal_config["max_age"]
+        self._gc_lock = threading.Lock()
+        self._collected = False
+
+    def open(self, shortcode: str, account: str) -> JobJournal:
+        with self._gc_lock:
+            if not self._collected:
+                self._collected = True
+                self.collect_garbage()
+        name = re.sub(r'[^A-Za-z0-9_.-]', '_', f"{account}__{shortcode}")
+        return JobJournal(self.journal_dir / f"{name}.json", shortcode, account)
+
+    def open_post(self, shortcode: str, accounts: List[str]) -> PostJournals:
+        return PostJournals({account: self.open(shortcode, account) for account in accounts})
+
+    def collect_garbage(self) -> int:
+        """Remove journals of posts started more than max_age ago."""
+        if not self.journal_dir.exists():
+            return 0
+
+        removed = 0
+        now = time.time()
+        for path in self.journal_dir.glob("*.json"):
+            try:
+                with open(path, 'r') as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                state = {}
+            try:
+                # Every resume rewrites the journal, so its age is counted from when the post was started
+                created = state.get("created") or path.stat().st_mtime
+            except OSError:
+                continue
+            if now - created < self.max_age:
+                continue
+            # The files it lists are shared media store objects; MediaStore.evict decides when they go
+            path.unlink(missing_ok=True)
+            removed += 1
+
+        # Leftovers from writes interrupted before os.replace
+        for path in self.journal_dir.glob("*.tmp"):
+            if now - path.stat().st_mtime > 3600:
+                path.unlink(missing_ok=True)
+
+        if removed:
+            logger.info(f"Removed {removed} stale journals")
+        return removed
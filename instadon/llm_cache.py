@@ -0,0 +1,155 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from .config import CONFIG
+
+logger = logging.getLogger(__name__)
+
+
+class LLMCache:
+    """Content-addressed on-disk cache for LLM completions.
+
+    Each entry is a small JSON file named after the SHA-256 of (model, prompt
+    template, caption, parameters), so editing a prompt or switching models
+    naturally misses. Entries expire after ``ttl`` seconds and the least
+    recently used ones are evicted once ``max_entries`` is exceeded.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, ttl: Optional[float] = None, max_entries: Optional[int] = None):
+        cache_config = CONFIG["llm_cache"]
+        self.cache_dir = Path(cache_dir or cache_config["dir"])
+        self.ttl = ttl or cache_config["ttl"]
+        self.max_entries = max_entries or cache_config["max_entries"]
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._writes_since_evict = 0
+
+    @staticmethod
+    def make_key(model: str, template: str, text: str, params: Dict[str, Any]) -> str:
+        material = json.dumps({
+            "model": model,
+            "template": hashlib.sha256(template.encode("utf-8")).hexdigest(),
+            "text": hashlib.sha256(text.encode("utf-8")).hexdigest(),
+            "params": params,
+        }, sort_keys=True)
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached completion for key, or None."""
+        path = self._path(key)
+        try:
+            with open(path, 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        if time.time() - entry["created"] > self.ttl:
+            path.unlink(missing_ok=True)
+            with self._lock:
+                self.misses += 1
+            return None
+
+        entry["hits"] = entry.get("hits", 0) + 1
+        self._write(path, entry)
+        with self._lock:
+            self.hits += 1
+        return entry["value"]
+
+    def set(self, key: str, value: str, **metadata):
+        """Store a completion. Metadata (model, template name, ...) is kept for inspection."""
+        entry = dict(metadata, value=value, created=time.time(), hits=0)
+        self._write(self._path(key), entry)
+
+        with self._lock:
+            self._writes_since_evict += 1
+            # Scanning the directory is cheap but not free; do it every few writes
+            should_evict = self._writes_since_evict >= 20
+            if should_evict:
+                self._writes_since_evict = 0
+        if should_evict:
+            self.evict()
+
+    def _write(self, path: Path, entry: Dict[str, Any]):
+        """Atomically write an entry; mtime doubles as the LRU timestamp."""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(fd, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp_name, path)
+
+    def _entries(self):
+        if not self.cache_dir.exists():
+            return []
+        return list(self.cache_dir.glob("*/*.json"))
+
+    def evict(self) -> int:
+        """Drop expired entries and the least recently used ones above max_entries."""
+        now = time.time()
+        removed = 0
+        entries = []
+        for path in self._entries():
+            try:
+                mtime = path.stat().st_mtime
+            except OSError:
+                continue
+            # Entries are rewritten on every hit, so an mtime older than the TTL means expired
+            if now - mtime > self.ttl:
+                path.unlink(missing_ok=True)
+                removed += 1
+            else:
+                entries.append((mtime, path))
+
+        entries.sort()
+        for _, path in entries[:max(0, len(entries) - self.max_entries)]:
+            path.unlink(missing_ok=True)
+            removed += 1
+
+        if removed:
+            logger.info(f"Evicted {removed} LLM cache entries")
+        return removed
+
+    def clear(self) -> int:
+        removed = 0
+        for path in self._entries():
+            path.unlink(missing_ok=True)
+            removed += 1
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit rates for this process plus totals recorded in the cache entries."""
+        entries = 0
+        total_hits = 0
+        size = 0
+        for path in self._entries():
+            try:
+                size += path.stat().st_size
+                with open(path, 'r') as f:
+                    total_hits += json.load(f).get("hits", 0)
+                entries += 1
+            except (OSError, ValueError):
+                continue
+
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "size_bytes": size,
+            "session_hits": self.hits,
+            "session_misses": self.misses,
+            "session_hit_rate": self.hits / lookups if lookups else 0.0,
+            # Every entry was created by one miss
+            "lifetime_hits": total_hits,
+            "lifetime_hit_rate": total_hits / (total_hits + entries) if entries else 0.0,
+        }
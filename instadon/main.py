@@ -5,17 +5,46 @@ CLI interface for InstaDon - Instagram to Mastodon cross-posting tool.
 
 import argparse
 import sys
-from pathlib import Path
+from typing import List, Optional, Tuple
 
-from .core import InstaDon
 
+def main(argv: Optional[List[str]] = None):
+    args = parse_command_line(sys.argv[1:] if argv is None else argv)
+    return args.run(args)
 
-def main():
-    parser = argparse.ArgumentParser(description="Cross-post from Instagram to Mastodon")
+
+def parse_command_line(argv: List[str]) -> argparse.Namespace:
+    """Parse a subcommand, or else the classic `instadon <profile>` form; ``run`` is the function to call.
+
+    A profile named like a command is given after ``--``: ``instadon --account ... -- batch``.
+    """
+    parser, commands = command_parser()
+    if argv[:1] and argv[0] in commands.choices:
+        return parser.parse_args(argv)
+    return post_parser().parse_args(argv)
+
+
+def command_parser() -> Tuple[argparse.ArgumentParser, argparse.Action]:
+    """The parser of the subcommands and its subparsers action."""
+    parser = argparse.ArgumentParser(prog="instadon", description="Cross-post from Instagram to Mastodon")
+    commands = parser.add_subparsers(dest="command", metavar="command")
+    add_batch_parser(commands)
+    add_serve_parser(commands)
+    add_backfill_parser(commands)
+    add_cache_parser(commands)
+    return parser, commands
+
+
+def post_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="instadon", description="Cross-post from Instagram to Mastodon",
+                                     epilog="Other commands: `instadon batch --help`, `instadon serve --help`, "
+                                            "`instadon backfill --help`, `instadon cache --help`. A profile "
+                                            "named like a command goes after `--`, e.g. "
+                                            "`instadon --account you@example.social -- batch`.")
 
     # Create mutually exclusive group for profile vs URL
     source_group = parser.add_mutually_exclusive_group(required=True)
-    source_group.add_argument("profile", nargs="?", help="Instagram profile name to fetch latest post from")
+    source_group.add_argument("profile", nargs="?", help="Instagram profile name to fetch new posts from")
     source_group.add_argument("--url", help="Specific Instagram post URL to cross-post")
 
     parser.add_argument("--visibility", default="public",
@@ -25,43 +54,256 @@ def main():
                        help="Instagram session file name (default: kommen)")
     parser.add_argument("--tracker", default="posted_instagram_ids.txt",
                        help="File to track posted Instagram IDs")
-    parser.add_argument("--account", required=True,
-                       help="Mastodon account to post to (required)")
+    parser.add_argument("--tracker-backend", choices=["text", "sqlite"],
+                       help="Tracker storage backend (default: guessed from --tracker extension)")
+    parser.add_argument("--migrate-tracker", metavar="TEXT_FILE",
+                       help="Import shortcodes from a legacy text tracker file before posting")
+    parser.add_argument("--cursor-file", default="instadon_cursors.json",
+                       help="File storing the newest handled post per profile")
+    parser.add_argument("--account", required=True, action="append",
+                       help="Mastodon account to post to (required; repeat to post to several accounts at once)")
+    parser.set_defaults(run=run_post)
+    return parser
 
-    args = parser.parse_args()
+
+def run_post(args: argparse.Namespace):
+    from .core import InstaDon
 
     try:
-        app = InstaDon(mastodon_account=args.account, session_file=args.session, tracker_file=args.tracker)
+        app = InstaDon(mastodon_account=args.account[0], extra_accounts=args.account[1:], session_file=args.session, tracker_file=args.tracker,
+                       tracker_backend=args.tracker_backend, cursor_file=args.cursor_file)
+
+        if args.migrate_tracker:
+            imported = app.post_tracker.migrate_from_text(args.migrate_tracker)
+            print(f"📥 Imported {imported} shortcodes from {args.migrate_tracker}")
 
-        # Choose between profile latest post or specific URL
+        # Choose between new posts of a profile or specific URL
         if args.url:
-            result = app.post_specific_post(args.url, args.visibility)
+            results = [app.post_specific_post(args.url, args.visibility)]
             source_info = f"URL: {args.url}"
         else:
-            result = app.post_latest_from_profile(args.profile, args.visibility)
+            results = app.post_new_from_profile(args.profile, args.visibility)
             source_info = f"Profile: {args.profile}"
+            if not results:
+                print(f"⏭️  No new posts for {args.profile}")
+
+        for result in results:
+            for account, account_result in result.get("accounts", {args.account[0]: result}).items():
+                print_result(account_result, source_info, account, args.visibility)
+
+    except Exception as e:
+        print(f"❌ Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+def print_result(result, source_info, account, visibility):
+    if result["status"] == "skipped":
+        print(f"⏭️  Post already processed: {result['shortcode']}")
+        print(f"Instagram URL: {result['instagram_url']}")
+    else:
+        thread_length = result.get('thread_length', 1)
+        if thread_length > 1:
+            print(f"✅ Successfully created Mastodon thread with {thread_length} posts!")
+            print(f"Main post ID: {result['post'].get('id')}")
+            print(f"Thread contains {len(result.get('posts', []))} posts total")
+        else:
+            print(f"✅ Successfully created Mastodon post!")
+            print(f"Post ID: {result['post'].get('id')}")
+        print(f"Instagram shortcode: {result['shortcode']}")
+        print(f"Source: {source_info}")
+        print(f"Mastodon account: {account}")
+        print(f"Visibility: {visibility}")
+
+
+def add_batch_parser(commands):
+    parser = commands.add_parser("batch", help="Run a manifest of jobs once",
+                                 description="Run a manifest of (profile, account, visibility) jobs in one process")
+    parser.add_argument("manifest", help="JSON manifest with the jobs to run")
+    parser.add_argument("--workers", type=int,
+                       help="Number of concurrent jobs (default: manifest value or 4)")
+    parser.add_argument("--session",
+                       help="Instagram session file name (default: manifest value or kommen)")
+    parser.add_argument("--tracker",
+                       help="File to track posted Instagram IDs (default: manifest value)")
+    parser.add_argument("--tracker-backend", choices=["text", "sqlite"],
+                       help="Tracker storage backend (default: guessed from --tracker extension)")
+    parser.add_argument("--cursor-file",
+                       help="File storing the newest handled post per profile (default: manifest value)")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                       help="Run all jobs concurrently on one event loop (needs `pip install instadon[async]`)")
+    parser.set_defaults(run=run_batch)
+
 
-        if result["status"] == "skipped":
-            print(f"⏭️  Post already processed: {result['shortcode']}")
-            print(f"Instagram URL: {result['instagram_url']}")
+def run_batch(args: argparse.Namespace):
+    from .batch import job_accounts, run_manifest
+
+    try:
+        reports = run_manifest(args.manifest, session_file=args.session, tracker_file=args.tracker,
+                               tracker_backend=args.tracker_backend, max_workers=args.workers,
+                               cursor_file=args.cursor_file, use_async=args.use_async)
+    except Exception as e:
+        print(f"❌ Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    icons = {"success": "✅", "skipped": "⏭️ ", "error": "❌"}
+    for report in reports:
+        job = report["job"]
+        line = f"{icons.get(report['status'], '?')} {job['profile']} -> {job_accounts(job)} ({report['elapsed']:.1f}s)"
+        if report["status"] == "error":
+            line += f": {report['error']}"
+        elif report["results"]:
+            line += ": " + ", ".join(f"{result['shortcode']} ({result['status']})" for result in report["results"])
         else:
-            thread_length = result.get('thread_length', 1)
-            if thread_length > 1:
-                print(f"✅ Successfully created Mastodon thread with {thread_length} posts!")
-                print(f"Main post ID: {result['post'].get('id')}")
-                print(f"Thread contains {len(result.get('posts', []))} posts total")
-            else:
-                print(f"✅ Successfully created Mastodon post!")
-                print(f"Post ID: {result['post'].get('id')}")
-            print(f"Instagram shortcode: {result['shortcode']}")
-            print(f"Source: {source_info}")
-            print(f"Mastodon account: {args.account}")
-            print(f"Visibility: {args.visibility}")
+            line += ": no new posts"
+        print(line)
+
+    total = sum(report["elapsed"] for report in reports)
+    failed = sum(1 for report in reports if report["status"] == "error")
+    print(f"{len(reports)} jobs, {failed} failed, {total:.1f}s of job time")
+    if failed:
+        sys.exit(1)
+
+
+def add_serve_parser(commands):
+    parser = commands.add_parser("serve", help="Poll a manifest's profiles continuously",
+                                 description="Keep running and poll the manifest's profiles on adaptive intervals")
+    parser.add_argument("manifest", help="JSON manifest with the jobs to poll (same format as `instadon batch`)")
+    parser.add_argument("--workers", type=int,
+                       help="Number of concurrent polls (default: manifest value or 4)")
+    parser.add_argument("--min-interval", type=float,
+                       help="Shortest poll interval in seconds (default: 300)")
+    parser.add_argument("--max-interval", type=float,
+                       help="Longest poll interval in seconds (default: 3600)")
+    parser.add_argument("--metrics-port", type=int,
+                       help="Serve Prometheus metrics on this port at /metrics")
+    parser.add_argument("--metrics-file",
+                       help="Append timing spans and counters to this file as JSON lines")
+    parser.set_defaults(run=run_serve)
+
 
+def run_serve(args: argparse.Namespace):
+    from .batch import BatchRunner, load_manifest
+    from .daemon import Daemon
+    from .metrics import MetricsServer, get_metrics
+
+    metrics = get_metrics()
+    if args.metrics_file:
+        metrics.jsonl_file = args.metrics_file
+
+    try:
+        manifest = load_manifest(args.manifest)
+        runner = BatchRunner(
+            session_file=manifest.get("session", "kommen"),
+            tracker_file=manifest.get("tracker", "posted_instagram_ids.txt"),
+            tracker_backend=manifest.get("tracker_backend"),
+            max_workers=args.workers or manifest.get("workers", 4),
+            cursor_file=manifest.get("cursor_file", "instadon_cursors.json"),
+        )
+        # Build the shared clients up front so configuration errors surface immediately
+        runner.instagram
+        runner.text_processor
+        server = MetricsServer(metrics, args.metrics_port).start() if args.metrics_port else None
+        try:
+            Daemon(runner, manifest["jobs"], min_interval=args.min_interval, max_interval=args.max_interval).run()
+        finally:
+            if server:
+                server.stop()
+    except Exception as e:
+        print(f"❌ Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+def add_backfill_parser(commands):
+    parser = commands.add_parser("backfill", help="Cross-post a profile's older posts",
+                                 description="Cross-post a profile's older posts, newest first, at a limited pace")
+    parser.add_argument("profile", help="Instagram profile name")
+    parser.add_argument("--since", required=True, type=date_argument,
+                       help="Oldest post date to include (YYYY-MM-DD, UTC)")
+    parser.add_argument("--account", required=True, action="append",
+                       help="Mastodon account to post to (repeat to post to several accounts at once)")
+    parser.add_argument("--visibility", default="public",
+                       choices=["public", "unlisted", "private", "direct"],
+                       help="Mastodon post visibility (default: public)")
+    parser.add_argument("--posts-per-hour", type=float,
+                       help="Posting pace (default: 20, or INSTADON_BACKFILL_POSTS_PER_HOUR)")
+    parser.add_argument("--checkpoint",
+                       help="File to resume an interrupted backfill from (default: in the cache directory)")
+    parser.add_argument("--session", default="kommen",
+                       help="Instagram session file name (default: kommen)")
+    parser.add_argument("--tracker", default="posted_instagram_ids.txt",
+                       help="File to track posted Instagram IDs")
+    parser.add_argument("--tracker-backend", choices=["text", "sqlite"],
+                       help="Tracker storage backend (default: guessed from --tracker extension)")
+    parser.add_argument("--cursor-file", default="instadon_cursors.json",
+                       help="File storing the newest handled post per profile")
+    parser.set_defaults(run=run_backfill)
+
+
+def run_backfill(args: argparse.Namespace):
+    from .backfill import Backfill
+    from .core import InstaDon
+
+    try:
+        app = InstaDon(mastodon_account=args.account[0], extra_accounts=args.account[1:], session_file=args.session,
+                       tracker_file=args.tracker, tracker_backend=args.tracker_backend, cursor_file=args.cursor_file)
+        report = Backfill(app, args.profile, args.since, args.visibility, posts_per_hour=args.posts_per_hour,
+                          checkpoint_file=args.checkpoint).run()
+    except KeyboardInterrupt:
+        print("⏸️  Interrupted - run the same command again to resume", file=sys.stderr)
+        sys.exit(130)
     except Exception as e:
         print(f"❌ Error: {e}", file=sys.stderr)
         sys.exit(1)
 
+    for result in report["results"]:
+        print(f"{'⏭️ ' if result['status'] == 'skipped' else '✅'} {result['shortcode']} ({result['status']})")
+    print(f"{report['posted']} posts cross-posted from {args.profile}, {len(report['failed'])} failed")
+    if report["failed"]:
+        print(f"Retry failed posts with `instadon --url`: {', '.join(report['failed'])}")
+        sys.exit(1)
+
+
+def date_argument(value: str):
+    from datetime import datetime, timezone
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid date '{value}', expected YYYY-MM-DD")
+
+
+def add_cache_parser(commands):
+    parser = commands.add_parser("cache", help="Inspect and manage the LLM response cache",
+                                 description="Inspect and manage the LLM response cache")
+    subparsers = parser.add_subparsers(dest="action", required=True)
+    subparsers.add_parser("stats", help="Show cache size and hit rates")
+    subparsers.add_parser("clear", help="Remove all cached responses")
+    warm_parser = subparsers.add_parser("warm", help="Pre-compute responses for captions")
+    warm_parser.add_argument("captions", help="JSON file with a list of caption strings")
+    parser.set_defaults(run=run_cache)
+
+
+def run_cache(args: argparse.Namespace):
+    from .llm_cache import LLMCache
+    cache = LLMCache()
+
+    if args.action == "stats":
+        stats = cache.stats()
+        print(f"Entries: {stats['entries']} ({stats['size_bytes'] / 1024:.1f} KiB) in {cache.cache_dir}")
+        print(f"Lifetime hits: {stats['lifetime_hits']} (hit rate {stats['lifetime_hit_rate']:.0%})")
+    elif args.action == "clear":
+        print(f"Removed {cache.clear()} cached responses")
+    elif args.action == "warm":
+        import json
+        from .text_processor import TextProcessor
+
+        with open(args.captions, 'r') as f:
+            captions = json.load(f)
+        processor = TextProcessor(cache=cache)
+        processor.warm_cache(captions)
+        stats = cache.stats()
+        print(f"Processed {len(captions)} captions: {stats['session_hits']} already cached, "
+              f"{stats['session_misses']} fetched")
+
 
 if __name__ == "__main__":
     main()
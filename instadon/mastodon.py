@@ -1,14 +1,33 @@
 import requests
 import logging
-from typing import List, Optional, Dict, Any
+import hashlib
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Union
 from .config import CONFIG
+from .http_client import HttpClient, get_http_client, redact_headers
+from .instance import InstanceCache, InstanceCapabilities, get_instance_cache
+from .media_store import MediaStore, get_media_store
+from .metrics import get_metrics
+from .multipart import MultipartEncoder
+from .thread_plan import ThreadPart, plan_thread
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-class MastodonClient:
-    def __init__(self, account: str):
+class MastodonAccount:
+    """One account on a Mastodon instance, as far as it doesn't depend on how requests are sent.
+
+    Holds the credentials, reuse of unattached uploads, which media are
+    still processing and the layout of threads. MastodonClient and
+    AsyncMastodonClient add the requests, blocking or as coroutines.
+    """
+
+    def __init__(self, account: str, media_store: Optional[MediaStore] = None,
+                 instances: Optional[InstanceCache] = None):
         accounts = CONFIG["mastodon"]["accounts"]
         if account not in accounts:
             available_accounts = list(accounts.keys())
@@ -22,48 +41,205 @@ class MastodonClient:
         if not self.access_token:
             raise ValueError(f"No access token configured for account '{account}'")
         
+        self.media_store = media_store or get_media_store()
+        self.instances = instances or get_instance_cache()
+        # Media IDs belong to an account, so upload reuse is tracked per instance and account
+        self.upload_target = f"{self.instance}|{account}"
         self.headers = {
             "Authorization": f"Bearer {self.access_token}",
             "Accept": "application/json"
         }
         
+        # Media IDs that Mastodon accepted with 202 and is still processing
+        self._pending_media = set()
+        self._pending_lock = threading.Lock()
+        # Guards the in_use sets passed to upload_media
+        self._in_use_lock = threading.Lock()
+
+    @staticmethod
+    def _upload_key(digest: str, description: str) -> str:
+        return f"{digest}:{hashlib.sha256((description or '').encode('utf-8')).hexdigest()[:16]}"
+
+    def _reusable_media_id(self, upload_key: str, file_path: str, in_use: Optional[Set[str]]) -> Optional[str]:
+        """An unattached upload of the same bytes and description that isn't in in_use (claimed for it)."""
+        cached_id = self.media_store.cached_media_id(self.upload_target, upload_key)
+        if cached_id and in_use is not None:
+            with self._in_use_lock:
+                if cached_id in in_use:
+                    cached_id = None
+                else:
+                    in_use.add(cached_id)
+        if cached_id:
+            get_metrics().increment("cache_hits", cache="media_upload")
+            logger.info(f"Reusing uploaded media {cached_id} for {file_path}")
+            self.track_pending([cached_id])
+        return cached_id
+
+    def _uploaded(self, upload_key: str, media_id: str, status_code: int, in_use: Optional[Set[str]]):
+        if in_use is not None:
+            # Before it can be found in the store, so no concurrent upload of the same bytes reuses it
+            with self._in_use_lock:
+                in_use.add(media_id)
+        self.media_store.remember_media_id(self.upload_target, upload_key, media_id)
+        if status_code == 202:
+            logger.info(f"Media {media_id} accepted, processing asynchronously")
+            self.track_pending([media_id])
+
+    def track_pending(self, media_ids: List[str]):
+        """Treat media_ids as possibly still processing (e.g. uploaded by an earlier run)."""
+        with self._pending_lock:
+            self._pending_media.update(media_ids)
+
+    def _still_pending(self, media_ids: List[str]) -> List[str]:
+        with self._pending_lock:
+            return [media_id for media_id in media_ids if media_id in self._pending_media]
+
+    def _processed(self, media_id: str, response) -> bool:
+        """Whether the answer to ``GET /api/v1/media/:id`` says media_id is ready; raises on errors."""
+        if response.status_code == 206 or (response.status_code == 200 and not response.json().get("url")):
+            return False
+        response.raise_for_status()
+        logger.info(f"Media {media_id} finished processing")
+        with self._pending_lock:
+            self._pending_media.discard(media_id)
+        return True
+
+    def _status_data(self, status: str, media_ids: List[str], visibility: str,
+                     in_reply_to_id: Optional[str]) -> Dict[str, Any]:
+        data = {
+            "status": status,
+            "media_ids": media_ids,
+            "visibility": visibility
+        }
+        
+        if in_reply_to_id:
+            data["in_reply_to_id"] = in_reply_to_id
+        return data
+
+    def _status_headers(self) -> Dict[str, str]:
+        # Lets Mastodon drop duplicates if a retried request had actually gone through
+        return dict(self.headers, **{"Idempotency-Key": str(uuid.uuid4())})
+
+    def _posted(self, media_ids: List[str]):
+        # Attached media can't be reused for another status
+        if media_ids:
+            self.media_store.forget_media_ids(self.upload_target, media_ids)
+
+    def _thread_parts(self, status: str, media_count: int, visibility: str, capabilities: InstanceCapabilities,
+                      existing_posts: Optional[List[Dict[str, Any]]]) -> List[ThreadPart]:
+        """The parts of the thread still to post (see create_post_thread)."""
+        parts = plan_thread(status, media_count, visibility, capabilities)
+        if len(parts) > 1:
+            logger.info(f"Creating thread with {len(parts)} posts for {media_count} media files")
+        if existing_posts:
+            logger.info(f"Resuming thread after {len(existing_posts)} already published posts")
+        return parts[len(existing_posts or []):]
+
+
+class MastodonClient(MastodonAccount):
+    def __init__(self, account: str, http: Optional[HttpClient] = None, media_store: Optional[MediaStore] = None,
+                 instances: Optional[InstanceCache] = None):
+        super().__init__(account, media_store, instances)
+        self.http = http or get_http_client()
         logger.info(f"Initialized Mastodon client for account '{account}' at {self.instance}")
     
-    def upload_media(self, file_path: str, description: str) -> str:
-        """Upload media to Mastodon and return media ID."""
+    @property
+    def capabilities(self) -> InstanceCapabilities:
+        """Character, attachment and media limits of the instance (cached, shared per instance)."""
+        return self.instances.capabilities(self.instance, self.http)
+
+    def media_limits(self) -> Dict[str, Any]:
+        """The instance's attachment limits (``configuration.media_attachments``)."""
+        return self.capabilities.media_limits
+
+    def upload_media(self, file_path: str, description: str, in_use: Optional[Set[str]] = None) -> str:
+        """Upload media to Mastodon and return media ID.
+
+        Returns as soon as the upload is accepted. If Mastodon is still
+        processing the file (HTTP 202), the ID is remembered and
+        ``create_post`` waits for it via ``wait_for_media``.
+
+        ``in_use`` holds the IDs of the status (or thread) being built; an
+        unattached upload is only reused if it isn't among them, so the same
+        bytes twice in one carousel become two attachments. The returned ID
+        is added to it.
+        """
         url = f"{self.instance}/api/v2/media"
-        
-        with open(file_path, 'rb') as f:
-            files = {'file': f}
-            data = {'description': description}
-            
-            response = requests.post(url, headers=self.headers, files=files, data=data)
+
+        # Identical bytes with the same description that were uploaded but never attached
+        # (e.g. by a failed run) are reused instead of being sent again
+        upload_key = self._upload_key(MediaStore.digest_of(file_path), description)
+        cached_id = self._reusable_media_id(upload_key, file_path, in_use)
+        if cached_id:
+            return cached_id
+
+        # Stream the file from disk instead of building the whole body in memory
+        body = MultipartEncoder({'description': description}, {'file': file_path}, CONFIG["media"]["chunk_size"])
+        headers = dict(self.headers, **{"Content-Type": body.content_type})
+
+        metrics = get_metrics()
+        with metrics.span("upload"):
+            response = self.http.post(url, headers=headers, data=body)
             response.raise_for_status()
-            
-            return response.json()['id']
+        metrics.increment("bytes_uploaded", len(body))
+
+        media_id = response.json()['id']
+        self._uploaded(upload_key, media_id, response.status_code, in_use)
+        return media_id
+
+    def wait_for_media(self, media_ids: List[str], timeout: Optional[float] = None):
+        """Block until every still-processing media attachment in media_ids is ready.
+
+        Polls ``GET /api/v1/media/:id`` with a growing interval; all pending IDs
+        are checked on each round, so the wait ends as soon as the slowest
+        attachment finishes.
+        """
+        pending = self._still_pending(media_ids)
+        if not pending:
+            return
+
+        media_config = CONFIG["media"]
+        timeout = timeout or media_config["processing_timeout"]
+        interval = media_config["processing_poll_interval"]
+        deadline = time.monotonic() + timeout
+
+        with get_metrics().span("media_processing"):
+            while pending:
+                still_pending = []
+                for media_id in pending:
+                    response = self.http.get(f"{self.instance}/api/v1/media/{media_id}", headers=self.headers)
+                    if not self._processed(media_id, response):
+                        still_pending.append(media_id)
+                pending = still_pending
+
+                if pending:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError(f"Media still processing after {timeout:.0f}s: {pending}")
+                    time.sleep(min(interval, remaining))
+                    interval = min(interval * 1.5, media_config["processing_max_poll_interval"])
     
     def create_post(self, status: str, media_ids: List[str], visibility: str = "public", in_reply_to_id: Optional[str] = None) -> Dict[str, Any]:
         """Create a post in Mastodon."""
         url = f"{self.instance}/api/v1/statuses"
+
+        # Attachments still being transcoded would make the post fail or go out without them
+        self.wait_for_media(media_ids)
         
-        data = {
-            "status": status,
-            "media_ids": media_ids,
-            "visibility": visibility
-        }
-        
-        if in_reply_to_id:
-            data["in_reply_to_id"] = in_reply_to_id
+        data = self._status_data(status, media_ids, visibility, in_reply_to_id)
         
         logger.info(f"Creating Mastodon post at: {url}")
-        logger.info(f"Request headers: {self.headers}")
-        logger.info(f"Request data: {data}")
+        logger.debug(f"Request headers: {redact_headers(self.headers)}")
+        logger.debug(f"Request data: {data}")
         
+        headers = self._status_headers()
+
         try:
-            response = requests.post(url, headers=self.headers, json=data)
+            with get_metrics().span("post_status", reply=bool(in_reply_to_id)):
+                response = self.http.post(url, headers=headers, json=data)
             
             logger.info(f"Response status code: {response.status_code}")
-            logger.info(f"Response headers: {dict(response.headers)}")
+            logger.debug(f"Response headers: {dict(response.headers)}")
             
             if response.status_code != 200:
                 logger.error(f"HTTP {response.status_code} error from Mastodon API")
@@ -79,7 +255,9 @@ class MastodonClient:
             response.raise_for_status()
             
             result = response.json()
-            logger.info(f"Mastodon API response: {result}")
+            logger.debug(f"Mastodon API response: {result}")
+
+            self._posted(media_ids)
             
             return result
             
@@ -89,39 +267,32 @@ class MastodonClient:
                 logger.error(f"Error response text: {e.response.text}")
             raise
 
-    def create_post_thread(self, status: str, media_ids: List[str], visibility: str = "public") -> List[Dict[str, Any]]:
-        """Create a thread of posts if media exceeds Mastodon's 4-attachment limit."""
-        MAX_MEDIA_PER_POST = 4
-        posts = []
+    def create_post_thread(self, status: str, media_ids: Sequence[Union[str, Future]], visibility: str = "public",
+                           existing_posts: Optional[List[Dict[str, Any]]] = None,
+                           on_post: Optional[Callable[[Dict[str, Any]], None]] = None) -> List[Dict[str, Any]]:
+        """Create a thread of posts if media or text exceed the instance's limits.
+
+        The layout comes from ``plan_thread``. ``media_ids`` may hold Futures
+        of uploads still in progress: each part is posted as soon as its own
+        media (and the part it replies to) are ready, so later uploads
+        overlap with posting the first parts.
+
+        ``existing_posts`` are thread parts already published by an earlier,
+        interrupted attempt; they are not posted again and the thread
+        continues below the last of them. ``on_post`` is called after each
+        new part is published.
+        """
+        posts = list(existing_posts or [])
         
-        if len(media_ids) <= MAX_MEDIA_PER_POST:
-            # Single post is sufficient
-            post = self.create_post(status, media_ids, visibility)
+        for part in self._thread_parts(status, len(media_ids), visibility, self.capabilities, posts):
+            chunk = [media_id.result() if isinstance(media_id, Future) else media_id
+                     for media_id in media_ids[part.media_start:part.media_end]]
+            # Each reply answers the previous post to create a chain
+            post = self.create_post(part.status, chunk, part.visibility, posts[-1]["id"] if part.reply else None)
             posts.append(post)
-            return posts
-        
-        # Split media into chunks of 4
-        media_chunks = [media_ids[i:i + MAX_MEDIA_PER_POST] for i in range(0, len(media_ids), MAX_MEDIA_PER_POST)]
-        
-        logger.info(f"Creating thread with {len(media_chunks)} posts for {len(media_ids)} media files")
-        
-        # Create first post with original status and visibility
-        first_chunk = media_chunks[0]
-        first_post = self.create_post(status, first_chunk, visibility)
-        posts.append(first_post)
-        
-        # Create reply posts for remaining media chunks
-        reply_to_id = first_post["id"]
-        for i, chunk in enumerate(media_chunks[1:], 1):
-            # Reply posts are unlisted to avoid spam
-            reply_visibility = "unlisted"
-            reply_status = f"({i + 1}/{len(media_chunks)})"  # Simple continuation indicator
-            
-            reply_post = self.create_post(reply_status, chunk, reply_visibility, reply_to_id)
-            posts.append(reply_post)
-            
-            # Next reply should reply to this post to create a chain
-            reply_to_id = reply_post["id"]
+            if on_post:
+                on_post(post)
         
-        logger.info(f"Successfully created thread with {len(posts)} posts")
+        if len(posts) > 1:
+            logger.info(f"Successfully created thread with {len(posts)} posts")
         return posts
@@ -1,17 +1,24 @@
 import requests
-import tempfile
 import logging
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 from .config import CONFIG
+from .http_client import get_http_client
+from .media_store import MediaStore, StoreLease, get_media_store
+from .metrics import get_metrics
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def download_from_cobalt(url: str) -> Dict[str, Any]:
-    """Download media info using Cobalt API."""
-    cobalt_url = CONFIG["cobalt"]["url"]
+def download_from_cobalt(url: str, cobalt_url: Optional[str] = None,
+                         max_retries: Optional[int] = None) -> Dict[str, Any]:
+    """Download media info using Cobalt API (the first configured endpoint unless cobalt_url is given).
+
+    Posts are resolved with failover between endpoints by
+    ``resolver.get_media_resolver().resolve(post, download_from_cobalt)``.
+    """
+    cobalt_url = cobalt_url or CONFIG["cobalt"]["urls"][0]
 
     logger.info(f"Requesting media from Cobalt API: {cobalt_url}")
     logger.info(f"Instagram URL: {url}")
@@ -20,18 +27,22 @@ def download_from_cobalt(url: str) -> Dict[str, Any]:
     headers = {"Content-Type": "application/json",
                "Accept": "application/json"}
 
-    logger.info(f"Request payload: {payload}")
-    logger.info(f"Request headers: {headers}")
+    logger.debug(f"Request payload: {payload}")
+    logger.debug(f"Request headers: {headers}")
 
     try:
-        response = requests.post(
-            cobalt_url,
-            headers=headers,
-            json=payload
-        )
+        with get_metrics().span("cobalt_resolve"):
+            response = get_http_client().post(
+                cobalt_url,
+                headers=headers,
+                json=payload,
+                max_retries=max_retries,
+                # Resolving a URL has no side effects, so a request that timed out can be sent again
+                idempotent=True
+            )
 
         logger.info(f"Response status code: {response.status_code}")
-        logger.info(f"Response headers: {dict(response.headers)}")
+        logger.debug(f"Response headers: {dict(response.headers)}")
 
         if response.status_code != 200:
             logger.error(f"HTTP {response.status_code} error from Cobalt API")
@@ -40,7 +51,7 @@ def download_from_cobalt(url: str) -> Dict[str, Any]:
         response.raise_for_status()
 
         result = response.json()
-        logger.info(f"Cobalt API response: {result}")
+        logger.debug(f"Cobalt API response: {result}")
 
         return result
 
@@ -50,38 +61,42 @@ def download_from_cobalt(url: str) -> Dict[str, Any]:
             logger.error(f"Error response text: {e.response.text}")
         raise
 
-def url_to_file(url: str, suffix: str = None) -> Path:
-    """Download a file from URL to temporary file."""
-    response = requests.get(url)
-    response.raise_for_status()
-
-    # Auto-detect file extension if not provided
-    if suffix is None:
-        content_type = response.headers.get('content-type', '')
-        if 'video' in content_type:
-            suffix = ".mp4"
-        elif 'image' in content_type:
-            suffix = ".jpeg"
-        else:
-            # Default based on URL extension or fallback to .jpeg
-            if any(ext in url.lower() for ext in ['.mp4', '.mov', '.avi']):
-                suffix = ".mp4"
-            else:
-                suffix = ".jpeg"
+def url_to_file(url: str, suffix: str = None, chunk_size: Optional[int] = None,
+                store: Optional[MediaStore] = None, lease: Optional[StoreLease] = None) -> Path:
+    """Stream a file from URL into the content-addressed media store (pinned by lease, if given)."""
+    chunk_size = chunk_size or CONFIG["media"]["chunk_size"]
+    store = store or get_media_store()
 
-    temp_file = tempfile.NamedTemporaryFile(suffix=suffix, delete=False)
-    temp_file.write(response.content)
-    temp_file.close()
-
-    return Path(temp_file.name)
+    metrics = get_metrics()
+    with metrics.span("download"), get_http_client().get(url, stream=True) as response:
+        response.raise_for_status()
 
-def process_cobalt_result(result: Dict[str, Any]) -> List[Path]:
-    """Process Cobalt download result and return list of file paths."""
+        # Auto-detect file extension if not provided
+        if suffix is None:
+            content_type = response.headers.get('content-type', '')
+            if 'video' in content_type:
+                suffix = ".mp4"
+            elif 'image' in content_type:
+                suffix = ".jpeg"
+            else:
+                # Default based on URL extension or fallback to .jpeg
+                if any(ext in url.lower() for ext in ['.mp4', '.mov', '.avi']):
+                    suffix = ".mp4"
+                else:
+                    suffix = ".jpeg"
+
+        expected_size = int(response.headers.get('content-length') or 0) or None
+        path = store.put_chunks(response.iter_content(chunk_size=chunk_size), suffix, expected_size, lease)
+    metrics.increment("bytes_downloaded", path.stat().st_size)
+    return path
+
+def cobalt_media_items(result: Dict[str, Any]) -> List[Tuple[str, Optional[str]]]:
+    """Turn a Cobalt result into an ordered list of (url, suffix) downloads."""
     status = result.get("status")
     logger.info(f"Processing Cobalt result with status: {status}")
 
     if status == "picker":
-        # Filter for photos and videos and download them
+        # Filter for photos and videos
         picker_items = result.get("picker", [])
         logger.info(f"Found {len(picker_items)} items in picker")
 
@@ -92,13 +107,13 @@ def process_cobalt_result(result: Dict[str, Any]) -> List[Path]:
             item_type = media_item.get("type", "unknown")
             logger.info(f"Media {i+1} ({item_type}): {media_item.get('url', 'No URL')}")
 
-        return [url_to_file(media_item["url"]) for media_item in media_items]
+        return [(media_item["url"], None) for media_item in media_items]
 
     elif status == "tunnel":
         # Single file download
         tunnel_url = result.get("url")
         logger.info(f"Single file download URL: {tunnel_url}")
-        return [url_to_file(tunnel_url)]
+        return [(tunnel_url, None)]
 
     elif status == "redirect":
         # Direct file download with redirect URL
@@ -115,9 +130,13 @@ def process_cobalt_result(result: Dict[str, Any]) -> List[Path]:
             elif filename.lower().endswith(('.jpg', '.jpeg')):
                 suffix = ".jpeg"
         
-        return [url_to_file(redirect_url, suffix)]
+        return [(redirect_url, suffix)]
 
     else:
         logger.warning(f"Unknown status '{status}' in Cobalt result")
         logger.warning(f"Full result: {result}")
         return []
+
+def process_cobalt_result(result: Dict[str, Any]) -> List[Path]:
+    """Process Cobalt download result and return list of file paths."""
+    return [url_to_file(url, suffix) for url, suffix in cobalt_media_items(result)]
@@ -0,0 +1,288 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter
+from functools import partial
+from pathlib import Path
+from typing import AsyncIterable, Dict, Iterable, List, Optional, Tuple, Union
+
+from .config import CONFIG
+from .scratch import ScratchArea, ScratchFile
+
+logger = logging.getLogger(__name__)
+
+# Seconds between sweeps of incoming/ for files of processes that crashed
+SWEEP_INTERVAL = 600
+
+
+class StoreLease:
+    """Store objects in use, kept from eviction until the lease is released.
+
+    Use as a context manager around everything that reads the files, e.g.
+    downloading, transcoding and uploading one post's media.
+    """
+
+    def __init__(self, store: "MediaStore"):
+        self.store = store
+        self.paths: List[Path] = []
+
+    def pin(self, path: Path) -> bool:
+        """Keep path until release; returns whether it (still) exists."""
+        path = Path(path)
+        self.paths.append(path)
+        return self.store._pin(path)
+
+    def release(self):
+        paths, self.paths = self.paths, []
+        self.store._unpin(paths)
+
+    def __enter__(self) -> "StoreLease":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class MediaStore:
+    """Content-addressed store for downloaded media.
+
+    Files live under ``objects/<first two hex digits>/<sha256><suffix>``, so
+    the same bytes downloaded twice (a retry, or one post sent to several
+    accounts) are stored once. The least recently used objects are evicted
+    when the store grows beyond ``max_bytes``; objects pinned by a
+    ``lease()`` are never evicted. Files are written in ``incoming/``, a
+    ScratchArea with its own quota, and moved into place once complete.
+
+    The store also remembers which Mastodon media ID an object was uploaded
+    as, per instance and account. Mastodon only lets a media ID be attached
+    to one status and deletes unattached media after about a day, so an ID
+    is reused only until it is attached or ``upload_ttl`` runs out.
+    """
+
+    def __init__(self, root: Optional[str] = None, max_bytes: Optional[int] = None, upload_ttl: Optional[float] = None):
+        store_config = CONFIG["media_store"]
+        self.root = Path(root or store_config["dir"])
+        self.max_bytes = max_bytes or store_config["max_bytes"]
+        self.upload_ttl = upload_ttl or store_config["upload_ttl"]
+        self.objects_dir = self.root / "objects"
+        self.incoming_dir = self.root / "incoming"
+        self.uploads_file = self.root / "uploads.json"
+        self._lock = threading.Lock()
+        # Pins per object and the store's size; the size is counted once, then kept up to date
+        self._objects_lock = threading.Lock()
+        self._pins: Counter = Counter()
+        self._size: Optional[int] = None
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        # Sweeps what crashed runs left in incoming/
+        self.scratch = ScratchArea(str(self.incoming_dir))
+        self._next_sweep = time.monotonic() + SWEEP_INTERVAL
+
+    def _object_path(self, digest: str, suffix: str) -> Path:
+        return self.objects_dir / digest[:2] / f"{digest}{suffix}"
+
+    def lease(self) -> StoreLease:
+        return StoreLease(self)
+
+    def _pin(self, path: Path) -> bool:
+        with self._objects_lock:
+            self._pins[path] += 1
+            return path.exists()
+
+    def _unpin(self, paths: List[Path]):
+        with self._objects_lock:
+            self._pins.subtract(paths)
+            for path in paths:
+                if self._pins[path] <= 0:
+                    del self._pins[path]
+
+    def _commit(self, source: Union[str, ScratchFile], digest: str, suffix: str,
+                lease: Optional[StoreLease] = None) -> Path:
+        """Move a finished file (a path or a scratch handle) from incoming/ to its object path."""
+        path = self._object_path(digest, suffix)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Pinned before it is in place, so no other thread's eviction can take it away
+        exists = lease.pin(path) if lease is not None else path.exists()
+        if exists:
+            logger.info(f"Media {digest[:12]} already in store")
+            if not isinstance(source, ScratchFile):
+                os.unlink(source)
+            os.utime(path)
+            return path
+        if isinstance(source, ScratchFile):
+            source.commit(path)
+        else:
+            os.replace(source, path)
+        with self._objects_lock:
+            if self._size is not None:
+                self._size += path.stat().st_size
+        return path
+
+    def put_chunks(self, chunks: Iterable[bytes], suffix: str = "", expected_size: Optional[int] = None,
+                   lease: Optional[StoreLease] = None) -> Path:
+        """Write streamed bytes into the store and return the object path.
+
+        expected_size (e.g. a Content-Length) lets a large download wait for
+        room in the scratch area before it starts. With a lease, the object
+        is pinned until the lease is released.
+        """
+        with self.scratch.file(suffix, expected_size) as f:
+            for chunk in chunks:
+                f.write(chunk)
+            path = self._commit(f, f.sha256.hexdigest(), suffix, lease)
+
+        self.evict(keep=path)
+        return path
+
+    async def put_async_chunks(self, chunks: AsyncIterable[bytes], suffix: str = "",
+                               expected_size: Optional[int] = None, lease: Optional[StoreLease] = None) -> Path:
+        """put_chunks for an async stream (e.g. an httpx response body)."""
+        with self.scratch.file(suffix, expected_size) as f:
+            async for chunk in chunks:
+                await f.write_async(chunk)
+            # Moving the file into place and evicting (which may scan the store) are kept off the event loop
+            loop = asyncio.get_running_loop()
+            path = await loop.run_in_executor(None, self._commit, f, f.sha256.hexdigest(), suffix, lease)
+
+        await loop.run_in_executor(None, partial(self.evict, keep=path))
+        return path
+
+    def put_file(self, source: Path, suffix: str = "", move: bool = False,
+                 lease: Optional[StoreLease] = None) -> Path:
+        """Add an existing file to the store under suffix.
+
+        With ``move`` the source (e.g. a transcoder output in ``incoming/``) is
+        moved into place; otherwise it is hard-linked, or copied where links
+        aren't possible, so a store object can get a second suffix cheaply.
+        """
+        source = Path(source)
+        digest = self.digest_of(source)
+        if move:
+            path = self._commit(str(source), digest, suffix, lease)
+        else:
+            with self.scratch.path(suffix, reserve=source.stat().st_size) as tmp_path:
+                tmp_path.unlink()
+                try:
+                    os.link(source, tmp_path)
+                except OSError:
+                    shutil.copyfile(source, tmp_path)
+                path = self._commit(str(tmp_path), digest, suffix, lease)
+
+        self.evict(keep=path)
+        return path
+
+    @staticmethod
+    def digest_of(path: Path) -> str:
+        """SHA-256 of a file; free for store objects, whose name is the digest."""
+        path = Path(path)
+        stem = path.name.split(".", 1)[0]
+        if len(stem) == 64 and path.parent.name == stem[:2]:
+            return stem
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _scan(self) -> Tuple[List[Tuple[float, int, Path]], int]:
+        objects = []
+        total = 0
+        for path in self.objects_dir.glob("*/*"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            objects.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        return objects, total
+
+    def evict(self, keep: Optional[Path] = None) -> int:
+        """Remove least recently used objects until the store fits in max_bytes.
+
+        The store is only scanned when it is over max_bytes (or its size isn't
+        known yet). Pinned objects and keep are never removed.
+        """
+        removed = 0
+        with self._objects_lock:
+            if self._size is None or self._size > self.max_bytes:
+                # Also picks up what other processes sharing the store added or removed
+                objects, self._size = self._scan()
+                for _, size, path in sorted(objects):
+                    if self._size <= self.max_bytes:
+                        break
+                    if path == keep or self._pins[path] > 0:
+                        continue
+                    path.unlink(missing_ok=True)
+                    self._size -= size
+                    removed += 1
+        if removed:
+            logger.info(f"Evicted {removed} media files from store")
+
+        # Scratch files left behind by a crash (of another process, while this one keeps running)
+        if time.monotonic() >= self._next_sweep:
+            self._next_sweep = time.monotonic() + SWEEP_INTERVAL
+            self.scratch.sweep()
+        return removed
+
+    def _load_uploads(self) -> Dict[str, Dict[str, Dict]]:
+        try:
+            with open(self.uploads_file, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_uploads(self, uploads: Dict[str, Dict[str, Dict]]):
+        fd, tmp_name = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        with os.fdopen(fd, 'w') as f:
+            json.dump(uploads, f)
+        os.replace(tmp_name, self.uploads_file)
+
+    def cached_media_id(self, target: str, key: str) -> Optional[str]:
+        """Return a still-usable media ID for key on target (instance and account)."""
+        with self._lock:
+            entry = self._load_uploads().get(target, {}).get(key)
+        if entry and time.time() - entry["uploaded"] < self.upload_ttl:
+            return entry["id"]
+        return None
+
+    def remember_media_id(self, target: str, key: str, media_id: str):
+        with self._lock:
+            uploads = self._load_uploads()
+            entries = uploads.setdefault(target, {})
+            now = time.time()
+            # Drop expired entries while we're rewriting the file anyway
+            for old_key in [k for k, entry in entries.items() if now - entry["uploaded"] >= self.upload_ttl]:
+                del entries[old_key]
+            entries[key] = {"id": media_id, "uploaded": now}
+            self._save_uploads(uploads)
+
+    def forget_media_ids(self, target: str, media_ids: List[str]):
+        """Media IDs attached to a status can't be attached again."""
+        media_ids = set(media_ids)
+        with self._lock:
+            uploads = self._load_uploads()
+            entries = uploads.get(target, {})
+            attached = [key for key, entry in entries.items() if entry["id"] in media_ids]
+            if not attached:
+                return
+            for key in attached:
+                del entries[key]
+            self._save_uploads(uploads)
+
+
+_default_store: Optional[MediaStore] = None
+_default_store_lock = threading.Lock()
+
+
+def get_media_store() -> MediaStore:
+    """Return the process-wide MediaStore, creating it on first use."""
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = MediaStore()
+        return _default_store
@@ -0,0 +1,89 @@
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from .config import CONFIG
+
+logger = logging.getLogger(__name__)
+
+# Instagram handles: up to 30 letters, digits, underscores and periods, not ending in a period.
+# The lookbehind keeps e-mail addresses (info@example.org) from matching.
+MENTION_RE = re.compile(r'(?<![\w@.])@([A-Za-z0-9_](?:[A-Za-z0-9_.]{0,28}[A-Za-z0-9_])?)')
+
+
+def find_mentions(text: str) -> List[str]:
+    """Return the @-handles in text, in order of first appearance, without duplicates."""
+    return list(dict.fromkeys(match.group(1) for match in MENTION_RE.finditer(text)))
+
+
+class MentionResolver:
+    """Resolve @-handles to display names without asking the LLM.
+
+    Names come from a user-editable JSON file mapping handle to name
+    (``mention_names.json`` by default), plus names learned from Instagram
+    profiles, which are kept separately in the cache directory so the
+    user's file is never rewritten.
+    """
+
+    def __init__(self, names_file: Optional[str] = None, learned_file: Optional[str] = None):
+        mentions_config = CONFIG["mentions"]
+        self.names_file = Path(names_file or mentions_config["names_file"])
+        self.learned_file = Path(learned_file or mentions_config["learned_file"])
+        self._lock = threading.Lock()
+        self._learned = self._load(self.learned_file)
+        self._names = self._load(self.names_file)
+
+    @staticmethod
+    def _load(path: Path) -> Dict[str, str]:
+        if not path.exists():
+            return {}
+        try:
+            with open(path, 'r') as f:
+                names = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not read mention names from {path}: {e}")
+            return {}
+        return {handle.lstrip("@").lower(): name for handle, name in names.items() if name}
+
+    def resolve(self, handle: str) -> Optional[str]:
+        handle = handle.lstrip("@").lower()
+        with self._lock:
+            # The user's own mapping wins over learned names
+            return self._names.get(handle) or self._learned.get(handle)
+
+    def learn(self, handle: str, name: str):
+        """Remember a name seen on Instagram for handle."""
+        handle = handle.lstrip("@").lower()
+        if not name:
+            return
+        with self._lock:
+            if self._learned.get(handle) == name:
+                return
+            self._learned[handle] = name
+            learned = dict(self._learned)
+
+        self.learned_file.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=self.learned_file.parent, suffix=".tmp")
+        with os.fdopen(fd, 'w') as f:
+            json.dump(learned, f, indent=2, ensure_ascii=False, sort_keys=True)
+        os.replace(tmp_name, self.learned_file)
+        logger.info(f"Learned name for @{handle}: {name}")
+
+    def replace_known(self, text: str) -> Tuple[str, List[str]]:
+        """Replace resolvable @-mentions with names. Returns (text, unresolved handles)."""
+        unresolved = []
+
+        def substitute(match):
+            name = self.resolve(match.group(1))
+            if name is None:
+                if match.group(1) not in unresolved:
+                    unresolved.append(match.group(1))
+                return match.group(0)
+            return name
+
+        return MENTION_RE.sub(substitute, text), unresolved
@@ -0,0 +1,189 @@
+"""
+Per-stage timing spans and counters.
+
+Spans time one stage of a cross-post (``instagram_fetch``, ``cobalt_resolve``,
+``download``, ``upload``, ``llm``, ``post_status``, ...); counters add up
+bytes moved, retries and cache hits. Both are kept in memory for the
+Prometheus text format (served by ``instadon serve --metrics-port``) and can
+also be appended to a JSON lines file as they happen.
+"""
+
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .config import CONFIG
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the span duration histogram buckets
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Optional[Dict[str, str]] = None) -> str:
+    pairs = list(key) + sorted((extra or {}).items())
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Metrics:
+    def __init__(self, jsonl_file: Optional[str] = None):
+        self.jsonl_file = jsonl_file
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        # stage -> labels -> [count, sum, max, bucket counts...]
+        self._spans: Dict[str, Dict[LabelKey, List[float]]] = {}
+
+    def _export(self, event: Dict[str, Any]):
+        if not self.jsonl_file:
+            return
+        line = json.dumps(dict(event, ts=time.time())) + "\n"
+        try:
+            with open(self.jsonl_file, 'a') as f:
+                f.write(line)
+        except OSError as e:
+            logger.warning(f"Could not write metrics to {self.jsonl_file}: {e}")
+
+    def increment(self, name: str, value: float = 1, **labels):
+        """Add value to the counter name (e.g. ``bytes_downloaded``, ``cache_hits``)."""
+        key = _label_key(labels)
+        with self._lock:
+            counters = self._counters.setdefault(name, {})
+            counters[key] = counters.get(key, 0) + value
+            self._export({"type": "counter", "name": name, "value": value, "labels": dict(key)})
+
+    def observe(self, stage: str, duration: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            entry = self._spans.setdefault(stage, {}).setdefault(key, [0, 0.0, 0.0] + [0] * len(DURATION_BUCKETS))
+            entry[0] += 1
+            entry[1] += duration
+            entry[2] = max(entry[2], duration)
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if duration <= bound:
+                    entry[3 + i] += 1
+            self._export({"type": "span", "name": stage, "duration": duration, "labels": dict(key)})
+
+    @contextmanager
+    def span(self, stage: str, **labels) -> Iterator[Dict[str, Any]]:
+        """Time the enclosed block as stage.
+
+        Yields the labels dict, so the block can add labels it only learns
+        while running. A block that raises is recorded with ``outcome="error"``.
+        """
+        labels = dict(labels)
+        started = time.perf_counter()
+        try:
+            yield labels
+        except BaseException:
+            labels["outcome"] = "error"
+            raise
+        finally:
+            labels.setdefault("outcome", "ok")
+            duration = time.perf_counter() - started
+            self.observe(stage, duration, **labels)
+            logger.debug(f"{stage} took {duration:.3f}s {labels}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Counters and per-stage count/sum/max, e.g. for a summary at exit."""
+        with self._lock:
+            return {
+                "counters": {name: [{"labels": dict(key), "value": value} for key, value in values.items()]
+                             for name, values in self._counters.items()},
+                "spans": {stage: [{"labels": dict(key), "count": entry[0], "sum": entry[1], "max": entry[2]}
+                                  for key, entry in values.items()]
+                          for stage, values in self._spans.items()},
+            }
+
+    def prometheus_text(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name, values in sorted(self._counters.items()):
+                metric = f"instadon_{name}_total"
+                lines.append(f"# TYPE {metric} counter")
+                for key, value in values.items():
+                    lines.append(f"{metric}{_format_labels(key)} {value:g}")
+
+            if self._spans:
+                metric = "instadon_stage_duration_seconds"
+                lines.append(f"# TYPE {metric} histogram")
+                for stage, values in sorted(self._spans.items()):
+                    for key, entry in values.items():
+                        key = (("stage", stage),) + key
+                        for i, bound in enumerate(DURATION_BUCKETS):
+                            lines.append(f"{metric}_bucket{_format_labels(key, {'le': f'{bound:g}'})} {entry[3 + i]}")
+                        lines.append(f"{metric}_bucket{_format_labels(key, {'le': '+Inf'})} {entry[0]}")
+                        lines.append(f"{metric}_sum{_format_labels(key)} {entry[1]:.6f}")
+                        lines.append(f"{metric}_count{_format_labels(key)} {entry[0]}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._spans.clear()
+
+
+class MetricsServer:
+    """Serve ``/metrics`` in the Prometheus text format from a background thread."""
+
+    def __init__(self, metrics: Metrics, port: int, host: Optional[str] = None):
+        # Only the daemon serves metrics; keep http.server out of the CLI's startup
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        self.metrics = metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(handler):
+                if handler.path.split("?", 1)[0] != "/metrics":
+                    handler.send_error(404)
+                    return
+                body = metrics.prometheus_text().encode("utf-8")
+                handler.send_response(200)
+                handler.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                handler.send_header("Content-Length", str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, format, *args):
+                logger.debug(f"Metrics request: {format % args}")
+
+        self.server = ThreadingHTTPServer((host or CONFIG["metrics"]["host"], port), Handler)
+        self._thread = threading.Thread(target=self.server.serve_forever, name="instadon-metrics", daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self.server.server_address[1]
+
+    def start(self) -> "MetricsServer":
+        self._thread.start()
+        logger.info(f"Serving metrics on http://{self.server.server_address[0]}:{self.port}/metrics")
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+_default_metrics: Optional[Metrics] = None
+_default_metrics_lock = threading.Lock()
+
+
+def get_metrics() -> Metrics:
+    """Return the process-wide Metrics, creating it on first use."""
+    global _default_metrics
+    with _default_metrics_lock:
+        if _default_metrics is None:
+            _default_metrics = Metrics(CONFIG["metrics"]["jsonl_file"])
+        return _default_metrics
@@ -0,0 +1,86 @@
+import mimetypes
+import os
+import uuid
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Union
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+class MultipartEncoder:
+    """Streaming multipart/form-data body.
+
+    Form fields are encoded up front (they are small); files are read from disk
+    in ``chunk_size`` pieces while the request is being sent, so memory use does
+    not depend on the file size. Pass an instance as ``data=`` to ``requests``
+    together with ``content_type`` as the Content-Type header.
+    """
+
+    def __init__(self, fields: Dict[str, str], files: Dict[str, Union[str, Path]], chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self.boundary = uuid.uuid4().hex
+        self.chunk_size = chunk_size
+        self._parts: List[Union[bytes, Path]] = []
+
+        for name, value in fields.items():
+            if value is None:
+                continue
+            self._parts.append(self._header(name) + b"\r\n" + str(value).encode("utf-8") + b"\r\n")
+
+        for name, path in files.items():
+            path = Path(path)
+            content_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+            self._parts.append(self._header(name, path.name, content_type) + b"\r\n")
+            self._parts.append(path)
+            self._parts.append(b"\r\n")
+
+        self._parts.append(f"--{self.boundary}--\r\n".encode("ascii"))
+        self.len = sum(os.path.getsize(part) if isinstance(part, Path) else len(part) for part in self._parts)
+        self.reset()
+
+    @property
+    def content_type(self) -> str:
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def _header(self, name: str, filename: Optional[str] = None, content_type: Optional[str] = None) -> bytes:
+        disposition = f'form-data; name="{name}"'
+        if filename:
+            disposition += f'; filename="{filename}"'
+        header = f"--{self.boundary}\r\nContent-Disposition: {disposition}\r\n"
+        if content_type:
+            header += f"Content-Type: {content_type}\r\n"
+        return header.encode("utf-8")
+
+    def _chunks(self) -> Iterator[bytes]:
+        for part in self._parts:
+            if isinstance(part, Path):
+                with open(part, 'rb') as f:
+                    while True:
+                        chunk = f.read(self.chunk_size)
+                        if not chunk:
+                            break
+                        yield chunk
+            else:
+                yield part
+
+    def reset(self):
+        """Rewind the body so the request can be sent again (e.g. on retry)."""
+        self._iterator = self._chunks()
+        self._buffer = b""
+
+    def __len__(self) -> int:
+        return self.len
+
+    def __iter__(self) -> Iterator[bytes]:
+        return self._chunks()
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._iterator, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if size < 0:
+            data, self._buffer = self._buffer, b""
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
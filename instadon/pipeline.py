@@ -0,0 +1,134 @@
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .config import CONFIG
+from .media import url_to_file
+from .media_store import StoreLease
+
+logger = logging.getLogger(__name__)
+
+
+class MediaPipeline:
+    """Download media items concurrently and upload each one as soon as it lands.
+
+    Results are returned in the original item order, so carousel order (and the
+    thread chunking that depends on it) is preserved regardless of which
+    download finishes first.
+    """
+
+    def __init__(self, max_concurrent_downloads: Optional[int] = None, max_concurrent_uploads: Optional[int] = None):
+        self.max_concurrent_downloads = max_concurrent_downloads or CONFIG["media"]["max_concurrent_downloads"]
+        self.max_concurrent_uploads = max_concurrent_uploads or CONFIG["media"]["max_concurrent_uploads"]
+
+    def run(self, items: List[Tuple[str, Optional[str]]], upload: Callable[[Path], str],
+            media_ids: Optional[List[Optional[str]]] = None, files: Optional[List[Optional[Path]]] = None,
+            on_download: Optional[Callable[[int, Path], None]] = None,
+            on_upload: Optional[Callable[[int, str], None]] = None,
+            keep_files_on_error: bool = False,
+            download: Optional[Callable[[int], Path]] = None,
+            prepare: Optional[Callable[[Path], Path]] = None,
+            lease: Optional[StoreLease] = None) -> Tuple[List[Optional[Path]], List[str]]:
+        """Fetch and upload (url, suffix) items. Returns (files, media_ids) in item order.
+
+        ``media_ids`` and ``files`` carry results of an earlier, interrupted
+        attempt: items with a media ID are skipped entirely and existing files
+        are uploaded without downloading them again. ``on_download`` and
+        ``on_upload`` are called from worker threads as each item progresses.
+        ``download`` replaces fetching item i directly, e.g. with a
+        ``SharedDownloads`` when several accounts publish the same media.
+        ``prepare`` maps each downloaded file to the file actually uploaded
+        (e.g. a transcoded copy); it runs outside the upload slots.
+        ``lease`` keeps downloaded and reused files in the media store until
+        they are uploaded.
+        """
+        if not items:
+            return [], []
+
+        upload_slots = threading.BoundedSemaphore(self.max_concurrent_uploads)
+        done_ids = list(media_ids or [None] * len(items))
+        files = [Path(path) if path else None for path in (files or [None] * len(items))]
+        failed = threading.Event()
+
+        def process(index: int) -> str:
+            if done_ids[index]:
+                return done_ids[index]
+            if failed.is_set():
+                raise RuntimeError("Aborted after an earlier media item failed")
+            if files[index] is None or not (lease.pin(files[index]) if lease else files[index].exists()):
+                if download:
+                    files[index] = download(index)
+                else:
+                    url, suffix = items[index]
+                    files[index] = url_to_file(url, suffix, lease=lease)
+                logger.info(f"Downloaded media {index + 1}/{len(items)}")
+                if on_download:
+                    on_download(index, files[index])
+            upload_file = prepare(files[index]) if prepare else files[index]
+            with upload_slots:
+                media_id = upload(upload_file)
+            logger.info(f"Uploaded media {index + 1}/{len(items)}: {media_id}")
+            if on_upload:
+                on_upload(index, media_id)
+            return media_id
+
+        workers = min(self.max_concurrent_downloads, len(items))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="instadon-media") as pool:
+            futures = [pool.submit(process, i) for i in range(len(items))]
+            try:
+                media_ids = []
+                for future in futures:
+                    try:
+                        media_ids.append(future.result())
+                    except Exception:
+                        failed.set()
+                        raise
+            except Exception:
+                for future in futures:
+                    future.cancel()
+                # Let in-flight items finish before removing what they downloaded
+                pool.shutdown(wait=True)
+                if not keep_files_on_error:
+                    for path in files:
+                        if path is not None:
+                            path.unlink(missing_ok=True)
+                raise
+
+        return files, media_ids
+
+
+class SharedDownloads:
+    """Fetch each media item at most once for several consumers.
+
+    Used when one post goes to several accounts: every account's pipeline
+    asks for item i, the first request starts the download and the others
+    wait for the same result. Downloads are pinned by lease, if given.
+    """
+
+    def __init__(self, items: List[Tuple[str, Optional[str]]], max_workers: Optional[int] = None,
+                 lease: Optional[StoreLease] = None):
+        self.items = items
+        self.lease = lease
+        self._pool = ThreadPoolExecutor(max_workers=max_workers or CONFIG["media"]["max_concurrent_downloads"],
+                                        thread_name_prefix="instadon-download")
+        self._futures: Dict[int, Future] = {}
+        self._lock = threading.Lock()
+
+    def get(self, index: int) -> Path:
+        with self._lock:
+            if index not in self._futures:
+                url, suffix = self.items[index]
+                self._futures[index] = self._pool.submit(url_to_file, url, suffix, lease=self.lease)
+            future = self._futures[index]
+        return future.result()
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,44 +1,205 @@
 import logging
+import sqlite3
+import threading
+import time
 from pathlib import Path
-from typing import Set
+from typing import Iterable, Optional, Set
 
 logger = logging.getLogger(__name__)
 
+
+class TextFileBackend:
+    """Append-only text log (one shortcode per line) with an in-memory index.
+
+    The file is read once; afterwards only bytes appended since the last read
+    (e.g. by another instadon process) are parsed, so lookups stay O(1).
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._index: Set[str] = set()
+        self._offset = 0
+        # Until the first read, a last line without a newline is a complete (e.g. hand-edited) entry
+        self._loaded = False
+        self._lock = threading.Lock()
+        if not self.path.exists():
+            self.path.touch()
+            logger.info(f"Created new post tracker file: {self.path}")
+
+    def _refresh(self):
+        """Index lines appended to the log since the last read."""
+        size = self.path.stat().st_size
+        if size < self._offset:
+            # File was truncated or replaced - rebuild the index
+            self._index.clear()
+            self._offset = 0
+        if size == self._offset:
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            chunk = f.read(size - self._offset)
+        # Afterwards only consume complete lines; a partial trailing line is picked up later
+        end = chunk.rfind(b"\n") + 1 if self._loaded else len(chunk)
+        self._loaded = True
+        if end == 0:
+            return
+        for line in chunk[:end].decode("utf-8").splitlines():
+            if line.strip():
+                self._index.add(line.strip())
+        self._offset += end
+
+    def contains_many(self, shortcodes: Iterable[str]) -> Set[str]:
+        with self._lock:
+            self._refresh()
+            return {shortcode for shortcode in shortcodes if shortcode in self._index}
+
+    def add(self, shortcode: str) -> bool:
+        with self._lock:
+            self._refresh()
+            if shortcode in self._index:
+                return False
+            with open(self.path, 'ab+') as f:
+                # Don't append to a last line that has no newline
+                f.seek(0, 2)
+                if f.tell():
+                    f.seek(-1, 2)
+                    separator = b"" if f.read(1) == b"\n" else b"\n"
+                else:
+                    separator = b""
+                f.write(separator + f"{shortcode}\n".encode("utf-8"))
+            self._refresh()
+            self._index.add(shortcode)
+            return True
+
+    def close(self):
+        pass
+
+
+class SQLiteBackend:
+    """SQLite tracker in WAL mode, safe for concurrent readers and one writer."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS posted ("
+            "shortcode TEXT PRIMARY KEY, posted_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def contains_many(self, shortcodes: Iterable[str]) -> Set[str]:
+        shortcodes = list(shortcodes)
+        found: Set[str] = set()
+        with self._lock:
+            # Stay well below SQLite's bound-parameter limit
+            for i in range(0, len(shortcodes), 500):
+                chunk = shortcodes[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT shortcode FROM posted WHERE shortcode IN ({placeholders})", chunk
+                )
+                found.update(row[0] for row in rows)
+        return found
+
+    def add(self, shortcode: str) -> bool:
+        return self.add_many([shortcode]) == 1
+
+    def add_many(self, shortcodes: Iterable[str]) -> int:
+        now = time.time()
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO posted (shortcode, posted_at) VALUES (?, ?)",
+                [(shortcode, now) for shortcode in shortcodes],
+            )
+            self._conn.commit()
+            return self._conn.total_changes - before
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+BACKENDS = {
+    "text": TextFileBackend,
+    "sqlite": SQLiteBackend,
+}
+
+
+def _guess_backend(tracker_file: Path) -> str:
+    """Pick a backend from the tracker file extension."""
+    if tracker_file.suffix.lower() in (".db", ".sqlite", ".sqlite3"):
+        return "sqlite"
+    return "text"
+
+
 class PostTracker:
-    def __init__(self, tracker_file: str = "posted_instagram_ids.txt"):
+    def __init__(self, tracker_file: str = "posted_instagram_ids.txt", backend: Optional[str] = None):
         self.tracker_file = Path(tracker_file)
-        self._ensure_tracker_file_exists()
-    
-    def _ensure_tracker_file_exists(self):
-        """Create tracker file if it doesn't exist."""
-        if not self.tracker_file.exists():
-            self.tracker_file.touch()
-            logger.info(f"Created new post tracker file: {self.tracker_file}")
-    
-    def is_already_posted(self, shortcode: str) -> bool:
-        """Check if an Instagram post has already been posted to Mastodon."""
+        backend = backend or _guess_backend(self.tracker_file)
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown tracker backend '{backend}'. Available backends: {list(BACKENDS)}")
+        self.backend_name = backend
+        self.backend = BACKENDS[backend](self.tracker_file)
+
+    @staticmethod
+    def account_key(shortcode: str, account: str) -> str:
+        """Tracker entry recording that shortcode was posted to one specific account."""
+        return f"{account}/{shortcode}"
+
+    def is_already_posted(self, shortcode: str, account: Optional[str] = None) -> bool:
+        """Check if an Instagram post has already been posted to Mastodon.
+
+        With an account, entries for that account count as well as plain
+        shortcodes, which older versions wrote for every account.
+        """
+        is_posted = shortcode in self.is_already_posted_many([shortcode], account)
+        logger.info(f"Post {shortcode} already posted{f' to {account}' if account else ''}: {is_posted}")
+        return is_posted
+
+    def is_already_posted_many(self, shortcodes: Iterable[str], account: Optional[str] = None) -> Set[str]:
+        """Return the subset of shortcodes that have already been posted."""
+        shortcodes = list(shortcodes)
+        keys = list(shortcodes)
+        if account:
+            keys += [self.account_key(shortcode, account) for shortcode in shortcodes]
         try:
-            with open(self.tracker_file, 'r') as f:
-                posted_ids = {line.strip() for line in f if line.strip()}
-            
-            is_posted = shortcode in posted_ids
-            logger.info(f"Post {shortcode} already posted: {is_posted}")
-            return is_posted
-            
+            found = self.backend.contains_many(keys)
         except Exception as e:
             logger.error(f"Error reading tracker file: {e}")
-            return False
-    
-    def mark_as_posted(self, shortcode: str):
-        """Mark an Instagram post as posted to Mastodon."""
+            return set()
+        return {shortcode for shortcode in shortcodes
+                if shortcode in found or (account and self.account_key(shortcode, account) in found)}
+
+    def mark_as_posted(self, shortcode: str, account: Optional[str] = None):
+        """Mark an Instagram post as posted to Mastodon (to account, if given)."""
+        key = self.account_key(shortcode, account) if account else shortcode
         try:
-            # Check if already exists to avoid duplicates
-            if not self.is_already_posted(shortcode):
-                with open(self.tracker_file, 'a') as f:
-                    f.write(f"{shortcode}\n")
-                logger.info(f"Marked post {shortcode} as posted")
+            if self.backend.add(key):
+                logger.info(f"Marked post {key} as posted")
             else:
-                logger.info(f"Post {shortcode} already marked as posted")
-                
+                logger.info(f"Post {key} already marked as posted")
+
         except Exception as e:
             logger.error(f"Error writing to tracker file: {e}")
+
+    def migrate_from_text(self, text_file: str) -> int:
+        """Import shortcodes from a legacy text tracker file. Returns the number of new entries."""
+        with open(text_file, 'r') as f:
+            shortcodes = [line.strip() for line in f if line.strip()]
+
+        already_posted = self.backend.contains_many(shortcodes)
+        new_shortcodes = list(dict.fromkeys(s for s in shortcodes if s not in already_posted))
+        if hasattr(self.backend, "add_many"):
+            imported = self.backend.add_many(new_shortcodes)
+        else:
+            imported = sum(1 for shortcode in new_shortcodes if self.backend.add(shortcode))
+
+        logger.info(f"Imported {imported} of {len(shortcodes)} shortcodes from {text_file} into {self.tracker_file}")
+        return imported
+
+    def close(self):
+        self.backend.close()
@@ -0,0 +1,261 @@
+"""
+Which files a post consists of, as a Cobalt API result.
+
+Sources, cheapest first: a short-lived cache of Cobalt answers by shortcode
+(retries and repeated runs don't resolve the same post again), the media
+URLs instaloader already returned with the post, and Cobalt itself on one
+of several endpoints, picked by health and measured latency.
+
+The fetch functions that talk to Cobalt are passed in, so the threaded
+engine and the asyncio engine share the selection, caching and fallbacks.
+"""
+
+import logging
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from .config import CONFIG
+from .metrics import get_metrics
+from .urls import post_url
+
+logger = logging.getLogger(__name__)
+
+# Weight of the newest measurement in an endpoint's latency average
+LATENCY_SMOOTHING = 0.3
+# CDN URLs about to expire are not worth starting a download from
+EXPIRY_MARGIN = 300
+
+# fetch(instagram_url, cobalt_url=..., max_retries=...) -> Cobalt result
+Fetch = Callable[..., Dict[str, Any]]
+AsyncFetch = Callable[..., Awaitable[Dict[str, Any]]]
+
+
+def post_media_result(media: Optional[List[Dict[str, str]]]) -> Optional[Dict[str, Any]]:
+    """A Cobalt-shaped picker result for a post's media URLs, or None if they are missing or expired."""
+    if not media:
+        return None
+    for item in media:
+        # Instagram's CDN URLs carry their expiry as hex seconds in "oe"
+        expires = parse_qs(urlparse(item["url"]).query).get("oe")
+        try:
+            if expires and int(expires[0], 16) < time.time() + EXPIRY_MARGIN:
+                return None
+        except ValueError:
+            pass
+    return {"status": "picker", "picker": [{"type": item["type"], "url": item["url"]} for item in media]}
+
+
+def is_endpoint_failure(error: Exception) -> bool:
+    """Whether error says something about the endpoint (down, overloaded) rather than the post."""
+    status_code = getattr(getattr(error, "response", None), "status_code", None)
+    return status_code is None or status_code == 429 or status_code >= 500
+
+
+def is_expired_media(error: BaseException) -> bool:
+    """Whether error says a media URL no longer works (expired tunnel or CDN signature)."""
+    status_code = getattr(getattr(error, "response", None), "status_code", None)
+    return status_code in (403, 404, 410)
+
+
+class CobaltEndpoint:
+    def __init__(self, url: str):
+        self.url = url
+        # Smoothed seconds per request; None until the first answer
+        self.latency: Optional[float] = None
+        self.failures = 0
+        self.down_until = 0.0
+
+    def __repr__(self):
+        latency = f"{self.latency:.2f}s" if self.latency is not None else "unmeasured"
+        return f"CobaltEndpoint({self.url}, {latency}, {self.failures} failures)"
+
+
+class CobaltEndpoints:
+    """Health and latency of the configured Cobalt endpoints.
+
+    ``order()`` puts the available endpoints first, shuffled with weights
+    inversely proportional to their latency, so the fastest one gets most
+    requests while the others keep being measured. Endpoints cooling down
+    after a failure follow, soonest available first, as a last resort.
+    """
+
+    def __init__(self, urls: Optional[List[str]] = None, cooldown: Optional[float] = None,
+                 max_cooldown: Optional[float] = None):
+        cobalt_config = CONFIG["cobalt"]
+        urls = urls or cobalt_config["urls"]
+        if not urls:
+            raise ValueError("No Cobalt endpoint configured")
+        self.endpoints = [CobaltEndpoint(url) for url in urls]
+        self.cooldown = cooldown or cobalt_config["cooldown"]
+        self.max_cooldown = max_cooldown or cobalt_config["max_cooldown"]
+        self._lock = threading.Lock()
+
+    def order(self) -> List[CobaltEndpoint]:
+        now = time.monotonic()
+        with self._lock:
+            available = [endpoint for endpoint in self.endpoints if endpoint.down_until <= now]
+            cooling = sorted((endpoint for endpoint in self.endpoints if endpoint.down_until > now),
+                             key=lambda endpoint: endpoint.down_until)
+            measured = [endpoint.latency for endpoint in available if endpoint.latency is not None]
+            # Unmeasured endpoints are tried as if they were as fast as the fastest one
+            default_latency = min(measured) if measured else 1.0
+            keys = {endpoint.url: random.random() ** max(endpoint.latency or default_latency, 1e-3)
+                    for endpoint in available}
+        return sorted(available, key=lambda endpoint: keys[endpoint.url], reverse=True) + cooling
+
+    def record_success(self, endpoint: CobaltEndpoint, elapsed: float):
+        with self._lock:
+            if endpoint.latency is None:
+                endpoint.latency = elapsed
+            else:
+                endpoint.latency += LATENCY_SMOOTHING * (elapsed - endpoint.latency)
+            endpoint.failures = 0
+            endpoint.down_until = 0.0
+
+    def record_failure(self, endpoint: CobaltEndpoint):
+        with self._lock:
+            endpoint.failures += 1
+            cooldown = min(self.cooldown * 2 ** (endpoint.failures - 1), self.max_cooldown)
+            endpoint.down_until = time.monotonic() + cooldown
+        get_metrics().increment("cobalt_failures", endpoint=urlparse(endpoint.url).hostname)
+        logger.warning(f"Cobalt endpoint {endpoint.url} failed {endpoint.failures}x, skipping it for {cooldown:.0f}s")
+
+
+class MediaResolver:
+    """Resolve posts to Cobalt results, from the cache, the post itself or a Cobalt endpoint."""
+
+    def __init__(self, endpoints: Optional[CobaltEndpoints] = None, cache_ttl: Optional[float] = None,
+                 use_post_media: Optional[bool] = None):
+        cobalt_config = CONFIG["cobalt"]
+        self.endpoints = endpoints or CobaltEndpoints()
+        self.cache_ttl = cobalt_config["cache_ttl"] if cache_ttl is None else cache_ttl
+        self.use_post_media = cobalt_config["use_post_media"] if use_post_media is None else use_post_media
+        self._lock = threading.Lock()
+        self._cache: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+
+    def cached(self, shortcode: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._cache.get(shortcode)
+            if entry and entry[0] <= time.monotonic():
+                del self._cache[shortcode]
+                entry = None
+        if entry:
+            get_metrics().increment("cache_hits", cache="cobalt")
+            return entry[1]
+        return None
+
+    def remember(self, shortcode: str, result: Dict[str, Any]):
+        if self.cache_ttl <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            for key in [key for key, (expires, _) in self._cache.items() if expires <= now]:
+                del self._cache[key]
+            self._cache[shortcode] = (now + self.cache_ttl, result)
+
+    def forget(self, shortcode: str):
+        """Drop the cached result for shortcode, e.g. because its URLs stopped working."""
+        with self._lock:
+            self._cache.pop(shortcode, None)
+
+    def _local(self, post) -> Optional[Dict[str, Any]]:
+        result = post_media_result(getattr(post, "media", None))
+        if result is not None:
+            get_metrics().increment("media_resolved", source="post")
+            logger.info(f"Using the media URLs of post {post.shortcode} from Instagram")
+        return result
+
+    def _attempts(self) -> List[Tuple[CobaltEndpoint, Optional[int]]]:
+        # Fail over at once while another endpoint is left; the last one gets the usual retries
+        endpoints = self.endpoints.order()
+        return [(endpoint, 0 if i < len(endpoints) - 1 else None) for i, endpoint in enumerate(endpoints)]
+
+    def _accept(self, post, endpoint: CobaltEndpoint, started: float, result: Dict[str, Any]) -> bool:
+        self.endpoints.record_success(endpoint, time.monotonic() - started)
+        if result.get("status") == "error":
+            # The endpoint works but can't handle this post (another one may, e.g. if it's IP-blocked)
+            logger.warning(f"Cobalt endpoint {endpoint.url} could not resolve {post.shortcode}: {result.get('error')}")
+            return False
+        get_metrics().increment("media_resolved", source="cobalt")
+        self.remember(post.shortcode, result)
+        return True
+
+    def _failed(self, post, endpoint: CobaltEndpoint, error: Exception):
+        if is_endpoint_failure(error):
+            self.endpoints.record_failure(endpoint)
+        logger.warning(f"Cobalt endpoint {endpoint.url} failed for {post.shortcode}: {error}")
+
+    def _give_up(self, post, error: Optional[Exception], result: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """Every endpoint failed: fall back to the post's media (even when not preferred), else the last outcome."""
+        local = None if self.use_post_media else self._local(post)
+        if local is not None:
+            return local
+        if error is not None:
+            raise error
+        return result
+
+    def _known(self, post, refresh: bool) -> Optional[Dict[str, Any]]:
+        if refresh:
+            # The URLs from the cache or the post just failed to download
+            self.forget(post.shortcode)
+            return None
+        return self.cached(post.shortcode) or (self._local(post) if self.use_post_media else None)
+
+    def resolve(self, post, fetch: Fetch, refresh: bool = False) -> Dict[str, Any]:
+        """The Cobalt result for post; fetch asks one Cobalt endpoint (see media.download_from_cobalt).
+
+        With refresh, Cobalt is asked even if the cache or the post itself has URLs.
+        """
+        result = self._known(post, refresh)
+        if result is not None:
+            return result
+
+        error = None
+        for endpoint, max_retries in self._attempts():
+            started = time.monotonic()
+            try:
+                result = fetch(post_url(post.shortcode), cobalt_url=endpoint.url, max_retries=max_retries)
+            except Exception as e:
+                error = e
+                self._failed(post, endpoint, e)
+                continue
+            error = None
+            if self._accept(post, endpoint, started, result):
+                return result
+        return self._give_up(post, error, result)
+
+    async def resolve_async(self, post, fetch: AsyncFetch, refresh: bool = False) -> Dict[str, Any]:
+        """Like resolve, with a coroutine fetch (see async_clients.download_from_cobalt)."""
+        result = self._known(post, refresh)
+        if result is not None:
+            return result
+
+        error = None
+        for endpoint, max_retries in self._attempts():
+            started = time.monotonic()
+            try:
+                result = await fetch(post_url(post.shortcode), cobalt_url=endpoint.url, max_retries=max_retries)
+            except Exception as e:
+                error = e
+                self._failed(post, endpoint, e)
+                continue
+            error = None
+            if self._accept(post, endpoint, started, result):
+                return result
+        return self._give_up(post, error, result)
+
+
+_default_resolver: Optional[MediaResolver] = None
+_default_resolver_lock = threading.Lock()
+
+
+def get_media_resolver() -> MediaResolver:
+    """Return the process-wide MediaResolver, creating it on first use."""
+    global _default_resolver
+    with _default_resolver_lock:
+        if _default_resolver is None:
+            _default_resolver = MediaResolver()
+        return _default_resolver
@@ -0,0 +1,229 @@
+"""
+Scratch space for media being downloaded or transcoded (``incoming/`` of the media store).
+
+Every scratch file belongs to a handle that removes it on exit, whether the
+work succeeded or not. File names carry the owning process and host, so
+files left behind by a crashed process are swept when the next one starts.
+Files on disk count against a quota: a download or transcode waits before
+its first byte hits the disk until it fits, and then runs to completion, so
+waiting never deadlocks. Files up to ``spool_bytes`` stay in memory until
+they are complete; failed or duplicate downloads of small images never
+touch the disk.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, Optional
+
+from .config import CONFIG
+from .metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+# How often coroutines check whether their download fits yet
+ASYNC_POLL_INTERVAL = 0.1
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # Exists, but belongs to someone else
+        return True
+    return True
+
+
+class ScratchFile:
+    """A file being written to the scratch area; see ScratchArea.file."""
+
+    def __init__(self, area: "ScratchArea", suffix: str = "", expected_size: Optional[int] = None):
+        self.area = area
+        self.suffix = suffix
+        self.expected_size = expected_size
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+        # Set once the contents moved from memory to disk
+        self.name: Optional[str] = None
+        self._buffer = bytearray()
+        self._file = None
+        self._committed = False
+
+    def _needs_disk(self, chunk: bytes) -> bool:
+        return self._file is None and self.size + len(chunk) > self.area.spool_bytes
+
+    def _spill(self):
+        fd, self.name = self.area.mkstemp(self.suffix)
+        self._file = os.fdopen(fd, 'wb')
+        self._file.write(self._buffer)
+        self._buffer = bytearray()
+
+    def _append(self, chunk: bytes):
+        self.sha256.update(chunk)
+        self.size += len(chunk)
+        if self._file is None:
+            self._buffer += chunk
+        else:
+            self._file.write(chunk)
+            self.area.grow(self, self.size)
+
+    def write(self, chunk: bytes):
+        if self._needs_disk(chunk):
+            self.area.admit(self, max(self.expected_size or 0, self.size + len(chunk)))
+            self._spill()
+        self._append(chunk)
+
+    async def write_async(self, chunk: bytes):
+        """write, waiting for the quota without blocking the event loop."""
+        if self._needs_disk(chunk):
+            await self.area.admit_async(self, max(self.expected_size or 0, self.size + len(chunk)))
+            self._spill()
+        self._append(chunk)
+
+    def commit(self, dest: Path) -> Path:
+        """Move the complete file to dest (on the same file system); it is no longer scratch."""
+        if self._file is None:
+            fd, self.name = self.area.mkstemp(self.suffix)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(self._buffer)
+            self._buffer = bytearray()
+        else:
+            self._file.close()
+        os.replace(self.name, dest)
+        self._committed = True
+        return dest
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        if self.name and not self._committed:
+            Path(self.name).unlink(missing_ok=True)
+        self._buffer = bytearray()
+        self.area.release(self)
+
+    def __enter__(self) -> "ScratchFile":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ScratchArea:
+    """A directory of scratch files with a quota on the bytes they take up."""
+
+    def __init__(self, root: str, max_bytes: Optional[int] = None, spool_bytes: Optional[int] = None,
+                 orphan_age: Optional[float] = None):
+        store_config = CONFIG["media_store"]
+        self.root = Path(root)
+        self.max_bytes = max_bytes or store_config["scratch_max_bytes"]
+        self.spool_bytes = store_config["spool_bytes"] if spool_bytes is None else spool_bytes
+        self.orphan_age = orphan_age or store_config["orphan_age"]
+        self.host = socket.gethostname().replace("~", "")
+        self._condition = threading.Condition()
+        # Bytes on disk (or reserved) per open handle
+        self._reserved: Dict[object, int] = {}
+        self._used = 0
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.sweep()
+
+    @property
+    def used(self) -> int:
+        return self._used
+
+    def mkstemp(self, suffix: str = ""):
+        return tempfile.mkstemp(dir=self.root, prefix=f"{os.getpid()}~{self.host}~", suffix=suffix)
+
+    def file(self, suffix: str = "", expected_size: Optional[int] = None) -> ScratchFile:
+        """Handle to write a file into (use as a context manager); expected_size is reserved up front."""
+        return ScratchFile(self, suffix, expected_size)
+
+    @contextmanager
+    def path(self, suffix: str = "", reserve: int = 0) -> Iterator[Path]:
+        """A new empty file for another writer (e.g. ffmpeg), removed on exit unless moved away."""
+        key = object()
+        self.admit(key, reserve)
+        name = None
+        try:
+            fd, name = self.mkstemp(suffix)
+            os.close(fd)
+            yield Path(name)
+        finally:
+            if name:
+                Path(name).unlink(missing_ok=True)
+            self.release(key)
+
+    def _fits(self, key: object, size: int) -> bool:
+        others = self._used - self._reserved.get(key, 0)
+        # Work that is alone is let through even if it is larger than the quota
+        return others == 0 or others + size <= self.max_bytes
+
+    def _reserve(self, key: object, size: int):
+        previous = self._reserved.get(key, 0)
+        if size > previous:
+            self._reserved[key] = size
+            self._used += size - previous
+
+    def try_admit(self, key: object, size: int) -> bool:
+        with self._condition:
+            if not self._fits(key, size):
+                return False
+            self._reserve(key, size)
+            return True
+
+    def admit(self, key: object, size: int):
+        """Wait until size bytes for key fit in the quota, and reserve them."""
+        with self._condition:
+            if not self._fits(key, size):
+                logger.info(f"Scratch area full ({self._used} of {self.max_bytes} bytes), waiting")
+                with get_metrics().span("scratch_wait"):
+                    self._condition.wait_for(lambda: self._fits(key, size))
+            self._reserve(key, size)
+
+    async def admit_async(self, key: object, size: int):
+        if self.try_admit(key, size):
+            return
+        logger.info(f"Scratch area full ({self._used} of {self.max_bytes} bytes), waiting")
+        with get_metrics().span("scratch_wait"):
+            while not self.try_admit(key, size):
+                await asyncio.sleep(ASYNC_POLL_INTERVAL)
+
+    def grow(self, key: object, size: int):
+        """Account for admitted work outgrowing its reservation; never waits."""
+        with self._condition:
+            self._reserve(key, size)
+
+    def release(self, key: object):
+        with self._condition:
+            self._used -= self._reserved.pop(key, 0)
+            self._condition.notify_all()
+
+    def sweep(self) -> int:
+        """Remove files of processes on this host that are gone, and any older than orphan_age."""
+        removed = 0
+        now = time.time()
+        for path in self.root.iterdir():
+            parts = path.name.split("~")
+            try:
+                if len(parts) == 3 and parts[0].isdigit() and parts[1] == self.host \
+                        and int(parts[0]) != os.getpid() and not _process_alive(int(parts[0])):
+                    orphaned = True
+                else:
+                    # Other hosts sharing the directory, and files from before scratch handles
+                    orphaned = now - path.stat().st_mtime > self.orphan_age
+                if orphaned:
+                    path.unlink(missing_ok=True)
+                    removed += 1
+            except OSError:
+                continue
+        if removed:
+            logger.info(f"Removed {removed} orphaned scratch files from {self.root}")
+        return removed
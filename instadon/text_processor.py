@@ -1,106 +1,369 @@
+import json
 import logging
-from openai import OpenAI
-from typing import Optional
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+from .budget import get_llm_budget
 from .config import CONFIG
+from .instance import DEFAULT_MAX_CHARACTERS
+from .llm_cache import LLMCache
+from .mentions import MentionResolver
+from .metrics import get_metrics
 
 logger = logging.getLogger(__name__)
 
+SUMMARIZE_PROMPT = """Please summarize this social media post to fit within {max_chars} characters while preserving the key message and tone.
+
+IMPORTANT: You must respond in the exact same language as the input text. If the input is in German, respond in German. If it's in English, respond in English. Do not translate or change the language.
+
+Replace @-mentions with names. Only use very common abbreviations. Don't use any ascii formatting except for list items. Preserve emojis and formatting like lists done with emojis. Keep it engaging and authentic.
+
+Only reply with the summarized text (no stats, no quotes around the summary):
+
+{text}
+
+Summary (max {max_chars} chars, same language as input):"""
+
+MENTIONS_PROMPT = """Please process this social media post by replacing @-mentions (usernames starting with @) with names derived from them, but do NOT summarize or shorten the text.
+
+IMPORTANT: You must respond in the exact same language as the input text. If the input is in German, respond in German. If it's in English, respond in English. Do not translate or change the language.
+
+Keep the original text length and content exactly the same, only replace @-mentions with readable names. Preserve all emojis, formatting, and structure.
+
+Only reply with the processed text (no quotes around it):
+
+{text}
+
+Processed text (same language as input):"""
+
+MENTIONS_BATCH_PROMPT = """Below are several social media posts as a JSON array of {{"id": ..., "text": ...}} objects. In each post, replace @-mentions (usernames starting with @) with names derived from them, but do NOT summarize or shorten the text.
+
+IMPORTANT: Keep every post in its own language. Do not translate or change the language.
+
+Keep the original text length and content exactly the same, only replace @-mentions with readable names. Preserve all emojis, formatting, and structure.
+
+Only reply with a JSON array of {{"id": ..., "text": ...}} objects, one for every post, with the same ids (no code fences, no comments):
+
+{text}"""
+
+PROMPT_NAMES = {SUMMARIZE_PROMPT: "summarize", MENTIONS_PROMPT: "mentions", MENTIONS_BATCH_PROMPT: "mentions_batch"}
+
+
+def parse_batch_response(content: str) -> Dict[int, str]:
+    """Read {id: text} from a JSON array answer, skipping malformed items."""
+    start, end = content.find("["), content.rfind("]")
+    if start < 0 or end < start:
+        raise ValueError("Response contains no JSON array")
+    items = json.loads(content[start:end + 1])
+    results = {}
+    for item in items if isinstance(items, list) else []:
+        if isinstance(item, dict) and isinstance(item.get("text"), str) and item["text"].strip():
+            try:
+                results[int(item["id"])] = item["text"].strip()
+            except (KeyError, TypeError, ValueError):
+                continue
+    return results
+
 class TextProcessor:
-    def __init__(self):
-        self.client = OpenAI(
-            api_key=CONFIG["openrouter"]["api_key"],
-            base_url=CONFIG["openrouter"]["base_url"]
-        )
+    def __init__(self, cache: Optional[LLMCache] = None, mentions: Optional[MentionResolver] = None):
+        self._client = None
+        self._client_lock = threading.Lock()
         self.model = CONFIG["openrouter"]["model"]
-        self.max_chars = 500
+        # Used when the caller doesn't pass the target instance's limit
+        self.max_chars = DEFAULT_MAX_CHARACTERS
+        if cache is None and CONFIG["llm_cache"]["enabled"]:
+            cache = LLMCache()
+        self.cache = cache
+        self.mentions = mentions or MentionResolver()
+
+        self.concurrency = CONFIG["llm"]["concurrency"]
+        # Shared by every call, so batch workers and single posts stay within the provider's quota together
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+        self.budget = get_llm_budget()
 
-    def summarize_if_needed(self, text: str) -> str:
-        """Process text and summarize if it exceeds character limit."""
+    @property
+    def client(self):
+        """OpenAI client, created on first LLM call (importing openai is slow)."""
+        with self._client_lock:
+            if self._client is None:
+                from openai import OpenAI
+                self._client = OpenAI(
+                    api_key=CONFIG["openrouter"]["api_key"],
+                    base_url=CONFIG["openrouter"]["base_url"]
+                )
+            return self._client
+
+    def summarize_if_needed(self, text: str, max_chars: Optional[int] = None) -> str:
+        """Process text and summarize if it exceeds max_chars (the instance's status limit)."""
         if not text:
             return text
 
-        if len(text) <= self.max_chars:
-            logger.info(f"Text length {len(text)} chars - processing @-mentions only")
-            return self._process_mentions_only(text)
+        max_chars = max_chars or self.max_chars
+        if self._needs_summary(text, max_chars):
+            return self._summarize_text(text, max_chars)
+        return self._process_mentions_only(text)
 
+    @staticmethod
+    def _needs_summary(text: str, max_chars: int) -> bool:
+        if len(text) <= max_chars:
+            logger.info(f"Text length {len(text)} chars - processing @-mentions only")
+            return False
         logger.info(f"Text length {len(text)} chars - summarizing with OpenRouter")
-        return self._summarize_text(text)
+        return True
 
-    def _summarize_text(self, text: str) -> str:
-        """Use OpenRouter to summarize the text."""
-        prompt = f"""Please summarize this social media post to fit within 500 characters while preserving the key message and tone.
+    def process_many(self, texts: List[str], max_chars: Optional[int] = None) -> List[str]:
+        """Like summarize_if_needed for every text, returned in order.
 
-IMPORTANT: You must respond in the exact same language as the input text. If the input is in German, respond in German. If it's in English, respond in English. Do not translate or change the language.
+        Summaries run concurrently (up to ``CONFIG["llm"]["concurrency"]``);
+        short captions that only have unknown @-mentions are packed several
+        to a request. Each caption falls back on its own, as in the single
+        calls: truncation for summaries, the original text for mentions.
+        """
+        max_chars = max_chars or self.max_chars
+        results, summaries, packs = self._plan_many(texts, max_chars)
+        if not summaries and not packs:
+            return results
 
-Replace @-mentions with names. Only use very common abbreviations. Don't use any ascii formatting except for list items. Preserve emojis and formatting like lists done with emojis. Keep it engaging and authentic.
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="instadon-llm") as pool:
+            futures = {i: pool.submit(self._summarize_text, texts[i], max_chars) for i in summaries}
+            pack_futures = [pool.submit(self._process_mentions_pack, pack) for pack in packs]
+            for i, future in futures.items():
+                results[i] = future.result()
+            for future in pack_futures:
+                for i, text in future.result().items():
+                    results[i] = text
+        return results
 
-Only reply with the summarized text (no stats, no quotes around the summary):
+    def _plan_many(self, texts: List[str], max_chars: int) -> Tuple[List[Optional[str]], List[int],
+                                                                   List[List[Tuple[int, str]]]]:
+        """Split texts for process_many: (results known without the LLM, indexes to summarize, mention packs)."""
+        results: List[Optional[str]] = [None] * len(texts)
+        summaries = []
+        mentions = []
+        for i, text in enumerate(texts):
+            if not text:
+                results[i] = text
+            elif len(text) > max_chars:
+                summaries.append(i)
+            else:
+                text, unresolved = self.mentions.replace_known(text)
+                cached = self._cached(self._mentions_key(text)) if unresolved else None
+                if not unresolved or cached is not None:
+                    results[i] = cached or text
+                else:
+                    mentions.append((i, text))
 
-{text}
+        packs = self._pack(mentions)
+        logger.info(f"Processing {len(texts)} captions: {len(summaries)} summaries, "
+                    f"{len(mentions)} with unknown @-mentions in {len(packs)} requests")
+        return results, summaries, packs
+
+    def warm_cache(self, texts: Iterable[str]) -> int:
+        """Run captions through the processor so later posts hit the cache. Returns the count processed."""
+        return len(self.process_many(list(texts)))
 
-Summary (max 500 chars, same language as input):"""
+    def _cache_key(self, template: str, text: str, max_tokens: int, temperature: float, **fields) -> Optional[str]:
+        if self.cache is None:
+            return None
+        return LLMCache.make_key(self.model, template, text,
+                                 dict(fields, max_tokens=max_tokens, temperature=temperature))
 
+    def _mentions_key(self, text: str) -> Optional[str]:
+        # Same parameters as _process_mentions_only, so packed and single results share cache entries
+        args = self._mentions_args(text)
+        return self._cache_key(MENTIONS_PROMPT, text, max_tokens=args["max_tokens"], temperature=args["temperature"])
+
+    def _cached(self, key: Optional[str]) -> Optional[str]:
+        if key is None:
+            return None
+        cached = self.cache.get(key)
+        if cached is not None:
+            get_metrics().increment("cache_hits", cache="llm")
+            logger.info("Using cached LLM response")
+        else:
+            get_metrics().increment("cache_misses", cache="llm")
+        return cached
+
+    def _complete(self, template: str, text: str, max_tokens: int, temperature: float,
+                  allow_truncation: bool = True, use_cache: bool = True, **fields) -> str:
+        """Run a chat completion for template filled with text (and fields), using the cache if enabled."""
+        key = self._cache_key(template, text, max_tokens, temperature, **fields) if use_cache else None
+        cached = self._cached(key)
+        if cached is not None:
+            return cached
+
+        self.budget.acquire()
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=150,
-                temperature=0.7
-            )
+            with self._slots, get_metrics().span("llm", prompt=PROMPT_NAMES.get(template, "other")):
+                response = self.client.chat.completions.create(
+                    **self._completion_args(template, text, max_tokens, temperature, **fields))
+        except Exception as e:
+            self._completion_failed(e)
+            raise
+        return self._completion_content(response, key, max_tokens, allow_truncation)
 
-            summary = response.choices[0].message.content.strip()
+    def _completion_args(self, template: str, text: str, max_tokens: int, temperature: float, **fields) -> Dict:
+        return {
+            "model": self.model,
+            "messages": [
+                {"role": "user", "content": template.format(text=text, **fields)}
+            ],
+            "max_tokens": max_tokens,
+            "temperature": temperature
+        }
 
-            # Ensure it's within limit
-            if len(summary) > self.max_chars:
-                summary = summary[:self.max_chars-3] + "..."
+    def _completion_failed(self, error: Exception):
+        if getattr(error, "status_code", None) == 429:
+            self.budget.penalize(CONFIG["llm"]["throttle_backoff"])
 
-            logger.info(f"Summarized from {len(text)} to {len(summary)} chars")
-            logger.info(f"Summary: {summary}")
+    def _completion_content(self, response, key: Optional[str], max_tokens: int, allow_truncation: bool) -> str:
+        """The answer's text, cached under key; raises if it was cut off and that isn't allowed."""
+        choice = response.choices[0]
+        if not allow_truncation and choice.finish_reason == "length":
+            raise ValueError(f"Response was cut off at max_tokens={max_tokens}")
+        content = choice.message.content.strip()
 
-            return summary
+        if key is not None and content:
+            self.cache.set(key, content, model=self.model)
+        return content
 
-        except Exception as e:
-            logger.error(f"Failed to summarize text: {e}")
-            # Fallback: truncate with ellipsis
-            fallback = text[:self.max_chars-3] + "..."
-            logger.info(f"Using fallback truncation: {len(fallback)} chars")
-            return fallback
+    def _pack(self, items: List[Tuple[int, str]]) -> List[List[Tuple[int, str]]]:
+        """Group (index, text) items into requests of at most pack_size items and pack_chars characters."""
+        llm_config = CONFIG["llm"]
+        packs = []
+        pack, chars = [], 0
+        for item in items:
+            if pack and (len(pack) >= llm_config["pack_size"] or chars + len(item[1]) > llm_config["pack_chars"]):
+                packs.append(pack)
+                pack, chars = [], 0
+            pack.append(item)
+            chars += len(item[1])
+        if pack:
+            packs.append(pack)
+        return packs
 
-    def _process_mentions_only(self, text: str) -> str:
-        """Process @-mentions without summarizing."""
-        prompt = f"""Please process this social media post by replacing @-mentions (usernames starting with @) with names derived from them, but do NOT summarize or shorten the text.
+    def _process_mentions_pack(self, pack: List[Tuple[int, str]]) -> Dict[int, str]:
+        """Resolve the @-mentions of several captions with one request. Returns {index: text}."""
+        if len(pack) == 1:
+            i, text = pack[0]
+            return {i: self._process_mentions_only(text)}
 
-IMPORTANT: You must respond in the exact same language as the input text. If the input is in German, respond in German. If it's in English, respond in English. Do not translate or change the language.
+        payload = self._pack_payload(pack)
+        try:
+            content = self._complete(MENTIONS_BATCH_PROMPT, payload, **self._pack_args(payload))
+        except Exception as e:
+            return self._pack_fallback(pack, e)
 
-Keep the original text length and content exactly the same, only replace @-mentions with readable names. Preserve all emojis, formatting, and structure.
+        results, missing = self._read_pack(pack, content)
+        for i, text in missing:
+            results[i] = self._process_mentions_only(text)
+        return results
 
-Only reply with the processed text (no quotes around it):
+    @staticmethod
+    def _pack_payload(pack: List[Tuple[int, str]]) -> str:
+        return json.dumps([{"id": n, "text": text} for n, (_, text) in enumerate(pack)], ensure_ascii=False)
 
-{text}
+    @staticmethod
+    def _pack_args(payload: str) -> Dict:
+        return {"max_tokens": max(400, len(payload)), "temperature": 0.3, "allow_truncation": False,
+                "use_cache": False}
 
-Processed text (same language as input):"""
+    @staticmethod
+    def _pack_fallback(pack: List[Tuple[int, str]], error: Exception) -> Dict[int, str]:
+        logger.error(f"Failed to process @-mentions of {len(pack)} captions: {error}")
+        logger.info("Using original texts as fallback")
+        return dict(pack)
 
+    def _read_pack(self, pack: List[Tuple[int, str]], content: str) -> Tuple[Dict[int, str], List[Tuple[int, str]]]:
+        """Answers of a batched @-mention request by index, and the (index, text) items it left out."""
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=200,
-                temperature=0.3
-            )
-
-            processed_text = response.choices[0].message.content.strip()
-            
-            logger.info(f"Processed @-mentions: {len(text)} -> {len(processed_text)} chars")
-            logger.info(f"Processed text: {processed_text}")
-
-            return processed_text
+            answers = parse_batch_response(content)
+        except ValueError as e:
+            logger.warning(f"Could not parse batched @-mention response: {e}")
+            answers = {}
+
+        results = {}
+        # Missing from the answer: asked about on their own
+        missing = []
+        for n, (i, text) in enumerate(pack):
+            if n in answers:
+                results[i] = answers[n]
+                key = self._mentions_key(text)
+                if key is not None:
+                    self.cache.set(key, answers[n], model=self.model)
+            else:
+                missing.append((i, text))
+        logger.info(f"Processed @-mentions of {len(pack)} captions in one request ({len(missing)} retried alone)")
+        return results, missing
 
+    def _summarize_text(self, text: str, max_chars: int) -> str:
+        """Use OpenRouter to summarize the text."""
+        # Known handles are replaced up front so the model doesn't have to guess them
+        text, _ = self.mentions.replace_known(text)
+        try:
+            summary = self._complete(SUMMARIZE_PROMPT, text, **self._summary_args(max_chars))
         except Exception as e:
-            logger.error(f"Failed to process @-mentions: {e}")
-            # Fallback: return original text
-            logger.info(f"Using original text as fallback")
+            return self._summary_fallback(text, max_chars, e)
+        return self._fit_summary(text, summary, max_chars)
+
+    @staticmethod
+    def _summary_args(max_chars: int) -> Dict:
+        # Roughly three characters per token
+        return {"max_tokens": max(150, max_chars // 3), "temperature": 0.7, "max_chars": max_chars}
+
+    @staticmethod
+    def _fit_summary(text: str, summary: str, max_chars: int) -> str:
+        # Ensure it's within limit
+        if len(summary) > max_chars:
+            summary = summary[:max_chars-3] + "..."
+
+        logger.info(f"Summarized from {len(text)} to {len(summary)} chars")
+        logger.debug(f"Summary: {summary}")
+
+        return summary
+
+    @staticmethod
+    def _summary_fallback(text: str, max_chars: int, error: Exception) -> str:
+        logger.error(f"Failed to summarize text: {error}")
+        # Fallback: truncate with ellipsis
+        fallback = text[:max_chars-3] + "..."
+        logger.info(f"Using fallback truncation: {len(fallback)} chars")
+        return fallback
+
+    def _process_mentions_only(self, text: str) -> str:
+        """Process @-mentions without summarizing.
+
+        Mentions are resolved locally where possible; the LLM is only asked
+        about handles that are not in the name map.
+        """
+        text, unresolved = self._replace_known_mentions(text)
+        if not unresolved:
             return text
+        try:
+            processed_text = self._complete(MENTIONS_PROMPT, text, **self._mentions_args(text))
+        except Exception as e:
+            return self._mentions_fallback(text, e)
+        logger.info(f"Processed @-mentions: {len(text)} -> {len(processed_text)} chars")
+        logger.debug(f"Processed text: {processed_text}")
+        return processed_text
+
+    def _replace_known_mentions(self, text: str) -> Tuple[str, List[str]]:
+        """text with the mentions of the name map replaced, and the handles left for the LLM."""
+        text, unresolved = self.mentions.replace_known(text)
+        if unresolved:
+            logger.info(f"Resolving unknown @-mentions with OpenRouter: {unresolved}")
+        else:
+            logger.info("No unknown @-mentions - skipping OpenRouter")
+        return text, unresolved
+
+    @staticmethod
+    def _mentions_args(text: str) -> Dict:
+        # Leave room for the whole text; a cut-off response would silently drop the end of the post
+        return {"max_tokens": max(200, len(text)), "temperature": 0.3, "allow_truncation": False}
+
+    @staticmethod
+    def _mentions_fallback(text: str, error: Exception) -> str:
+        logger.error(f"Failed to process @-mentions: {error}")
+        # Fallback: return the text with only the locally known mentions replaced
+        logger.info(f"Using original text as fallback")
+        return text
@@ -0,0 +1,86 @@
+import re
+from typing import List, Optional
+
+from .instance import InstanceCapabilities
+
+URL_RE = re.compile(r'https?://\S+')
+# Mastodon counts a remote mention as its local part only
+REMOTE_MENTION_RE = re.compile(r'(@\w+)@[\w.-]+\w')
+
+# Room kept in continuation parts for the "(12/34)" marker and the blank line after it
+MARKER_RESERVE = 12
+
+
+def status_length(text: str, characters_reserved_per_url: int) -> int:
+    """Length of text as Mastodon counts it against the status limit."""
+    text = REMOTE_MENTION_RE.sub(r'\1', text)
+    return len(URL_RE.sub("x" * characters_reserved_per_url, text))
+
+
+def split_text(text: str, first_limit: int, limit: int, characters_reserved_per_url: int) -> List[str]:
+    """Split text at whitespace into segments of at most first_limit, then limit, counted characters."""
+    segments = []
+    current = ""
+    for word in re.split(r'(?<=\s)(?=\S)', text):
+        max_length = limit if segments else first_limit
+        candidate = current + word
+        if status_length(candidate.rstrip(), characters_reserved_per_url) <= max_length:
+            current = candidate
+            continue
+        if current.strip():
+            segments.append(current.rstrip())
+        # A single word longer than a whole post is cut
+        while status_length(word.rstrip(), characters_reserved_per_url) > (limit if segments else first_limit):
+            cut = limit if segments else first_limit
+            segments.append(word[:cut])
+            word = word[cut:]
+        current = word
+    if current.strip() or not segments:
+        segments.append(current.rstrip())
+    return segments
+
+
+class ThreadPart:
+    def __init__(self, index: int, status: str, media_start: int, media_end: int, visibility: str,
+                 reply: bool):
+        self.index = index
+        self.status = status
+        # Positions in the post's media list, in carousel order
+        self.media_start = media_start
+        self.media_end = media_end
+        self.visibility = visibility
+        self.reply = reply
+
+    def __repr__(self):
+        return f"ThreadPart({self.index}, media {self.media_start}:{self.media_end}, {len(self.status)} chars)"
+
+
+def plan_thread(status: str, media_count: int, visibility: str = "public",
+                capabilities: Optional[InstanceCapabilities] = None) -> List[ThreadPart]:
+    """Lay out a post as a thread before anything is published.
+
+    Media go out in chunks of the instance's attachment limit. The first part
+    carries the status with the requested visibility; replies are unlisted
+    and start with a "(2/3)" marker. Text beyond the instance's character
+    limit continues in the replies, adding text-only parts if needed.
+    """
+    capabilities = capabilities or InstanceCapabilities()
+    per_post = capabilities.max_media_attachments
+    url_chars = capabilities.characters_reserved_per_url
+    max_characters = capabilities.max_characters
+
+    segments = split_text(status, max_characters, max_characters - MARKER_RESERVE, url_chars)
+    total = max(len(segments), -(-media_count // per_post), 1)
+
+    parts = []
+    for i in range(total):
+        text = segments[i] if i < len(segments) else ""
+        media_start, media_end = min(i * per_post, media_count), min((i + 1) * per_post, media_count)
+        if i == 0:
+            parts.append(ThreadPart(0, text, media_start, media_end, visibility, reply=False))
+        else:
+            # Reply posts are unlisted to avoid spam
+            marker = f"({i + 1}/{total})"
+            parts.append(ThreadPart(i, f"{marker}\n\n{text}" if text else marker, media_start, media_end,
+                                    "unlisted", reply=True))
+    return parts
@@ -0,0 +1,306 @@
+"""
+Optional pre-upload stage that makes media fit the target instance.
+
+Instagram serves whatever its CDN has: full-resolution photos, HEIC or WebP
+files labelled as JPEG, reels above an instance's size or frame rate limit.
+Mastodon rejects or re-encodes those after the upload, so oversized files are
+scaled down here first, using the limits the instance publishes in
+``/api/v2/instance`` (``configuration.media_attachments``).
+
+Images are resized with Pillow in a process pool, videos are re-encoded (or
+just remuxed) with ffmpeg. Both are optional: without them a file is only
+relabelled with the suffix matching its real format and uploaded as it is.
+"""
+
+import json
+import logging
+import math
+import mimetypes
+import os
+import shutil
+import subprocess
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from .config import CONFIG
+from .media_store import MediaStore, StoreLease, get_media_store
+from .metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+# Mastodon's defaults, used for anything the instance doesn't report
+DEFAULT_LIMITS = {
+    "image_size_limit": 16 * 1024 ** 2,
+    "image_matrix_limit": 33177600,  # 7680x4320
+    "video_size_limit": 99 * 1024 ** 2,
+    "video_matrix_limit": 8294400,  # 3840x2160
+    "video_frame_rate_limit": 120,
+    "supported_mime_types": None,
+}
+
+# ISO base media "ftyp" brands that are still images rather than video
+_HEIF_BRANDS = {b"heic", b"heix", b"hevc", b"heim", b"heis", b"mif1", b"msf1"}
+
+MIN_JPEG_QUALITY = 50
+
+
+def sniff_format(path: Path) -> Optional[Tuple[str, str, str]]:
+    """Identify a media file by its magic bytes. Returns (kind, mime type, suffix) or None."""
+    with open(path, 'rb') as f:
+        head = f.read(16)
+
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image", "image/jpeg", ".jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image", "image/png", ".png"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "image", "image/gif", ".gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image", "image/webp", ".webp"
+    if head[4:8] == b"ftyp":
+        brand = head[8:12]
+        if brand in _HEIF_BRANDS:
+            return "image", "image/heic", ".heic"
+        if brand == b"avif":
+            return "image", "image/avif", ".avif"
+        if brand == b"qt  ":
+            return "video", "video/quicktime", ".mov"
+        return "video", "video/mp4", ".mp4"
+    if head.startswith(b"\x1a\x45\xdf\xa3"):
+        return "video", "video/webm", ".webm"
+    return None
+
+
+def pillow_available() -> bool:
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _fit_image(src: str, dst: str, max_pixels: int, max_bytes: int, quality: int) -> str:
+    """Resize/re-encode src into dst until it fits. Runs in a worker process; returns the suffix."""
+    from PIL import Image, ImageOps
+
+    with Image.open(src) as original:
+        image = ImageOps.exif_transpose(original)
+    width, height = image.size
+    if width * height > max_pixels:
+        scale = math.sqrt(max_pixels / (width * height))
+        image = image.resize((max(1, int(width * scale)), max(1, int(height * scale))), Image.LANCZOS)
+
+    has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+    if not has_alpha and image.mode != "RGB":
+        image = image.convert("RGB")
+
+    for _ in range(10):
+        if has_alpha:
+            image.save(dst, "PNG", optimize=True)
+        else:
+            image.save(dst, "JPEG", quality=quality, optimize=True, progressive=True)
+        if os.path.getsize(dst) <= max_bytes:
+            break
+        if not has_alpha and quality > MIN_JPEG_QUALITY:
+            quality -= 10
+        else:
+            width, height = image.size
+            image = image.resize((max(1, int(width * 0.75)), max(1, int(height * 0.75))), Image.LANCZOS)
+
+    return ".png" if has_alpha else ".jpeg"
+
+
+class MediaTranscoder:
+    """Bring downloaded media within an instance's attachment limits.
+
+    Results are remembered per source file and limits, so a post fanned out
+    to several accounts on the same instance is only transcoded once.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, jpeg_quality: Optional[int] = None,
+                 store: Optional[MediaStore] = None):
+        transcode_config = CONFIG["transcode"]
+        self.max_workers = max_workers or transcode_config["workers"]
+        self.jpeg_quality = jpeg_quality or transcode_config["jpeg_quality"]
+        self.store = store or get_media_store()
+        self.ffmpeg = shutil.which(transcode_config["ffmpeg"])
+        self.ffprobe = shutil.which(transcode_config["ffprobe"])
+        self._pool: Optional[ProcessPoolExecutor] = None
+        # ffmpeg is its own process already; this only bounds how many run at once
+        self._video_slots = threading.BoundedSemaphore(self.max_workers)
+        self._results: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self._pool
+
+    def prepare(self, path: Path, limits: Optional[Dict[str, Any]] = None, lease: Optional[StoreLease] = None) -> Path:
+        """Return a file that fits limits: path itself, or a transcoded copy in the media store.
+
+        Transcoding is best effort; if it fails the file is uploaded as it is.
+        A transcoded copy is pinned by lease, if given, until it is uploaded.
+        """
+        path = Path(path)
+        limits = dict(DEFAULT_LIMITS, **{key: value for key, value in (limits or {}).items() if value})
+        key = f"{MediaStore.digest_of(path)}:{json.dumps(limits, sort_keys=True)}"
+
+        with self._lock:
+            future = self._results.get(key)
+            if future is not None and future.done() and not future.result().exists():
+                # Evicted from the store since; do it again
+                future = None
+            owner = future is None
+            if owner:
+                future = self._results[key] = Future()
+
+        if owner:
+            try:
+                future.set_result(self._prepare(path, limits, lease))
+            except Exception as e:
+                future.set_exception(e)
+                with self._lock:
+                    self._results.pop(key, None)
+        result = future.result()
+        if not owner and lease is not None and not lease.pin(result):
+            # Evicted since another caller made it
+            return self.prepare(path, limits, lease)
+        # Identical bytes under another name (e.g. a retry) need no copy of their own
+        return path if MediaStore.digest_of(result) == MediaStore.digest_of(path) \
+            and result.suffix == path.suffix else result
+
+    def _prepare(self, path: Path, limits: Dict[str, Any], lease: Optional[StoreLease] = None) -> Path:
+        sniffed = sniff_format(path)
+        if sniffed is None:
+            return path
+        kind, mime_type, suffix = sniffed
+
+        # The multipart upload derives its Content-Type from the file name
+        if path.suffix.lower() != suffix and mimetypes.guess_type(path.name)[0] != mime_type:
+            logger.info(f"{path.name} is {mime_type}, relabelling as {suffix}")
+            path = self.store.put_file(path, suffix, lease=lease)
+
+        supported = limits["supported_mime_types"]
+        unsupported = bool(supported) and mime_type not in supported
+        try:
+            if kind == "image":
+                return self._prepare_image(path, limits, unsupported, lease)
+            return self._prepare_video(path, limits, unsupported, lease)
+        except Exception as e:
+            # Best effort: Mastodon gets the file as it is and decides
+            logger.warning(f"Could not transcode {path.name}, uploading it unchanged: {e}")
+            return path
+
+    def _prepare_image(self, path: Path, limits: Dict[str, Any], unsupported: bool,
+                       lease: Optional[StoreLease] = None) -> Path:
+        max_pixels, max_bytes = limits["image_matrix_limit"], limits["image_size_limit"]
+        too_large = path.stat().st_size > max_bytes
+        if not pillow_available():
+            if too_large or unsupported:
+                logger.warning(f"{path.name} exceeds the instance's image limits but Pillow is not installed")
+            return path
+
+        from PIL import Image
+        # Only reads the header
+        with Image.open(path) as image:
+            width, height = image.size
+            animated = getattr(image, "is_animated", False)
+        if animated:
+            # Re-encoding would drop every frame but the first
+            return path
+        if not (too_large or unsupported or width * height > max_pixels):
+            return path
+
+        logger.info(f"Resizing {path.name} ({width}x{height}, {path.stat().st_size} bytes)")
+        with self.store.scratch.path(reserve=path.stat().st_size) as dst:
+            with get_metrics().span("transcode", kind="image"):
+                suffix = self.pool.submit(_fit_image, str(path), str(dst), max_pixels, max_bytes,
+                                          self.jpeg_quality).result()
+            return self.store.put_file(dst, suffix, move=True, lease=lease)
+
+    def _probe(self, path: Path) -> Dict[str, float]:
+        """Width, height, frame rate and duration of the first video stream."""
+        output = subprocess.run(
+            [self.ffprobe, "-v", "error", "-select_streams", "v:0",
+             "-show_entries", "stream=width,height,avg_frame_rate:format=duration", "-of", "json", str(path)],
+            check=True, capture_output=True, timeout=60,
+        ).stdout
+        info = json.loads(output)
+        stream = (info.get("streams") or [{}])[0]
+        numerator, _, denominator = str(stream.get("avg_frame_rate", "0/1")).partition("/")
+        fps = float(numerator) / float(denominator or 1) if float(denominator or 1) else 0.0
+        return {
+            "width": int(stream.get("width") or 0),
+            "height": int(stream.get("height") or 0),
+            "fps": fps,
+            "duration": float(info.get("format", {}).get("duration") or 0),
+        }
+
+    def _prepare_video(self, path: Path, limits: Dict[str, Any], unsupported: bool,
+                       lease: Optional[StoreLease] = None) -> Path:
+        max_pixels, max_bytes = limits["video_matrix_limit"], limits["video_size_limit"]
+        max_fps = limits["video_frame_rate_limit"]
+        size = path.stat().st_size
+        if not (self.ffmpeg and self.ffprobe):
+            if size > max_bytes or unsupported:
+                logger.warning(f"{path.name} exceeds the instance's video limits but ffmpeg is not available")
+            return path
+
+        info = self._probe(path)
+        width, height = info["width"], info["height"]
+        over_matrix = width * height > max_pixels
+        over_fps = info["fps"] > max_fps
+        if not (size > max_bytes or unsupported or over_matrix or over_fps):
+            return path
+
+        args = [self.ffmpeg, "-y", "-v", "error", "-i", str(path)]
+        if size > max_bytes or over_matrix or over_fps:
+            if over_matrix:
+                scale = math.sqrt(max_pixels / (width * height))
+                # libx264 needs even dimensions
+                args += ["-vf", f"scale={int(width * scale) // 2 * 2}:{int(height * scale) // 2 * 2}"]
+            if over_fps:
+                args += ["-r", str(max_fps)]
+            args += ["-c:v", "libx264", "-preset", "veryfast", "-crf", "23", "-pix_fmt", "yuv420p",
+                     "-c:a", "aac", "-b:a", "128k"]
+            if size > max_bytes and info["duration"]:
+                # Leave 10% headroom for the container and audio
+                kbps = max(200, int(max_bytes * 8 * 0.9 / info["duration"] / 1000) - 128)
+                args += ["-maxrate", f"{kbps}k", "-bufsize", f"{2 * kbps}k"]
+            action = "Transcoding"
+        else:
+            # Only the container is unsupported
+            args += ["-c", "copy"]
+            action = "Remuxing"
+
+        logger.info(f"{action} {path.name} ({width}x{height} @ {info['fps']:.0f}fps, {size} bytes)")
+        # The output is rarely larger than the input
+        with self.store.scratch.path(reserve=size) as dst:
+            with self._video_slots, get_metrics().span("transcode", kind="video"):
+                subprocess.run(args + ["-movflags", "+faststart", "-f", "mp4", str(dst)],
+                               check=True, capture_output=True, timeout=CONFIG["transcode"]["timeout"])
+            return self.store.put_file(dst, ".mp4", move=True, lease=lease)
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True)
+                self._pool = None
+
+
+_default_transcoder: Optional[MediaTranscoder] = None
+_default_transcoder_lock = threading.Lock()
+
+
+def get_transcoder() -> MediaTranscoder:
+    """Return the process-wide MediaTranscoder, creating it on first use."""
+    global _default_transcoder
+    with _default_transcoder_lock:
+        if _default_transcoder is None:
+            _default_transcoder = MediaTranscoder()
+        return _default_transcoder
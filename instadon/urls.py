@@ -0,0 +1,22 @@
+import re
+from typing import Optional
+
+# Match patterns like:
+# https://www.instagram.com/p/ABC123/
+# https://instagram.com/p/ABC123/
+# instagram.com/p/ABC123/
+# https://www.instagram.com/reel/ABC123/
+# https://instagram.com/reel/ABC123/
+# instagram.com/reel/ABC123/
+SHORTCODE_RE = re.compile(r'(?:https?://)?(?:www\.)?instagram\.com/(?:p|reel)/([A-Za-z0-9_-]+)')
+
+
+def extract_shortcode(url: str) -> Optional[str]:
+    """Extract shortcode from Instagram URL."""
+    match = SHORTCODE_RE.search(url)
+    return match.group(1) if match else None
+
+
+def post_url(shortcode: str) -> str:
+    """Build the canonical Instagram URL for a post."""
+    return f"https://www.instagram.com/p/{shortcode}/"
@@ -0,0 +1,289 @@
+import asyncio
+import copy
+
+import pytest
+
+pytest.importorskip("httpx")
+
+from benchmarks import pipeline
+from instadon import budget, instance, media_store, resolver, transcode
+from instadon.async_http import AsyncHttpClient
+from instadon.config import CONFIG
+
+
+@pytest.fixture
+def isolated_config(monkeypatch):
+    for section in list(CONFIG):
+        monkeypatch.setitem(CONFIG, section, copy.deepcopy(CONFIG[section]))
+    monkeypatch.setattr(budget, "_llm_budget", None)
+    monkeypatch.setattr(resolver, "_default_resolver", None)
+    monkeypatch.setattr(media_store, "_default_store", None)
+    monkeypatch.setattr(instance, "_default_cache", None)
+    monkeypatch.setattr(transcode, "_default_transcoder", None)
+    yield
+    if transcode._default_transcoder is not None:
+        transcode._default_transcoder.close()
+
+
+def test_async_batch_posts_every_profile(isolated_config):
+    available = pipeline.scenarios(reel_mb=1, profiles=3)
+
+    result = pipeline.run_scenario(available["batch"], runs=1, latency=0, bandwidth=None, processing_delay=0.1,
+                                   rate_limit_every=2, workers=3, use_async=True)
+
+    assert result["posts"] == 3
+    # One status per profile; a 429 answer is retried rather than failing the job
+    assert result["requests"]["statuses"] >= 3
+    assert result["requests"]["rate_limited"] >= 1
+
+
+def test_requests_per_host_are_limited():
+    client = AsyncHttpClient(per_host_limit=2, host_limits={"slow.example:8080": 1})
+    in_flight = {"a.example": 0, "slow.example:8080": 0}
+    peak = dict(in_flight)
+
+    async def hold(url, host):
+        async with client._slot(url):
+            in_flight[host] += 1
+            peak[host] = max(peak[host], in_flight[host])
+            await asyncio.sleep(0.01)
+            in_flight[host] -= 1
+
+    async def main():
+        await asyncio.gather(*(hold("https://a.example/x", "a.example") for _ in range(5)),
+                             *(hold("http://slow.example:8080/y", "slow.example:8080") for _ in range(3)))
+        await client.aclose()
+
+    asyncio.run(main())
+    assert peak == {"a.example": 2, "slow.example:8080": 1}
+
+
+def test_async_uploads_are_not_repeated_after_a_read_timeout(monkeypatch):
+    import httpx
+
+    sent = []
+
+    def handler(request):
+        sent.append(request.method)
+        # The first attempt of each request times out waiting for the answer
+        if sent.count(request.method) == 1:
+            raise httpx.ReadTimeout("read timed out", request=request)
+        return httpx.Response(200, json={"id": "1"})
+
+    async def main():
+        client = AsyncHttpClient(max_retries=3, backoff_factor=0)
+        await client.client.aclose()
+        client.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        try:
+            with pytest.raises(httpx.ReadTimeout):
+                await client.post("https://example.social/api/v2/media", content=b"jpeg")
+            assert (await client.get("https://example.social/api/v1/media/1")).status_code == 200
+        finally:
+            await client.aclose()
+
+    asyncio.run(main())
+    # The upload was sent once; the GET after it was retried
+    assert sent == ["POST", "GET", "GET"]
+
+
+class FakePost:
+    shortcode = "ABC123"
+    caption = "Ein Abend im Neubau"
+    accessibility_caption = "Foto"
+
+
+class FakeAsyncTextProcessor:
+    def __init__(self):
+        self.calls = 0
+
+    async def summarize_if_needed(self, text, max_chars=None):
+        self.calls += 1
+        return text
+
+
+def _fake_mastodon(account, fail_on_reply=False, fail_uploads=0):
+    """An AsyncMastodonClient that records uploads and statuses; threads are laid out by the real client."""
+    from instadon.async_clients import AsyncMastodonClient
+    from instadon.instance import InstanceCapabilities
+
+    class FakeAsyncMastodon(AsyncMastodonClient):
+        def __init__(self):
+            self.account_name = account
+            self.uploads = []
+            self.statuses = []
+            self.fail_on_reply = fail_on_reply
+            self.fail_uploads = fail_uploads
+
+        async def capabilities(self):
+            return InstanceCapabilities()
+
+        def track_pending(self, media_ids):
+            pass
+
+        async def upload_media(self, path, description, in_use=None):
+            if self.fail_uploads:
+                self.fail_uploads -= 1
+                raise RuntimeError("upload rejected")
+            self.uploads.append(path)
+            return f"media-{path.rsplit('/', 1)[-1].split('.')[0]}"
+
+        async def create_post(self, status, media_ids, visibility="public", in_reply_to_id=None):
+            if in_reply_to_id and self.fail_on_reply:
+                self.fail_on_reply = False
+                raise RuntimeError("connection reset")
+            post = {"id": f"status-{len(self.statuses) + 1}", "status": status, "media_ids": media_ids,
+                    "in_reply_to_id": in_reply_to_id}
+            self.statuses.append(post)
+            return post
+
+    return FakeAsyncMastodon()
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch, isolated_config):
+    """Builds AsyncInstaDon apps on fake Cobalt, CDN and Mastodon; records what was resolved and downloaded."""
+    from concurrent.futures import ThreadPoolExecutor
+    from instadon import async_core
+    from instadon.cursor import CursorStore
+    from instadon.journal import JournalStore
+    from instadon.post_tracker import PostTracker
+
+    CONFIG["transcode"]["enabled"] = False
+    calls = {"cobalt": [], "downloads": [], "gone": set()}
+    media_count = {"value": 6}
+
+    async def fake_cobalt(http, url, **kwargs):
+        calls["cobalt"].append(url)
+        # Every answer has new (signed) URLs
+        version = len(calls["cobalt"])
+        return {"status": "picker", "picker": [{"type": "photo", "url": f"https://cdn.example/{i}.jpg?v={version}"}
+                                               for i in range(media_count["value"])]}
+
+    async def fake_download(http, url, suffix=None, **kwargs):
+        calls["downloads"].append(url)
+        if url in calls["gone"]:
+            error = RuntimeError(f"410 Gone: {url}")
+            error.response = type("Response", (), {"status_code": 410})()
+            raise error
+        path = tmp_path / url.rsplit("/", 1)[-1].split("?")[0]
+        path.write_bytes(b"jpeg")
+        return path
+
+    monkeypatch.setattr(async_core, "download_from_cobalt", fake_cobalt)
+    monkeypatch.setattr(async_core, "url_to_file", fake_download)
+    executor = ThreadPoolExecutor(max_workers=2)
+
+    def make(clients, text_processor, count=6):
+        media_count["value"] = count
+        accounts = list(clients)
+        app = async_core.AsyncInstaDon(accounts[0], instagram=None, http=None, text_processor=text_processor,
+                                       mastodon_clients=clients, extra_accounts=accounts[1:],
+                                       post_tracker=PostTracker(str(tmp_path / "posted.txt")),
+                                       cursors=CursorStore(str(tmp_path / "cursors.json")), executor=executor)
+        app.journals = JournalStore(str(tmp_path / "journal"))
+        return app
+
+    make.calls = calls
+    yield make
+    executor.shutdown(wait=True)
+
+
+def test_async_interrupted_post_resumes_from_journal(engine, tmp_path):
+    mastodon = _fake_mastodon("test@example.social", fail_on_reply=True)
+    text_processor = FakeAsyncTextProcessor()
+    app = engine({"test@example.social": mastodon}, text_processor)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(app._process_instagram_post(FakePost()))
+    assert len(mastodon.uploads) == 6
+    assert len(mastodon.statuses) == 1
+
+    result = asyncio.run(app._process_instagram_post(FakePost()))
+
+    assert result["status"] == "success"
+    assert [post["id"] for post in result["posts"]] == ["status-1", "status-2"]
+    assert mastodon.statuses[1]["in_reply_to_id"] == "status-1"
+    assert mastodon.statuses[1]["media_ids"] == ["media-4", "media-5"]
+    # Nothing was resolved, uploaded or summarized twice
+    assert len(engine.calls["cobalt"]) == 1
+    assert len(mastodon.uploads) == 6
+    assert text_processor.calls == 1
+    assert list((tmp_path / "journal").iterdir()) == []
+
+
+def test_async_fan_out_shares_downloads_and_text(engine):
+    first, second = _fake_mastodon("a@one.social"), _fake_mastodon("b@two.social")
+    text_processor = FakeAsyncTextProcessor()
+    app = engine({"a@one.social": first, "b@two.social": second}, text_processor, count=3)
+
+    result = asyncio.run(app._process_instagram_post(FakePost()))
+
+    assert {account: outcome["status"] for account, outcome in result["accounts"].items()} == \
+        {"a@one.social": "success", "b@two.social": "success"}
+    assert len(first.uploads) == len(second.uploads) == 3
+    # Resolved, downloaded and summarized once for both accounts
+    assert len(engine.calls["cobalt"]) == 1
+    assert len(engine.calls["downloads"]) == 3
+    assert text_processor.calls == 1
+
+
+def test_async_failed_account_is_retried_alone(engine):
+    first, second = _fake_mastodon("a@one.social"), _fake_mastodon("b@two.social", fail_uploads=1)
+    app = engine({"a@one.social": first, "b@two.social": second}, FakeAsyncTextProcessor(), count=3)
+
+    with pytest.raises(RuntimeError, match="1 of 2 accounts"):
+        asyncio.run(app._process_instagram_post(FakePost()))
+    assert len(first.statuses) == 1
+    assert second.statuses == []
+
+    result = asyncio.run(app._process_instagram_post(FakePost()))
+
+    assert result["accounts"]["a@one.social"]["status"] == "skipped"
+    assert result["accounts"]["b@two.social"]["status"] == "success"
+    assert len(first.statuses) == len(second.statuses) == 1
+    assert len(first.uploads) == 3
+
+
+def test_async_expired_media_urls_are_resolved_again(engine):
+    mastodon = _fake_mastodon("test@example.social")
+    app = engine({"test@example.social": mastodon}, FakeAsyncTextProcessor(), count=2)
+    # The URLs of the first answer stopped working before they were downloaded
+    engine.calls["gone"].update(f"https://cdn.example/{i}.jpg?v=1" for i in range(2))
+
+    result = asyncio.run(app._process_instagram_post(FakePost()))
+
+    assert result["status"] == "success"
+    assert len(engine.calls["cobalt"]) == 2
+    assert mastodon.statuses[0]["media_ids"] == ["media-0", "media-1"]
+
+
+def test_async_backlog_leaves_posted_captions_out_of_the_batch(engine):
+    from datetime import datetime
+
+    from instadon.instagram_cache import CachedPost
+
+    class BatchingTextProcessor(FakeAsyncTextProcessor):
+        batches = []
+
+        async def process_many(self, texts, max_chars=None):
+            self.batches.append(texts)
+            return [text.upper() for text in texts]
+
+    class FakeInstagram:
+        def new_posts(self, profile_name, since):
+            return [CachedPost(shortcode, f"Caption {shortcode}", None, datetime(2024, 5, day))
+                    for day, shortcode in enumerate(("OLD", "NEW1", "NEW2"), 1)]
+
+    mastodon = _fake_mastodon("test@example.social")
+    text_processor = BatchingTextProcessor()
+    app = engine({"test@example.social": mastodon}, text_processor, count=1)
+    app.instagram = FakeInstagram()
+    app.post_tracker.mark_as_posted("OLD", "test@example.social")
+
+    results = asyncio.run(app.post_new_from_profile("profile"))
+
+    assert [result["status"] for result in results] == ["skipped", "success", "success"]
+    assert text_processor.batches == [["Caption NEW1", "Caption NEW2"]]
+    # Each post used its text from the batch
+    assert [post["status"] for post in mastodon.statuses] == ["CAPTION NEW1", "CAPTION NEW2"]
+    assert text_processor.calls == 0
@@ -0,0 +1,122 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from instadon.backfill import Backfill
+from instadon.core import InstaDon
+from instadon.instagram_cache import CachedPost
+
+START = datetime(2024, 1, 1)
+
+
+class FakeInstagram:
+    """Serves 30 daily posts newest first; the resume state is the index to continue from."""
+
+    def __init__(self):
+        self.posts = [CachedPost(f"p{i}", f"Post {i}", None, START + timedelta(days=i)) for i in range(30)][::-1]
+        self.fetched = 0
+
+    def iter_posts(self, profile_name, since, resume=None):
+        for index in range((resume or {}).get("index", 0), len(self.posts)):
+            post = self.posts[index]
+            if post.date_utc.replace(tzinfo=timezone.utc) < since:
+                return
+            self.fetched += 1
+            yield post, {"index": index}
+
+
+def make_app(tmp_path, instagram):
+    app = InstaDon("test@example.social", instagram=instagram, tracker_file=str(tmp_path / "posted.txt"),
+                   cursor_file=str(tmp_path / "cursors.json"))
+    app.handled = []
+
+    def process(post, visibility="public"):
+        if post.shortcode == app.interrupt_at:
+            raise KeyboardInterrupt
+        if post.shortcode == "p25":
+            raise RuntimeError("Cobalt could not resolve the post")
+        app.handled.append(post.shortcode)
+        app.post_tracker.mark_as_posted(post.shortcode, "test@example.social")
+        return {"status": "success", "shortcode": post.shortcode}
+
+    app._process_instagram_post = process
+    app.interrupt_at = None
+    return app
+
+
+def test_backfill_skips_posted_paces_and_resumes(tmp_path):
+    instagram = FakeInstagram()
+    app = make_app(tmp_path, instagram)
+    app.post_tracker.mark_as_posted("p28")
+    checkpoint = tmp_path / "checkpoint.json"
+
+    def backfill():
+        return Backfill(app, "profile", START + timedelta(days=20), posts_per_hour=3600 * 1000, queue_size=2,
+                        checkpoint_file=str(checkpoint))
+
+    app.interrupt_at = "p23"
+    with pytest.raises(KeyboardInterrupt):
+        backfill().run()
+    assert app.handled == ["p29", "p27", "p26", "p24"]
+    saved = json.loads(checkpoint.read_text())
+    assert saved["posted"] == 4 and saved["failed"] == ["p25"]
+    assert saved["iterator"] == {"index": 5}
+
+    app.interrupt_at = None
+    fetched = instagram.fetched
+    report = backfill().run()
+
+    assert app.handled[4:] == ["p23", "p22", "p21", "p20"]
+    # Resumed at p24, not from the top of the profile
+    assert instagram.fetched - fetched == 5
+    assert report["posted"] == 8 and report["failed"] == ["p25"]
+    assert not checkpoint.exists()
+    assert app.cursors.get("profile:test@example.social") == (START + timedelta(days=29)).replace(tzinfo=timezone.utc)
+
+
+def test_only_posts_published_by_this_run_are_counted(tmp_path):
+    app = make_app(tmp_path, FakeInstagram())
+    handled = app._process_instagram_post
+
+    def process(post, visibility="public"):
+        if post.shortcode == "p28":
+            # Posted to every account by a concurrent run since the tracker was checked
+            return {"status": "skipped", "reason": "already_posted", "shortcode": post.shortcode}
+        return handled(post, visibility)
+
+    app._process_instagram_post = process
+    report = Backfill(app, "profile", START + timedelta(days=27), posts_per_hour=3600 * 1000,
+                      checkpoint_file=str(tmp_path / "checkpoint.json")).run()
+
+    assert [result["status"] for result in report["results"]] == ["success", "skipped", "success"]
+    assert report["posted"] == 2
+
+
+def test_interrupt_does_not_wait_for_a_stuck_fetch(tmp_path, monkeypatch):
+    import threading
+    import time
+
+    import instadon.backfill
+
+    monkeypatch.setattr(instadon.backfill, "PRODUCER_JOIN_TIMEOUT", 0.1)
+    instagram = FakeInstagram()
+    released = threading.Event()
+
+    def iter_posts(profile_name, since, resume=None):
+        # One page is handed to the posting loop, then the next page's request doesn't return
+        for index in range(instadon.backfill.FILTER_CHUNK):
+            yield instagram.posts[index], {"index": index}
+        released.wait(10)
+
+    instagram.iter_posts = iter_posts
+    app = make_app(tmp_path, instagram)
+    app.interrupt_at = "p29"
+
+    started = time.monotonic()
+    with pytest.raises(KeyboardInterrupt):
+        Backfill(app, "profile", START, posts_per_hour=3600 * 1000,
+                 checkpoint_file=str(tmp_path / "checkpoint.json")).run()
+    released.set()
+
+    assert time.monotonic() - started < 5
@@ -0,0 +1,80 @@
+import json
+
+import pytest
+
+from instadon.batch import BatchRunner, job_accounts, load_manifest
+
+
+def _write(tmp_path, manifest):
+    path = tmp_path / "jobs.json"
+    path.write_text(json.dumps(manifest))
+    return str(path)
+
+
+def test_manifest_defaults_and_fan_out(tmp_path):
+    manifest = load_manifest(_write(tmp_path, {
+        "session": "kommen",
+        "workers": 2,
+        "jobs": [
+            {"profile": "kulturneubau", "account": "kulturneubau@neubau.social"},
+            {"profile": "kaffemik", "account": ["kaffemik@neubau.social", "kulturneubau@neubau.social"],
+             "visibility": "unlisted"},
+        ],
+    }))
+
+    assert manifest["workers"] == 2
+    assert [job["visibility"] for job in manifest["jobs"]] == ["public", "unlisted"]
+    assert job_accounts(manifest["jobs"][1]) == "kaffemik@neubau.social, kulturneubau@neubau.social"
+
+
+def test_manifest_may_be_a_plain_list_of_jobs(tmp_path):
+    manifest = load_manifest(_write(tmp_path, [{"profile": "kulturneubau", "account": "a@b.social"}]))
+
+    assert [job["profile"] for job in manifest["jobs"]] == ["kulturneubau"]
+
+
+@pytest.mark.parametrize("manifest, message", [
+    ({"jobs": []}, "contains no jobs"),
+    ([{"profile": "kulturneubau"}], "missing: account"),
+    ([{"profile": "kulturneubau", "account": "a@b.social", "visibility": "secret"}], "invalid visibility"),
+])
+def test_invalid_manifests_are_rejected(tmp_path, manifest, message):
+    with pytest.raises(ValueError, match=message):
+        load_manifest(_write(tmp_path, manifest))
+
+
+class FakeApp:
+    def __init__(self, outcomes, profile_log):
+        self.outcomes = outcomes
+        self.profile_log = profile_log
+
+    def post_new_from_profile(self, profile, visibility):
+        self.profile_log.append((profile, visibility))
+        outcome = self.outcomes[profile]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def test_runner_reports_every_job_in_order(tmp_path):
+    outcomes = {
+        "posted": [{"status": "success", "shortcode": "A"}, {"status": "skipped", "shortcode": "B"}],
+        "quiet": [{"status": "skipped", "shortcode": "C"}],
+        "broken": RuntimeError("session expired"),
+    }
+    profile_log = []
+
+    class FakeRunner(BatchRunner):
+        def app_for(self, account, tracker_file=None):
+            return FakeApp(outcomes, profile_log)
+
+    runner = FakeRunner(tracker_file=str(tmp_path / "posted.txt"), max_workers=3,
+                        cursor_file=str(tmp_path / "cursors.json"))
+    jobs = [{"profile": profile, "account": "a@b.social", "visibility": "public"} for profile in outcomes]
+
+    reports = runner.run(jobs)
+
+    assert [report["job"]["profile"] for report in reports] == ["posted", "quiet", "broken"]
+    assert [report["status"] for report in reports] == ["success", "skipped", "error"]
+    assert reports[2]["error"] == "session expired"
+    assert sorted(profile_log) == sorted((profile, "public") for profile in outcomes)
@@ -0,0 +1,34 @@
+import copy
+
+from benchmarks import pipeline
+from instadon import budget, instance, media_store, resolver, transcode
+from instadon.config import CONFIG
+
+
+def test_pipeline_benchmark_runs_offline(monkeypatch):
+    # The benchmark repoints CONFIG and the process-wide singletons; restore them afterwards
+    for section in list(CONFIG):
+        monkeypatch.setitem(CONFIG, section, copy.deepcopy(CONFIG[section]))
+    monkeypatch.setattr(budget, "_llm_budget", None)
+    monkeypatch.setattr(resolver, "_default_resolver", None)
+    monkeypatch.setattr(media_store, "_default_store", None)
+    monkeypatch.setattr(instance, "_default_cache", None)
+    monkeypatch.setattr(transcode, "_default_transcoder", None)
+
+    available = pipeline.scenarios(reel_mb=1, profiles=2)
+    results = [
+        pipeline.run_scenario(available[name], runs=1, latency=0, bandwidth=None, processing_delay=0.1,
+                              rate_limit_every=2, workers=2)
+        for name in ("carousel", "reel", "batch")
+    ]
+
+    carousel, reel, batch = results
+    assert carousel["posts"] == 1
+    # 10 items at 4 per post, one of the statuses answered with 429 and retried
+    assert carousel["requests"]["statuses"] == 3
+    assert carousel["requests"]["rate_limited"] >= 1
+    assert reel["requests"]["media_polls"] >= 1
+    assert batch["posts"] == 2
+    assert all(result["posts_per_s"] > 0 for result in results)
+    if transcode._default_transcoder is not None:
+        transcode._default_transcoder.close()
@@ -0,0 +1,42 @@
+import time
+
+from instadon.budget import RequestBudget
+from instadon.instagram_cache import CachedPost, InstagramCache
+
+
+def test_bucket_refills_at_rate(tmp_path):
+    budget = RequestBudget(rate_per_hour=3600 * 100, burst=2, state_file=str(tmp_path / "budget.json"))
+    budget.acquire()
+    budget.acquire()
+    assert budget.wait_time() > 0
+
+    started = time.monotonic()
+    budget.acquire()
+    assert time.monotonic() - started < 0.1
+
+    # Another process starts from the saved level rather than a full bucket
+    assert RequestBudget(rate_per_hour=3600 * 100, burst=2, state_file=str(tmp_path / "budget.json")).wait_time(2) > 0
+
+
+def test_penalize_blocks_all_requests():
+    budget = RequestBudget(rate_per_hour=3600 * 1000, burst=50)
+    budget.penalize(30)
+    assert 29 < budget.wait_time() <= 30
+
+
+def test_post_metadata_round_trips_and_expires(tmp_path):
+    from datetime import datetime
+
+    cache = InstagramCache(str(tmp_path / "instagram.json"), profile_ttl=3600, post_ttl=3600)
+    post = CachedPost("ABC123", "Caption", "Photo of a stage", datetime(2024, 5, 1, 18, 30), owner_username="neubau")
+    cache.remember_posts([post])
+    cache.remember_profile("Neubau", 42, "Kultur im Neubau")
+
+    reloaded = InstagramCache(str(tmp_path / "instagram.json"), profile_ttl=3600, post_ttl=3600)
+    cached = reloaded.post("ABC123")
+    assert (cached.caption, cached.accessibility_caption, cached.date_utc) == \
+        ("Caption", "Photo of a stage", datetime(2024, 5, 1, 18, 30))
+    assert reloaded.profile("neubau") == {"id": 42, "full_name": "Kultur im Neubau", "fetched": reloaded.profile("neubau")["fetched"]}
+
+    expired = InstagramCache(str(tmp_path / "instagram.json"), profile_ttl=3600, post_ttl=1e-9)
+    assert expired.post("ABC123") is None
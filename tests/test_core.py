@@ -1,7 +1,255 @@
 import pytest
 from instadon.core import InstaDon
+from instadon.instance import InstanceCapabilities
+from instadon.mastodon import MastodonClient
 
-def test_instadon_initialization():
+def test_instadon_initialization(tmp_path):
     """Test that InstaDon can be initialized."""
-    app = InstaDon()
+    app = InstaDon("kulturneubau@neubau.social", tracker_file=str(tmp_path / "posted.txt"),
+                   cursor_file=str(tmp_path / "cursors.json"))
     assert app is not None
+    assert app.accounts == ["kulturneubau@neubau.social"]
+
+
+class FakePost:
+    shortcode = "ABC123"
+    caption = "Ein Abend im Neubau"
+    accessibility_caption = "Foto"
+
+
+class FakeTextProcessor:
+    def __init__(self):
+        self.calls = 0
+
+    def summarize_if_needed(self, text, max_chars=None):
+        self.calls += 1
+        return text
+
+
+class FlakyMastodon(MastodonClient):
+    """Uploads media and posts statuses, failing once on the second thread part.
+
+    Threads are laid out by the real MastodonClient.create_post_thread.
+    """
+
+    account_name = "test@example.social"
+    capabilities = InstanceCapabilities()
+
+    def __init__(self):
+        self.uploads = []
+        self.statuses = []
+        self.fail_on_reply = True
+
+    def upload_media(self, path, description, in_use=None):
+        self.uploads.append(path)
+        return f"media-{path.rsplit('/', 1)[-1].split('.')[0]}"
+
+    def track_pending(self, media_ids):
+        pass
+
+    def media_limits(self):
+        return {}
+
+    def create_post(self, status, media_ids, visibility="public", in_reply_to_id=None):
+        if in_reply_to_id and self.fail_on_reply:
+            self.fail_on_reply = False
+            raise RuntimeError("connection reset")
+        post = {"id": f"status-{len(self.statuses) + 1}", "media_ids": media_ids, "in_reply_to_id": in_reply_to_id}
+        self.statuses.append(post)
+        return post
+
+
+def test_interrupted_post_resumes_from_journal(tmp_path, monkeypatch):
+    import instadon.media
+    import instadon.pipeline
+    import instadon.resolver
+    from instadon.journal import JournalStore
+
+    cobalt_calls = []
+    picker = {"status": "picker", "picker": [{"type": "photo", "url": f"https://cdn.example/{i}.jpg"} for i in range(6)]}
+    monkeypatch.setattr(instadon.media, "download_from_cobalt",
+                        lambda url, **kwargs: cobalt_calls.append(url) or picker)
+    monkeypatch.setattr(instadon.resolver, "_default_resolver", None)
+
+    def fake_download(url, suffix=None, **kwargs):
+        path = tmp_path / url.rsplit("/", 1)[-1]
+        path.write_bytes(b"jpeg")
+        return path
+
+    monkeypatch.setattr(instadon.pipeline, "url_to_file", fake_download)
+
+    mastodon = FlakyMastodon()
+    text_processor = FakeTextProcessor()
+    app = InstaDon("test@example.social", mastodon=mastodon, text_processor=text_processor,
+                   tracker_file=str(tmp_path / "posted.txt"), cursor_file=str(tmp_path / "cursors.json"))
+    app.journals = JournalStore(str(tmp_path / "journal"))
+
+    with pytest.raises(RuntimeError):
+        app._process_instagram_post(FakePost())
+    assert len(mastodon.uploads) == 6
+    assert len(mastodon.statuses) == 1
+
+    result = app._process_instagram_post(FakePost())
+
+    assert result["status"] == "success"
+    assert [post["id"] for post in result["posts"]] == ["status-1", "status-2"]
+    assert mastodon.statuses[1]["in_reply_to_id"] == "status-1"
+    assert mastodon.statuses[1]["media_ids"] == ["media-4", "media-5"]
+    # Nothing was resolved, uploaded or summarized twice
+    assert len(cobalt_calls) == 1
+    assert len(mastodon.uploads) == 6
+    assert text_processor.calls == 1
+    assert list((tmp_path / "journal").iterdir()) == []
+
+
+def test_fan_out_shares_downloads_and_text(tmp_path, monkeypatch):
+    import instadon.media
+    import instadon.pipeline
+    import instadon.resolver
+    from instadon.journal import JournalStore
+
+    cobalt_calls = []
+    downloads = []
+    picker = {"status": "picker", "picker": [{"type": "photo", "url": f"https://cdn.example/{i}.jpg"} for i in range(3)]}
+    monkeypatch.setattr(instadon.media, "download_from_cobalt",
+                        lambda url, **kwargs: cobalt_calls.append(url) or picker)
+    monkeypatch.setattr(instadon.resolver, "_default_resolver", None)
+
+    def fake_download(url, suffix=None, **kwargs):
+        downloads.append(url)
+        path = tmp_path / url.rsplit("/", 1)[-1]
+        path.write_bytes(b"jpeg")
+        return path
+
+    monkeypatch.setattr(instadon.pipeline, "url_to_file", fake_download)
+
+    accounts = ["a@example.social", "b@example.social"]
+    clients = {account: FlakyMastodon() for account in accounts}
+    clients["b@example.social"].fail_on_reply = False
+    text_processor = FakeTextProcessor()
+    app = InstaDon(accounts[0], extra_accounts=accounts[1:], mastodon_clients=clients, text_processor=text_processor,
+                   tracker_file=str(tmp_path / "posted.txt"), cursor_file=str(tmp_path / "cursors.json"))
+    app.journals = JournalStore(str(tmp_path / "journal"))
+
+    result = app._process_instagram_post(FakePost())
+
+    assert result["status"] == "success"
+    assert set(result["accounts"]) == set(accounts)
+    assert len(cobalt_calls) == 1
+    assert sorted(downloads) == sorted(item["url"] for item in picker["picker"])
+    assert text_processor.calls == 1
+    for client in clients.values():
+        assert client.statuses[0]["media_ids"] == ["media-0", "media-1", "media-2"]
+
+    # Tracked per account: a second pass skips both
+    assert app._process_instagram_post(FakePost())["status"] == "skipped"
+
+
+def _journal_state(shortcode, account, recorded, **stages):
+    import time
+    now = time.time()
+    return dict(stages, shortcode=shortcode, account=account, created=now - recorded, updated=now,
+                recorded={stage: now - recorded for stage in stages})
+
+
+@pytest.mark.parametrize("status_code", [404, 410])
+def test_resume_resolves_expired_media_urls_again(tmp_path, monkeypatch, status_code):
+    import requests
+    import instadon.media
+    import instadon.pipeline
+    import instadon.resolver
+    from instadon.journal import JournalStore
+
+    # A crash left the tunnel URLs Cobalt answered with moments ago; by now they are gone
+    journals = JournalStore(str(tmp_path / "journal"))
+    journal = journals.open("ABC123", "test@example.social")
+    journal.state = _journal_state("ABC123", "test@example.social", 10,
+                                   media_items=[[f"https://tunnel.example/old-{i}", None] for i in range(2)])
+    journal._save()
+
+    cobalt_calls = []
+    picker = {"status": "picker", "picker": [{"type": "photo", "url": f"https://cdn.example/{i}.jpg"} for i in range(2)]}
+    monkeypatch.setattr(instadon.media, "download_from_cobalt",
+                        lambda url, **kwargs: cobalt_calls.append(url) or picker)
+    monkeypatch.setattr(instadon.resolver, "_default_resolver", None)
+
+    def fake_download(url, suffix=None, **kwargs):
+        if "old" in url:
+            response = requests.Response()
+            response.status_code = status_code
+            raise requests.HTTPError(f"{status_code} Client Error", response=response)
+        path = tmp_path / url.rsplit("/", 1)[-1]
+        path.write_bytes(b"jpeg")
+        return path
+
+    monkeypatch.setattr(instadon.pipeline, "url_to_file", fake_download)
+
+    mastodon = FlakyMastodon()
+    app = InstaDon("test@example.social", mastodon=mastodon, text_processor=FakeTextProcessor(),
+                   tracker_file=str(tmp_path / "posted.txt"), cursor_file=str(tmp_path / "cursors.json"))
+    app.journals = journals
+
+    result = app._process_instagram_post(FakePost())
+
+    assert result["status"] == "success"
+    assert len(cobalt_calls) == 1
+    assert mastodon.statuses[0]["media_ids"] == ["media-0", "media-1"]
+    assert list((tmp_path / "journal").iterdir()) == []
+
+
+def test_journaled_stages_expire(tmp_path, monkeypatch):
+    import time
+    import instadon.media
+    import instadon.pipeline
+    import instadon.resolver
+    from instadon.journal import JournalStore
+
+    journals = JournalStore(str(tmp_path / "journal"))
+    journal = journals.open("ABC123", "test@example.social")
+    # Two hours old: the media URLs have expired, the unattached media IDs are still there
+    journal.state = _journal_state("ABC123", "test@example.social", 2 * 3600,
+                                   media_items=[["https://tunnel.example/old-0", None]],
+                                   media_ids=["media-old"])
+    journal._save()
+
+    picker = {"status": "picker", "picker": [{"type": "photo", "url": "https://cdn.example/0.jpg"}]}
+    monkeypatch.setattr(instadon.media, "download_from_cobalt", lambda url, **kwargs: picker)
+    monkeypatch.setattr(instadon.resolver, "_default_resolver", None)
+    monkeypatch.setattr(instadon.pipeline, "url_to_file", lambda url, suffix=None, **kwargs: pytest.fail("downloaded again"))
+
+    mastodon = FlakyMastodon()
+    app = InstaDon("test@example.social", mastodon=mastodon, text_processor=FakeTextProcessor(),
+                   tracker_file=str(tmp_path / "posted.txt"), cursor_file=str(tmp_path / "cursors.json"))
+    app.journals = journals
+
+    assert app._process_instagram_post(FakePost())["status"] == "success"
+    assert mastodon.statuses[0]["media_ids"] == ["media-old"]
+
+    # Resumed 13 hours after the post was started: the media IDs may be gone too
+    journal = journals.open("ABC123", "test@example.social")
+    journal.state = _journal_state("ABC123", "test@example.social", 13 * 3600, media_ids=["media-old"])
+    assert journal.fresh("media_ids", 12 * 3600) is None
+    assert "media_ids" not in journal.state
+    assert journal.get("created") < time.time() - 12 * 3600
+
+
+def test_garbage_collection_keeps_shared_media(tmp_path):
+    import os
+    from instadon.journal import JournalStore
+    from instadon.media_store import MediaStore
+
+    store = MediaStore(str(tmp_path / "media"))
+    shared = store.put_chunks([b"jpeg"], ".jpeg")
+    journals = JournalStore(str(tmp_path / "journal"), max_age=3600)
+    stale = journals.open("OLD", "a@example.social")
+    stale.state = _journal_state("OLD", "a@example.social", 2 * 3600, files=[str(shared)])
+    stale._save()
+    # Resumed a minute ago, but started too long ago to be resumed again
+    os.utime(stale.path)
+    current = journals.open("NEW", "a@example.social")
+    current.record("files", [str(shared)])
+
+    assert journals.collect_garbage() == 1
+
+    assert not stale.path.exists() and current.path.exists()
+    assert shared.exists()
@@ -0,0 +1,58 @@
+import threading
+from datetime import datetime, timezone
+
+from instadon.cursor import CursorStore
+from instadon.instagram import InstagramClient
+from instadon.instagram_cache import InstagramCache
+
+
+class FakePost:
+    def __init__(self, shortcode, day, is_pinned=False):
+        self.shortcode = shortcode
+        self.date_utc = datetime(2026, 5, day)
+        self.is_pinned = is_pinned
+        self.caption = f"Post {shortcode}"
+        self.accessibility_caption = None
+
+
+class FakeProfile:
+    def __init__(self, posts):
+        self.posts = posts
+        self.fetched = 0
+
+    def get_posts(self):
+        for post in self.posts:
+            self.fetched += 1
+            yield post
+
+
+def make_client(profile, cache_file):
+    client = InstagramClient.__new__(InstagramClient)
+    client.cache = InstagramCache(str(cache_file))
+    client._lock = threading.RLock()
+    client._profiles = {"kulturneubau": profile}
+    return client
+
+
+def test_cursor_only_moves_forward(tmp_path):
+    cursors = CursorStore(str(tmp_path / "cursors.json"))
+    assert cursors.get("kulturneubau") is None
+
+    cursors.advance("kulturneubau", datetime(2026, 5, 3), "C")
+    cursors.advance("kulturneubau", datetime(2026, 5, 2), "B")
+    assert CursorStore(str(tmp_path / "cursors.json")).get("kulturneubau") == datetime(2026, 5, 3, tzinfo=timezone.utc)
+
+
+def test_new_posts_stops_at_cursor(tmp_path):
+    profile = FakeProfile([
+        FakePost("PIN", 1, is_pinned=True),
+        FakePost("E", 5), FakePost("D", 4), FakePost("C", 3), FakePost("B", 2), FakePost("A", 1),
+    ])
+    client = make_client(profile, tmp_path / "instagram.json")
+
+    posts = client.new_posts("kulturneubau", datetime(2026, 5, 3, tzinfo=timezone.utc))
+
+    assert [post.shortcode for post in posts] == ["D", "E"]
+    assert profile.fetched == 4
+    # Seen posts are answered from the cache later
+    assert client.get_post_by_shortcode("D").caption == "Post D"
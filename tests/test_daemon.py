@@ -0,0 +1,53 @@
+import threading
+import time
+
+from instadon.budget import RequestBudget
+from instadon.daemon import Daemon
+
+
+class FakeRunner:
+    max_workers = 2
+
+    def __init__(self):
+        self.calls = []
+        self.closed = False
+
+    def run_job(self, job):
+        self.calls.append(job["profile"])
+        status = "success" if job["profile"] == "active" else "skipped"
+        return {"job": job, "status": status, "elapsed": 0.0}
+
+    def close(self):
+        self.closed = True
+
+
+def test_adapts_intervals_and_stops_gracefully():
+    runner = FakeRunner()
+    jobs = [
+        {"profile": "active", "account": "a@example.social", "interval": 0.08},
+        {"profile": "quiet", "account": "b@example.social", "interval": 0.02},
+    ]
+    daemon = Daemon(runner, jobs, min_interval=0.01, max_interval=1.0, jitter=0.0,
+                    budget=RequestBudget(rate_per_hour=3600 * 1000, burst=100))
+
+    threading.Timer(0.3, daemon.stop).start()
+    # Signal handlers can only be installed from the main thread, which is where run() is called
+    daemon.run()
+
+    assert runner.closed
+    assert "active" in runner.calls and "quiet" in runner.calls
+    assert daemon.intervals[0] < 0.08
+    assert daemon.intervals[1] > 0.02
+
+
+def test_polls_wait_for_instagram_budget():
+    runner = FakeRunner()
+    jobs = [{"profile": "active", "account": "a@example.social", "interval": 0.01}]
+    budget = RequestBudget(rate_per_hour=3600, burst=10)
+    budget.penalize(60)
+    daemon = Daemon(runner, jobs, min_interval=0.01, max_interval=1.0, jitter=0.0, budget=budget)
+
+    threading.Timer(0.1, daemon.stop).start()
+    daemon.run()
+
+    assert runner.calls == []
@@ -0,0 +1,82 @@
+import io
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import requests
+
+from instadon import http_client
+from instadon.http_client import HttpClient
+
+
+def make_response(status_code, headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    response.raw = io.BytesIO(b"")
+    response.url = "https://example.social/api/v1/statuses"
+    return response
+
+
+def test_retries_rate_limited_requests_using_reset_header(monkeypatch):
+    reset = (datetime.now(timezone.utc) + timedelta(seconds=30)).isoformat().replace("+00:00", "Z")
+    responses = [
+        make_response(429, {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": reset}),
+        make_response(503, {"Retry-After": "2"}),
+        make_response(200),
+    ]
+    sleeps = []
+    monkeypatch.setattr(http_client.time, "sleep", sleeps.append)
+
+    client = HttpClient(max_retries=3)
+    monkeypatch.setattr(client.session, "request", lambda *args, **kwargs: responses.pop(0))
+
+    # Posting a status carries an Idempotency-Key, so it may be repeated after a 503
+    assert client.post("https://example.social/api/v1/statuses",
+                       headers={"Idempotency-Key": "abc"}).status_code == 200
+    assert 28 < sleeps[0] <= 30
+    assert sleeps[1] == 2
+
+
+def test_gives_up_after_max_retries(monkeypatch):
+    calls = []
+    monkeypatch.setattr(http_client.time, "sleep", lambda delay: None)
+
+    client = HttpClient(max_retries=2)
+
+    def request(*args, **kwargs):
+        calls.append(kwargs["timeout"])
+        return make_response(502)
+
+    monkeypatch.setattr(client.session, "request", request)
+
+    assert client.get("https://cobalt.example/").status_code == 502
+    assert len(calls) == 3
+    assert calls[0] == client.timeout
+
+
+def test_uploads_are_only_retried_if_nothing_was_sent(monkeypatch):
+    from urllib3.exceptions import MaxRetryError, NewConnectionError
+
+    monkeypatch.setattr(http_client.time, "sleep", lambda delay: None)
+    client = HttpClient(max_retries=3)
+    url = "https://example.social/api/v2/media"
+    refused = requests.ConnectionError(MaxRetryError(None, url, NewConnectionError(None, "Connection refused")))
+    outcomes = [refused, make_response(200)]
+
+    def request(*args, **kwargs):
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    monkeypatch.setattr(client.session, "request", request)
+    assert client.post(url).status_code == 200
+
+    # The upload may have been stored before the answer was lost; sending it again would duplicate it
+    outcomes = [requests.ReadTimeout("read timed out"), make_response(200)]
+    with pytest.raises(requests.ReadTimeout):
+        client.post(url)
+
+    outcomes = [make_response(502), make_response(200)]
+    assert client.post(url).status_code == 502
+    assert client.get(url).status_code == 200
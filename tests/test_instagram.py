@@ -0,0 +1,48 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("instaloader")
+
+import instaloader
+
+from instadon.instagram import InstagramClient
+from instadon.instagram_cache import InstagramCache
+
+
+def make_client(tmp_path):
+    # No session file or network: only the profile lookup is exercised
+    client = InstagramClient.__new__(InstagramClient)
+    client.loader = SimpleNamespace(context=object())
+    client.cache = InstagramCache(str(tmp_path / "instagram.json"))
+    client._profiles = {}
+    return client
+
+
+def test_cached_profile_ids_are_not_looked_up_again(tmp_path, monkeypatch):
+    client = make_client(tmp_path)
+    client.cache.remember_profile("Neubau", 42, "Kultur im Neubau")
+
+    def from_username(context, username):
+        raise AssertionError("profile looked up by username")
+
+    monkeypatch.setattr(instaloader.Profile, "from_username", from_username)
+    profile = client._profile("Neubau")
+
+    assert (profile.userid, profile.username, profile.full_name) == (42, "neubau", "Kultur im Neubau")
+    assert client._profile("Neubau") is profile
+
+
+def test_unknown_profiles_are_looked_up_and_cached(tmp_path, monkeypatch):
+    client = make_client(tmp_path)
+    lookups = []
+
+    def from_username(context, username):
+        lookups.append(username)
+        return instaloader.Profile(context, {"id": 7, "username": username, "full_name": "Kaffemik"})
+
+    monkeypatch.setattr(instaloader.Profile, "from_username", from_username)
+    client._profile("kaffemik")
+
+    assert lookups == ["kaffemik"]
+    assert client.cache.profile("kaffemik")["id"] == 7
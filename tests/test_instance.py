@@ -0,0 +1,70 @@
+import threading
+import time
+
+from instadon.instance import InstanceCache
+
+
+class FakeResponse:
+    def __init__(self, status_code, payload):
+        self.status_code = status_code
+        self._payload = payload
+
+    def json(self):
+        return self._payload
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+
+class FakeHttp:
+    def __init__(self, status_code=200):
+        self.status_code = status_code
+        self.calls = 0
+
+    def get(self, url, **kwargs):
+        self.calls += 1
+        time.sleep(0.01)
+        return FakeResponse(self.status_code, {"configuration": {
+            "statuses": {"max_characters": 5000, "max_media_attachments": 8},
+            "media_attachments": {"image_size_limit": 1024},
+        }})
+
+
+def test_fetched_once_and_shared(tmp_path):
+    http = FakeHttp()
+    cache = InstanceCache(str(tmp_path / "instances.json"), ttl=3600)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.capabilities("https://a.social", http)))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert http.calls == 1
+    assert {caps.max_characters for caps in results} == {5000}
+    assert results[0].max_media_attachments == 8
+    assert results[0].media_limits == {"image_size_limit": 1024}
+
+    # A new process reads the limits from disk
+    fresh = InstanceCache(str(tmp_path / "instances.json"), ttl=3600)
+    assert fresh.capabilities("https://a.social", http).max_characters == 5000
+    assert http.calls == 1
+
+
+def test_unreachable_instance_uses_defaults_then_stale_entry(tmp_path):
+    cache = InstanceCache(str(tmp_path / "instances.json"), ttl=0.01)
+    failing = FakeHttp(status_code=503)
+
+    caps = cache.capabilities("https://a.social", failing)
+    assert (caps.max_characters, caps.max_media_attachments) == (500, 4)
+    # Not asked again right away
+    cache.capabilities("https://a.social", failing)
+    assert failing.calls == 1
+
+    cache._failed_at.clear()
+    cache.capabilities("https://a.social", FakeHttp())
+    time.sleep(0.02)
+    assert cache.capabilities("https://a.social", failing).max_characters == 5000
@@ -0,0 +1,34 @@
+import os
+import time
+
+from instadon.llm_cache import LLMCache
+
+
+def test_roundtrip_and_stats(tmp_path):
+    cache = LLMCache(str(tmp_path), ttl=3600, max_entries=10)
+    key = LLMCache.make_key("model", "Summarize: {text}", "Hallo", {"max_tokens": 150})
+    assert key != LLMCache.make_key("model", "Summarize briefly: {text}", "Hallo", {"max_tokens": 150})
+
+    assert cache.get(key) is None
+    cache.set(key, "Hi", model="model")
+    assert cache.get(key) == "Hi"
+
+    stats = cache.stats()
+    assert stats["entries"] == 1
+    assert stats["session_hits"] == 1 and stats["session_misses"] == 1
+    assert stats["lifetime_hits"] == 1
+
+
+def test_evicts_expired_and_least_recently_used(tmp_path):
+    cache = LLMCache(str(tmp_path), ttl=3600, max_entries=2)
+    keys = [LLMCache.make_key("m", "t", str(i), {}) for i in range(4)]
+    for i, key in enumerate(keys):
+        cache.set(key, str(i))
+        path = cache._path(key)
+        os.utime(path, (time.time() - 100 + i, time.time() - 100 + i))
+    os.utime(cache._path(keys[0]), (0, 0))
+
+    assert cache.evict() == 2
+    assert cache.get(keys[0]) is None
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[3]) == "3"
@@ -0,0 +1,35 @@
+import pytest
+
+from instadon.main import parse_command_line, run_backfill, run_batch, run_cache, run_post
+
+
+def test_profile_form_is_the_default_command():
+    args = parse_command_line(["kulturneubau", "--account", "kulturneubau@neubau.social"])
+
+    assert args.run is run_post
+    assert args.profile == "kulturneubau"
+    assert args.account == ["kulturneubau@neubau.social"]
+
+
+def test_subcommands_are_parsed_by_their_own_parsers():
+    batch = parse_command_line(["batch", "jobs.json", "--workers", "2", "--async"])
+    assert batch.run is run_batch
+    assert (batch.manifest, batch.workers, batch.use_async) == ("jobs.json", 2, True)
+
+    backfill = parse_command_line(["backfill", "kulturneubau", "--since", "2024-01-01", "--account", "a@b.social"])
+    assert backfill.run is run_backfill
+    assert backfill.since.year == 2024
+
+    assert parse_command_line(["cache", "stats"]).run is run_cache
+
+
+def test_profiles_named_like_commands_go_after_a_double_dash():
+    args = parse_command_line(["--account", "a@b.social", "--", "batch"])
+
+    assert args.run is run_post
+    assert args.profile == "batch"
+
+
+def test_profile_or_url_is_required():
+    with pytest.raises(SystemExit):
+        parse_command_line(["--account", "a@b.social"])
@@ -0,0 +1,101 @@
+import pytest
+
+from instadon import mastodon
+from instadon.mastodon import MastodonClient
+from instadon.instance import InstanceCache
+from instadon.media_store import MediaStore
+
+
+class FakeResponse:
+    def __init__(self, status_code, payload):
+        self.status_code = status_code
+        self._payload = payload
+        self.headers = {}
+        self.text = str(payload)
+
+    def json(self):
+        return self._payload
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+
+class FakeHttp:
+    def __init__(self):
+        self.polls = {}
+        self.posted = []
+
+    def get(self, url, **kwargs):
+        media_id = url.rsplit("/", 1)[-1]
+        self.polls[media_id] = self.polls.get(media_id, 0) + 1
+        if self.polls[media_id] < 3:
+            return FakeResponse(206, {"id": media_id, "url": None})
+        return FakeResponse(200, {"id": media_id, "url": f"https://files.example/{media_id}.mp4"})
+
+    def post(self, url, **kwargs):
+        if url.endswith("/api/v2/media"):
+            media_id = str(len(self.polls) + 1)
+            self.polls[media_id] = 0
+            return FakeResponse(202, {"id": media_id, "url": None})
+        self.posted.append(kwargs["json"])
+        return FakeResponse(200, {"id": "status-1"})
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.setitem(mastodon.CONFIG["mastodon"]["accounts"], "test@example.social",
+                        {"instance": "https://example.social", "access_token": "token"})
+    monkeypatch.setitem(mastodon.CONFIG["media"], "processing_poll_interval", 0.001)
+    return MastodonClient("test@example.social", http=FakeHttp(), media_store=MediaStore(str(tmp_path / "store")),
+                          instances=InstanceCache(str(tmp_path / "instances.json")))
+
+
+def test_create_post_waits_for_processing_media(client, tmp_path):
+    video = tmp_path / "reel.mp4"
+    video.write_bytes(b"\x00" * 10)
+
+    media_id = client.upload_media(str(video), "A reel")
+    assert client.http.polls[media_id] == 0
+
+    client.create_post("Hello", [media_id])
+    assert client.http.polls[media_id] == 3
+    assert client.http.posted[0]["media_ids"] == [media_id]
+
+    # Ready media is not polled again
+    client.create_post("Again", [media_id])
+    assert client.http.polls[media_id] == 3
+
+
+def test_wait_for_media_times_out(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(client.http, "get", lambda url, **kwargs: FakeResponse(206, {"url": None}))
+    video = tmp_path / "reel.mp4"
+    video.write_bytes(b"\x00")
+    media_id = client.upload_media(str(video), "")
+
+    with pytest.raises(TimeoutError):
+        client.wait_for_media([media_id], timeout=0.01)
+
+
+def test_unattached_upload_is_reused(client, tmp_path):
+    photo = client.media_store.put_chunks([b"jpeg bytes"], ".jpeg")
+
+    first = client.upload_media(str(photo), "Foto")
+    assert client.upload_media(str(photo), "Foto") == first
+    assert client.upload_media(str(photo), "Anderes Foto") != first
+
+    client.create_post("Hello", [first])
+    assert client.upload_media(str(photo), "Foto") != first
+
+
+def test_same_bytes_twice_in_one_status_are_uploaded_twice(client):
+    photo = client.media_store.put_chunks([b"jpeg bytes"], ".jpeg")
+    earlier = client.upload_media(str(photo), "Foto")
+
+    # A carousel that repeats the photo: the unattached upload is reused once, not for both items
+    in_use = set()
+    media_ids = [client.upload_media(str(photo), "Foto", in_use) for _ in range(2)]
+
+    assert media_ids[0] == earlier
+    assert media_ids[1] != earlier
+    assert in_use == set(media_ids)
@@ -0,0 +1,68 @@
+import os
+
+from instadon.media_store import MediaStore
+
+
+def test_identical_bytes_are_stored_once(tmp_path):
+    store = MediaStore(str(tmp_path), max_bytes=1024)
+    first = store.put_chunks([b"same ", b"bytes"], ".jpeg")
+    second = store.put_chunks([b"same bytes"], ".jpeg")
+
+    assert first == second
+    assert MediaStore.digest_of(first) == first.name.split(".")[0]
+    assert list(store.incoming_dir.iterdir()) == []
+
+
+def test_evicts_least_recently_used(tmp_path):
+    store = MediaStore(str(tmp_path), max_bytes=250)
+    old = store.put_chunks([b"a" * 100], ".jpeg")
+    os.utime(old, (1, 1))
+    recent = store.put_chunks([b"b" * 100], ".jpeg")
+    newest = store.put_chunks([b"c" * 100], ".mp4")
+
+    assert not old.exists()
+    assert recent.exists() and newest.exists()
+
+
+def test_put_file_adds_a_second_suffix(tmp_path):
+    store = MediaStore(str(tmp_path), max_bytes=1024)
+    original = store.put_chunks([b"png bytes"], ".jpeg")
+
+    relabelled = store.put_file(original, ".png")
+
+    assert relabelled.name == original.name.replace(".jpeg", ".png")
+    assert relabelled.read_bytes() == b"png bytes"
+    assert original.exists()
+    assert list(store.incoming_dir.iterdir()) == []
+
+
+def test_leased_objects_are_not_evicted(tmp_path):
+    store = MediaStore(str(tmp_path), max_bytes=250)
+    with store.lease() as lease:
+        in_use = store.put_chunks([b"a" * 100], ".jpeg", lease=lease)
+        os.utime(in_use, (1, 1))
+        # Another thread's downloads push the store over its limit before in_use is uploaded
+        older = store.put_chunks([b"b" * 100], ".jpeg")
+        os.utime(older, (2, 2))
+        store.put_chunks([b"c" * 100], ".mp4")
+
+        assert in_use.exists() and not older.exists()
+
+    store.put_chunks([b"d" * 100], ".mp4")
+    assert not in_use.exists()
+
+
+def test_store_is_only_scanned_when_over_its_limit(tmp_path, monkeypatch):
+    store = MediaStore(str(tmp_path), max_bytes=1000)
+    scans = []
+    scan = store._scan
+    monkeypatch.setattr(store, "_scan", lambda: scans.append(1) or scan())
+
+    for i in range(5):
+        store.put_chunks([bytes([i]) * 100], ".jpeg")
+    assert len(scans) == 1
+
+    for i in range(5, 11):
+        store.put_chunks([bytes([i]) * 100], ".jpeg")
+    assert len(scans) == 2
+    assert sum(1 for _ in store.objects_dir.glob("*/*")) == 10
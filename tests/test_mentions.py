@@ -0,0 +1,22 @@
+import json
+
+from instadon.mentions import MentionResolver, find_mentions
+
+
+def test_find_mentions_ignores_email_addresses():
+    text = "Mit @kulturneubau und @anna.maria_. Infos: info@example.org @kulturneubau"
+    assert find_mentions(text) == ["kulturneubau", "anna.maria_"]
+
+
+def test_replace_known_and_learn(tmp_path):
+    names_file = tmp_path / "names.json"
+    names_file.write_text(json.dumps({"@KulturNeubau": "Kultur Neubau"}))
+    resolver = MentionResolver(str(names_file), str(tmp_path / "learned.json"))
+
+    text, unresolved = resolver.replace_known("Danke @kulturneubau und @someone!")
+    assert text == "Danke Kultur Neubau und @someone!"
+    assert unresolved == ["someone"]
+
+    resolver.learn("someone", "Some One")
+    assert MentionResolver(str(names_file), str(tmp_path / "learned.json")).resolve("@SomeOne") == "Some One"
+    assert resolver.replace_known("Danke @someone!") == ("Danke Some One!", [])
@@ -0,0 +1,49 @@
+import json
+import urllib.request
+
+import pytest
+
+from instadon.http_client import redact_headers
+from instadon.metrics import Metrics, MetricsServer
+
+
+def test_spans_and_counters_export_as_json_lines(tmp_path):
+    metrics = Metrics(str(tmp_path / "metrics.jsonl"))
+
+    with metrics.span("upload", instance="example.social"):
+        pass
+    with pytest.raises(RuntimeError):
+        with metrics.span("upload", instance="example.social"):
+            raise RuntimeError("boom")
+    metrics.increment("bytes_uploaded", 1024)
+
+    events = [json.loads(line) for line in (tmp_path / "metrics.jsonl").read_text().splitlines()]
+    assert [(event["type"], event["name"]) for event in events] == \
+        [("span", "upload"), ("span", "upload"), ("counter", "bytes_uploaded")]
+    assert [event["labels"]["outcome"] for event in events[:2]] == ["ok", "error"]
+
+    spans = metrics.snapshot()["spans"]["upload"]
+    assert sorted(span["count"] for span in spans) == [1, 1]
+
+
+def test_prometheus_endpoint():
+    metrics = Metrics()
+    metrics.increment("cache_hits", cache="llm")
+    metrics.observe("download", 0.3)
+
+    server = MetricsServer(metrics, 0, "127.0.0.1").start()
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.port}/metrics") as response:
+            text = response.read().decode("utf-8")
+    finally:
+        server.stop()
+
+    assert 'instadon_cache_hits_total{cache="llm"} 1' in text
+    assert 'instadon_stage_duration_seconds_bucket{stage="download",le="0.25"} 0' in text
+    assert 'instadon_stage_duration_seconds_bucket{stage="download",le="0.5"} 1' in text
+    assert 'instadon_stage_duration_seconds_count{stage="download"} 1' in text
+
+
+def test_redact_headers():
+    headers = {"Authorization": "Bearer secret", "Accept": "application/json"}
+    assert redact_headers(headers) == {"Authorization": "<redacted>", "Accept": "application/json"}
@@ -0,0 +1,31 @@
+from email.parser import BytesParser
+from email.policy import HTTP
+
+from instadon.multipart import MultipartEncoder
+
+
+def test_streams_fields_and_file(tmp_path):
+    media = tmp_path / "photo.jpeg"
+    media.write_bytes(bytes(range(256)) * 100)
+
+    body = MultipartEncoder({"description": "Ein Bild"}, {"file": media}, chunk_size=1000)
+    chunks = []
+    while True:
+        chunk = body.read(8192)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    data = b"".join(chunks)
+    assert len(data) == len(body)
+
+    message = BytesParser(policy=HTTP).parsebytes(
+        f"Content-Type: {body.content_type}\r\n\r\n".encode() + data
+    )
+    parts = {part.get_param("name", header="content-disposition"): part for part in message.iter_parts()}
+    assert parts["description"].get_content() == "Ein Bild"
+    assert parts["file"].get_content_type() == "image/jpeg"
+    assert parts["file"].get_payload(decode=True) == media.read_bytes()
+
+    # Rewinding allows the body to be sent again
+    body.reset()
+    assert body.read() == data
@@ -0,0 +1,51 @@
+import random
+import time
+from pathlib import Path
+
+import pytest
+
+from instadon import pipeline
+from instadon.pipeline import MediaPipeline
+
+
+def fake_download(url, suffix=None, **kwargs):
+    time.sleep(random.uniform(0, 0.02))
+    return Path(f"/nonexistent/{url}")
+
+
+def test_media_ids_keep_item_order(monkeypatch):
+    monkeypatch.setattr(pipeline, "url_to_file", fake_download)
+    items = [(f"item{i}", None) for i in range(10)]
+
+    files, media_ids = MediaPipeline(4, 2).run(items, lambda path: f"id-{path.name}")
+
+    assert [f.name for f in files] == [f"item{i}" for i in range(10)]
+    assert media_ids == [f"id-item{i}" for i in range(10)]
+
+
+def test_failed_upload_cleans_up_downloads(monkeypatch, tmp_path):
+    def download(url, suffix=None, **kwargs):
+        path = tmp_path / url
+        path.write_bytes(b"x")
+        return path
+
+    def upload(path):
+        if path.name == "item2":
+            raise RuntimeError("upload failed")
+        return path.name
+
+    monkeypatch.setattr(pipeline, "url_to_file", download)
+    with pytest.raises(RuntimeError):
+        MediaPipeline(2, 1).run([(f"item{i}", None) for i in range(5)], upload)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_prepared_file_is_uploaded(monkeypatch):
+    monkeypatch.setattr(pipeline, "url_to_file", fake_download)
+    items = [(f"item{i}", None) for i in range(3)]
+
+    files, media_ids = MediaPipeline(2, 1).run(items, lambda path: f"id-{path.name}",
+                                               prepare=lambda path: path.with_suffix(".small"))
+
+    assert [f.name for f in files] == ["item0", "item1", "item2"]
+    assert media_ids == ["id-item0.small", "id-item1.small", "id-item2.small"]
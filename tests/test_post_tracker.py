@@ -0,0 +1,55 @@
+from instadon.post_tracker import PostTracker
+
+
+def test_text_backend_indexes_appended_lines(tmp_path):
+    tracker_file = tmp_path / "posted.txt"
+    tracker_file.write_text("ABC\nDEF\n")
+    tracker = PostTracker(str(tracker_file))
+    assert tracker.backend_name == "text"
+    assert tracker.is_already_posted("ABC")
+    assert not tracker.is_already_posted("XYZ")
+
+    # Another process appends to the log
+    with open(tracker_file, "a") as f:
+        f.write("XYZ\n")
+    assert tracker.is_already_posted_many(["ABC", "XYZ", "NEW"]) == {"ABC", "XYZ"}
+
+    tracker.mark_as_posted("NEW")
+    tracker.mark_as_posted("NEW")
+    assert tracker_file.read_text().splitlines() == ["ABC", "DEF", "XYZ", "NEW"]
+
+
+def test_text_backend_reads_a_last_line_without_newline(tmp_path):
+    tracker_file = tmp_path / "posted.txt"
+    # Hand-edited legacy file
+    tracker_file.write_text("ABC\nDEF")
+    tracker = PostTracker(str(tracker_file))
+    assert tracker.is_already_posted("DEF")
+
+    tracker.mark_as_posted("NEW")
+    assert tracker_file.read_text() == "ABC\nDEF\nNEW\n"
+    assert PostTracker(str(tracker_file)).is_already_posted_many(["ABC", "DEF", "NEW"]) == {"ABC", "DEF", "NEW"}
+
+
+def test_sqlite_backend_and_migration(tmp_path):
+    legacy = tmp_path / "posted.txt"
+    legacy.write_text("ABC\nDEF\nABC\n")
+    tracker = PostTracker(str(tmp_path / "posted.db"))
+    assert tracker.backend_name == "sqlite"
+
+    assert tracker.migrate_from_text(str(legacy)) == 2
+    assert tracker.migrate_from_text(str(legacy)) == 0
+    tracker.mark_as_posted("GHI")
+    assert tracker.is_already_posted_many(["ABC", "GHI", "XYZ"]) == {"ABC", "GHI"}
+    tracker.close()
+
+
+def test_per_account_tracking(tmp_path):
+    tracker = PostTracker(str(tmp_path / "posted.txt"))
+    tracker.mark_as_posted("ABC", "kaffemik@neubau.social")
+    tracker.mark_as_posted("LEGACY")
+
+    assert tracker.is_already_posted("ABC", "kaffemik@neubau.social")
+    assert not tracker.is_already_posted("ABC", "kulturneubau@neubau.social")
+    # Plain entries from older versions apply to every account
+    assert tracker.is_already_posted_many(["ABC", "LEGACY"], "kulturneubau@neubau.social") == {"LEGACY"}
@@ -0,0 +1,120 @@
+import random
+import time
+from datetime import datetime
+
+import pytest
+import requests
+
+from instadon.instagram_cache import CachedPost, post_media
+from instadon.resolver import CobaltEndpoints, MediaResolver
+
+PICKER = {"status": "picker", "picker": [{"type": "photo", "url": "https://cobalt.example/tunnel/1"}]}
+
+
+def make_post(shortcode="ABC123", media=None):
+    return CachedPost(shortcode, "Ein Abend im Neubau", "Foto", datetime(2026, 5, 1), media=media)
+
+
+class RecordingFetch:
+    def __init__(self, answers):
+        # Per endpoint: a result, or an exception to raise
+        self.answers = answers
+        self.calls = []
+
+    def __call__(self, url, cobalt_url, max_retries=None):
+        self.calls.append((cobalt_url, max_retries))
+        answer = self.answers[cobalt_url]
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+
+def test_failover_cools_down_failed_endpoint_and_caches_result(monkeypatch):
+    monkeypatch.setattr(random, "random", lambda: 0.5)
+    endpoints = CobaltEndpoints(["https://a.example/", "https://b.example/"], cooldown=60)
+    resolver = MediaResolver(endpoints, cache_ttl=60, use_post_media=False)
+    fetch = RecordingFetch({"https://a.example/": requests.ConnectionError("refused"), "https://b.example/": PICKER})
+    # a looks faster, so it is asked first
+    endpoints.record_success(endpoints.endpoints[0], 0.1)
+    endpoints.record_success(endpoints.endpoints[1], 5.0)
+
+    assert resolver.resolve(make_post(), fetch) == PICKER
+    assert [url for url, _ in fetch.calls] == ["https://a.example/", "https://b.example/"]
+    # a is not retried while another endpoint is left; the last one gets the usual retries
+    assert [retries for _, retries in fetch.calls] == [0, None]
+    assert [endpoint.url for endpoint in endpoints.order()] == ["https://b.example/", "https://a.example/"]
+
+    # A retry of the same post is answered from the cache
+    assert resolver.resolve(make_post(), fetch) == PICKER
+    assert len(fetch.calls) == 2
+
+
+def test_cobalt_error_for_a_post_does_not_mark_endpoint_down():
+    endpoints = CobaltEndpoints(["https://a.example/", "https://b.example/"])
+    resolver = MediaResolver(endpoints, cache_ttl=0, use_post_media=False)
+    error = {"status": "error", "error": {"code": "error.api.fetch.fail"}}
+    fetch = RecordingFetch({"https://a.example/": error, "https://b.example/": error})
+
+    assert resolver.resolve(make_post(), fetch)["status"] == "error"
+    assert len(fetch.calls) == 2
+    assert all(endpoint.failures == 0 for endpoint in endpoints.endpoints)
+
+
+def test_faster_endpoint_is_preferred():
+    endpoints = CobaltEndpoints(["https://slow.example/", "https://fast.example/"])
+    endpoints.record_success(endpoints.endpoints[0], 2.0)
+    endpoints.record_success(endpoints.endpoints[1], 0.2)
+
+    firsts = [endpoints.order()[0].url for _ in range(500)]
+
+    assert firsts.count("https://fast.example/") > 400
+    assert "https://slow.example/" in firsts
+
+
+def test_post_media_skip_cobalt_unless_expired():
+    resolver = MediaResolver(CobaltEndpoints(["https://a.example/"]), cache_ttl=0, use_post_media=True)
+    fetch = RecordingFetch({"https://a.example/": PICKER})
+    valid = f"https://scontent.cdninstagram.com/v/1.jpg?oe={int(time.time()) + 86400:X}"
+    expired = f"https://scontent.cdninstagram.com/v/1.jpg?oe={int(time.time()) - 60:X}"
+
+    result = resolver.resolve(make_post(media=[{"type": "photo", "url": valid}]), fetch)
+    assert result == {"status": "picker", "picker": [{"type": "photo", "url": valid}]}
+    assert fetch.calls == []
+
+    assert resolver.resolve(make_post(media=[{"type": "photo", "url": expired}]), fetch) == PICKER
+    assert len(fetch.calls) == 1
+
+
+def test_post_media_are_the_last_resort():
+    resolver = MediaResolver(CobaltEndpoints(["https://a.example/"]), cache_ttl=0, use_post_media=False)
+    fetch = RecordingFetch({"https://a.example/": requests.ConnectionError("refused")})
+    post = make_post(media=[{"type": "video", "url": "https://scontent.cdninstagram.com/v/1.mp4"}])
+
+    assert resolver.resolve(post, fetch)["picker"][0]["type"] == "video"
+    with pytest.raises(requests.ConnectionError):
+        resolver.resolve(make_post(), fetch)
+
+
+class FakeInstaloaderPost:
+    def __init__(self, node, full_metadata=None):
+        self._node = node
+        self._full_metadata_dict = full_metadata
+
+
+def test_post_media_reads_sidecar_without_requests():
+    sidecar = {"edge_sidecar_to_children": {"edges": [
+        {"node": {"is_video": False, "display_url": "https://cdn.example/1.jpg"}},
+        {"node": {"is_video": True, "display_url": "https://cdn.example/2.jpg"}},
+    ]}}
+
+    # The feed lacks the video's URL: nothing to download from
+    assert post_media(FakeInstaloaderPost(sidecar)) is None
+
+    sidecar["edge_sidecar_to_children"]["edges"][1]["node"]["video_url"] = "https://cdn.example/2.mp4"
+    assert post_media(FakeInstaloaderPost(sidecar)) == [
+        {"type": "photo", "url": "https://cdn.example/1.jpg"},
+        {"type": "video", "url": "https://cdn.example/2.mp4"},
+    ]
+    assert post_media(FakeInstaloaderPost({"display_url": "https://cdn.example/3.jpg", "is_video": False})) == [
+        {"type": "photo", "url": "https://cdn.example/3.jpg"},
+    ]
@@ -0,0 +1,84 @@
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+from instadon.media_store import MediaStore
+from instadon.scratch import ScratchArea
+
+
+def test_failed_download_leaves_nothing_behind(tmp_path):
+    store = MediaStore(str(tmp_path))
+    store.scratch.spool_bytes = 4
+
+    def broken_stream():
+        yield b"first chunk"
+        raise ConnectionError("reset by peer")
+
+    with pytest.raises(ConnectionError):
+        store.put_chunks(broken_stream(), ".mp4")
+
+    assert list(store.incoming_dir.iterdir()) == []
+    assert store.scratch.used == 0
+
+
+def test_small_files_stay_in_memory_until_committed(tmp_path):
+    area = ScratchArea(str(tmp_path / "incoming"), spool_bytes=100)
+
+    with area.file(".jpeg") as f:
+        f.write(b"small image")
+        assert list(area.root.iterdir()) == []
+        dest = f.commit(tmp_path / "image.jpeg")
+
+    assert dest.read_bytes() == b"small image"
+    assert list(area.root.iterdir()) == []
+
+
+def test_downloads_wait_while_the_quota_is_used_up(tmp_path):
+    area = ScratchArea(str(tmp_path / "incoming"), max_bytes=100, spool_bytes=0)
+    first = area.file(".mp4", expected_size=80)
+    first.write(b"x" * 10)
+    assert area.used == 80
+
+    started = threading.Event()
+    written = threading.Event()
+
+    def second_download():
+        with area.file(".mp4", expected_size=50) as f:
+            started.set()
+            f.write(b"y" * 10)
+            written.set()
+
+    worker = threading.Thread(target=second_download)
+    worker.start()
+    started.wait(1)
+    assert not written.wait(0.2)
+
+    first.close()
+    assert written.wait(1)
+    worker.join()
+    assert area.used == 0
+    assert list(area.root.iterdir()) == []
+
+
+def test_sweep_removes_files_of_finished_processes(tmp_path):
+    incoming = tmp_path / "incoming"
+    incoming.mkdir()
+    area = ScratchArea(str(incoming), orphan_age=3600)
+    finished = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"],
+                              capture_output=True, text=True).stdout.strip()
+    orphan = incoming / f"{finished}~{area.host}~abc.mp4"
+    live = incoming / f"{os.getpid()}~{area.host}~def.mp4"
+    other_host = incoming / f"{finished}~elsewhere~ghi.mp4"
+    stale = incoming / "tmp1234.jpeg"
+    for path in (orphan, live, other_host, stale):
+        path.write_bytes(b"partial")
+    os.utime(stale, (1, 1))
+
+    assert area.sweep() == 2
+
+    assert not orphan.exists() and not stale.exists()
+    # Another host's process may still be writing it
+    assert live.exists() and other_host.exists()
@@ -0,0 +1,7 @@
+from benchmarks.startup import DEFERRED_MODULES, measure
+
+
+def test_cli_startup_defers_heavy_imports():
+    loaded = {module for module, _, _ in measure()}
+    assert "instadon.core" in loaded
+    assert not loaded & set(DEFERRED_MODULES)
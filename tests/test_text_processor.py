@@ -0,0 +1,67 @@
+import json
+from types import SimpleNamespace
+
+from instadon.budget import RequestBudget
+from instadon.llm_cache import LLMCache
+from instadon.mentions import MentionResolver
+from instadon.text_processor import MENTIONS_BATCH_PROMPT, TextProcessor, parse_batch_response
+
+
+class FakeCompletions:
+    """Answers batched prompts with every item's mentions replaced, except the ids in drop."""
+
+    def __init__(self, drop=(), fail_batches=False):
+        self.drop = set(drop)
+        self.fail_batches = fail_batches
+        self.prompts = []
+
+    def create(self, model, messages, max_tokens, temperature):
+        prompt = messages[0]["content"]
+        self.prompts.append(prompt)
+        if prompt.startswith(MENTIONS_BATCH_PROMPT[:40]):
+            if self.fail_batches:
+                raise RuntimeError("service unavailable")
+            items = json.loads(prompt[prompt.index("\n\n[") + 2:])
+            content = json.dumps([{"id": item["id"], "text": item["text"].replace("@", "")}
+                                  for item in items if item["id"] not in self.drop])
+        elif prompt.startswith("Please summarize"):
+            content = "Kurz."
+        else:
+            content = prompt.split("\n\n")[-2].replace("@", "")
+        return SimpleNamespace(choices=[SimpleNamespace(finish_reason="stop",
+                                                        message=SimpleNamespace(content=content))])
+
+
+def make_processor(tmp_path, completions, cache=None):
+    processor = TextProcessor(cache=cache, mentions=MentionResolver(str(tmp_path / "names.json"),
+                                                                    str(tmp_path / "learned.json")))
+    processor.budget = RequestBudget(rate_per_hour=3600 * 1000, burst=100, name="LLM")
+    processor._client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    return processor
+
+
+def test_process_many_packs_short_captions(tmp_path):
+    completions = FakeCompletions(drop={1})
+    cache = LLMCache(str(tmp_path / "llm"))
+    processor = make_processor(tmp_path, completions, cache)
+    texts = ["Mit @anna", "Mit @ben", "Ohne Erwähnung", "", "Lang " * 200, "Mit @carla"]
+
+    results = processor.process_many(texts, max_chars=500)
+
+    assert results == ["Mit anna", "Mit ben", "Ohne Erwähnung", "", "Kurz.", "Mit carla"]
+    # One packed request, the caption it left out retried alone, and the summary
+    assert len(completions.prompts) == 3
+    # Packed answers are cached like single ones
+    assert processor.summarize_if_needed("Mit @carla", 500) == "Mit carla"
+    assert len(completions.prompts) == 3
+
+
+def test_failed_pack_falls_back_to_original_texts(tmp_path):
+    processor = make_processor(tmp_path, FakeCompletions(fail_batches=True))
+
+    assert processor.process_many(["Mit @anna", "Mit @ben"]) == ["Mit @anna", "Mit @ben"]
+
+
+def test_parse_batch_response_skips_malformed_items():
+    content = 'Sure!\n[{"id": 0, "text": "a"}, {"id": "x", "text": "b"}, {"id": 2}, {"id": 3, "text": " c "}]'
+    assert parse_batch_response(content) == {0: "a", 3: "c"}
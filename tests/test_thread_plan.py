@@ -0,0 +1,64 @@
+import threading
+from concurrent.futures import Future
+
+from instadon.instance import InstanceCapabilities
+from instadon.mastodon import MastodonClient
+from instadon.thread_plan import plan_thread, status_length
+
+
+def test_plan_chunks_media_with_markers():
+    parts = plan_thread("Ein Abend im Neubau", 10, "public", InstanceCapabilities())
+
+    assert [(part.media_start, part.media_end) for part in parts] == [(0, 4), (4, 8), (8, 10)]
+    assert [part.status for part in parts] == ["Ein Abend im Neubau", "(2/3)", "(3/3)"]
+    assert [part.visibility for part in parts] == ["public", "unlisted", "unlisted"]
+    assert [part.reply for part in parts] == [False, True, True]
+
+
+def test_plan_continues_long_text_in_replies():
+    capabilities = InstanceCapabilities({"statuses": {"max_characters": 60}})
+    text = "Heute Abend Lesung und Musik im Neubau, mehr unter https://example.org/" + "x" * 80 + " " + "Wort " * 12
+
+    parts = plan_thread(text, 1, "public", capabilities)
+
+    assert len(parts) > 1
+    assert all(status_length(part.status, 23) <= 60 for part in parts)
+    # The long URL counts as 23 characters and stays whole
+    assert "https://example.org/" + "x" * 80 in parts[1].status
+    assert parts[1].status.startswith(f"(2/{len(parts)})\n\n")
+    assert (parts[0].media_start, parts[0].media_end) == (0, 1)
+    assert all(part.media_start == part.media_end for part in parts[1:])
+
+
+class RecordingMastodon(MastodonClient):
+    capabilities = InstanceCapabilities()
+
+    def __init__(self):
+        self.statuses = []
+
+    def create_post(self, status, media_ids, visibility="public", in_reply_to_id=None):
+        post = {"id": f"status-{len(self.statuses) + 1}", "media_ids": media_ids, "in_reply_to_id": in_reply_to_id}
+        self.statuses.append(post)
+        return post
+
+
+def test_thread_parts_are_posted_as_their_media_finish_uploading():
+    mastodon = RecordingMastodon()
+    media = [Future() for _ in range(6)]
+    for i in range(4):
+        media[i].set_result(f"media-{i}")
+
+    def finish_uploads():
+        # The first part goes out while the last two items are still uploading
+        while not mastodon.statuses:
+            threading.Event().wait(0.01)
+        for i in (4, 5):
+            media[i].set_result(f"media-{i}")
+
+    uploader = threading.Thread(target=finish_uploads)
+    uploader.start()
+    posts = mastodon.create_post_thread("Status", media)
+    uploader.join()
+
+    assert [post["media_ids"] for post in posts] == [[f"media-{i}" for i in range(4)], ["media-4", "media-5"]]
+    assert posts[1]["in_reply_to_id"] == "status-1"
@@ -0,0 +1,64 @@
+import pytest
+
+from instadon.media_store import MediaStore
+from instadon.transcode import MediaTranscoder, sniff_format
+
+
+@pytest.mark.parametrize("head, expected", [
+    (b"\xff\xd8\xff\xe0\x00\x10JFIF", ("image", "image/jpeg", ".jpeg")),
+    (b"\x89PNG\r\n\x1a\n\x00\x00", ("image", "image/png", ".png")),
+    (b"RIFF\x00\x00\x00\x00WEBPVP8 ", ("image", "image/webp", ".webp")),
+    (b"\x00\x00\x00\x18ftypheic\x00\x00", ("image", "image/heic", ".heic")),
+    (b"\x00\x00\x00\x18ftypisom\x00\x00", ("video", "video/mp4", ".mp4")),
+    (b"\x00\x00\x00\x14ftypqt  \x00\x00", ("video", "video/quicktime", ".mov")),
+    (b"not media at all", None),
+])
+def test_sniff_format(tmp_path, head, expected):
+    path = tmp_path / "file.bin"
+    path.write_bytes(head + b"\x00" * 16)
+    assert sniff_format(path) == expected
+
+
+def test_mislabelled_file_is_relabelled(tmp_path):
+    store = MediaStore(str(tmp_path / "store"))
+    original = store.put_chunks([b"RIFF\x00\x00\x00\x00WEBPVP8 " + b"\x00" * 32], ".jpeg")
+
+    prepared = MediaTranscoder(store=store).prepare(original)
+
+    assert prepared.suffix == ".webp"
+    assert MediaStore.digest_of(prepared) == MediaStore.digest_of(original)
+    assert original.exists()
+
+
+def test_oversized_image_is_downscaled(tmp_path):
+    Image = pytest.importorskip("PIL.Image")
+    store = MediaStore(str(tmp_path / "store"))
+    source = tmp_path / "photo.jpeg"
+    Image.new("RGB", (400, 300), "red").save(source, "JPEG")
+
+    transcoder = MediaTranscoder(max_workers=1, store=store)
+    try:
+        prepared = transcoder.prepare(source, {"image_matrix_limit": 100 * 100})
+        # Same source and limits: reused rather than transcoded again
+        assert transcoder.prepare(source, {"image_matrix_limit": 100 * 100}) == prepared
+        assert transcoder.prepare(source, {}) == source
+    finally:
+        transcoder.close()
+
+    with Image.open(prepared) as image:
+        assert image.size[0] * image.size[1] <= 100 * 100
+        assert image.size[0] / image.size[1] == pytest.approx(4 / 3, rel=0.05)
+
+
+@pytest.mark.parametrize("pillow, ffmpeg, enabled", [
+    (None, None, "0"),
+    ("PIL", None, "1"),
+    (None, "/usr/bin/ffmpeg", "1"),
+])
+def test_transcoding_is_on_by_default_only_with_a_tool_for_it(monkeypatch, pillow, ffmpeg, enabled):
+    from instadon import config
+
+    monkeypatch.setattr(config, "find_spec", lambda name: pillow)
+    monkeypatch.setattr(config.shutil, "which", lambda name: ffmpeg)
+
+    assert config._transcode_default() == enabled